@@ -0,0 +1,227 @@
+# armazem.py
+# Histórico de execuções em SQLite (results/armazem.sqlite): cada run com seus metadados e
+# resultados, indexados por run, modelo e pergunta para comparações entre execuções.
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+ARQUIVO_ARMAZEM = os.path.join("results", "armazem.sqlite")
+
+METRICAS = ["faithfulness", "answer_relevancy", "context_precision", "rouge_1_f1", "rouge_2_f1", "bertscore_f1"]
+CAMPOS_NUMERICOS = ["num_contextos", "tempo_geracao_queries", "tempo_resposta", "tokens_resposta"]
+
+ESQUEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    iniciado_em REAL NOT NULL,
+    concluido_em REAL,
+    modelos TEXT NOT NULL,
+    modo_contexto TEXT,
+    num_queries INTEGER,
+    hash_prompt_queries TEXT,
+    hash_prompt_resposta TEXT,
+    num_perguntas INTEGER,
+    config TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_iniciado_em ON runs (iniciado_em);
+
+CREATE TABLE IF NOT EXISTS textos (
+    hash TEXT PRIMARY KEY,
+    texto TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS resultados (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    modelo TEXT NOT NULL,
+    hash_pergunta TEXT NOT NULL,
+    resposta TEXT,
+    queries_geradas TEXT,
+    issues TEXT,
+    {", ".join(f"{c} REAL" for c in CAMPOS_NUMERICOS + METRICAS)},
+    PRIMARY KEY (run_id, modelo, hash_pergunta)
+);
+CREATE INDEX IF NOT EXISTS idx_resultados_modelo ON resultados (modelo, run_id);
+CREATE INDEX IF NOT EXISTS idx_resultados_pergunta ON resultados (hash_pergunta, modelo);
+
+-- Médias por (modelo, run), gravadas junto com o run: consultas de tendência não tocam em resultados
+CREATE TABLE IF NOT EXISTS medias_por_run (
+    modelo TEXT NOT NULL,
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    iniciado_em REAL NOT NULL,
+    avaliacoes INTEGER NOT NULL,
+    {", ".join(f"{c} REAL" for c in METRICAS + ["tempo_resposta"])},
+    PRIMARY KEY (modelo, run_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_medias_run ON medias_por_run (run_id);
+"""
+
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256((texto or "").encode("utf-8")).hexdigest()[:16]
+
+
+def novo_run_id() -> str:
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def conectar(caminho: str = ARQUIVO_ARMAZEM) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    conexao = sqlite3.connect(caminho)
+    conexao.row_factory = sqlite3.Row
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.execute("PRAGMA synchronous=NORMAL")
+    conexao.executescript(ESQUEMA)
+    return conexao
+
+
+def registrar_run(resultados: list, metadados: dict = None, caminho: str = ARQUIVO_ARMAZEM) -> str:
+    """Grava um run e seus resultados em uma única transação. Retorna o run_id.
+
+    metadados (opcionais): run_id, iniciado_em, modelos, modo_contexto, num_queries, system_prompts
+    ({"queries", "resposta"}) e config (demais opções, gravadas como JSON).
+    """
+    metadados = metadados or {}
+    run_id = metadados.get("run_id") or novo_run_id()
+    iniciado_em = metadados.get("iniciado_em") or time.time()
+    modelos = metadados.get("modelos") or sorted({r["modelo"] for r in resultados})
+    prompts = metadados.get("system_prompts") or {}
+    if not prompts and resultados:
+        prompts = {"queries": resultados[0].get("system_prompt_queries"), "resposta": resultados[0].get("system_prompt_resposta")}
+    perguntas = {r["pergunta"] for r in resultados}
+
+    textos = {hash_texto(t): t for t in list(perguntas) + [prompts.get("queries"), prompts.get("resposta")] if t}
+    linhas = []
+    for r in resultados:
+        linhas.append((
+            run_id, r["modelo"], hash_texto(r["pergunta"]), r.get("resposta"),
+            json.dumps(r.get("queries_geradas", []), ensure_ascii=False),
+            json.dumps(r.get("issues", []), ensure_ascii=False),
+            *[r.get(c) for c in CAMPOS_NUMERICOS + METRICAS],
+        ))
+
+    colunas = ["run_id", "modelo", "hash_pergunta", "resposta", "queries_geradas", "issues"] + CAMPOS_NUMERICOS + METRICAS
+    conexao = conectar(caminho)
+    try:
+        with conexao:
+            conexao.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, iniciado_em, time.time(), json.dumps(modelos), metadados.get("modo_contexto"),
+                 metadados.get("num_queries"), hash_texto(prompts["queries"]) if prompts.get("queries") else None,
+                 hash_texto(prompts["resposta"]) if prompts.get("resposta") else None, len(perguntas),
+                 json.dumps(metadados.get("config") or {}, ensure_ascii=False, default=str)),
+            )
+            conexao.executemany("INSERT OR IGNORE INTO textos VALUES (?, ?)", textos.items())
+            conexao.executemany(
+                f"INSERT OR REPLACE INTO resultados ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})",
+                linhas,
+            )
+            medias = ", ".join(f"AVG({c})" for c in METRICAS + ["tempo_resposta"])
+            conexao.execute(
+                f"INSERT OR REPLACE INTO medias_por_run SELECT modelo, run_id, ?, COUNT(*), {medias} "
+                "FROM resultados WHERE run_id = ? GROUP BY modelo",
+                (iniciado_em, run_id),
+            )
+    finally:
+        conexao.close()
+    print(f"[INFO] Run {run_id} registrado em {caminho} ({len(linhas)} resultados)")
+    return run_id
+
+
+def _consultar(sql: str, parametros=(), caminho: str = ARQUIVO_ARMAZEM) -> list:
+    conexao = conectar(caminho)
+    try:
+        return [dict(linha) for linha in conexao.execute(sql, parametros)]
+    finally:
+        conexao.close()
+
+
+def _validar_metrica(metrica: str):
+    if metrica not in METRICAS + ["tempo_resposta"]:
+        raise ValueError(f"Métrica desconhecida: {metrica}")
+
+
+def listar_runs(limite: int = 20, caminho: str = ARQUIVO_ARMAZEM) -> list:
+    runs = _consultar("SELECT * FROM runs ORDER BY iniciado_em DESC LIMIT ?", (limite,), caminho)
+    for run in runs:
+        run["modelos"] = json.loads(run["modelos"])
+        run["config"] = json.loads(run["config"] or "{}")
+    return runs
+
+
+def tendencia_modelo(modelo: str, metrica: str = "faithfulness", limite: int = 100, caminho: str = ARQUIVO_ARMAZEM) -> list:
+    """Média da métrica do modelo nos últimos runs, do mais antigo para o mais recente."""
+    _validar_metrica(metrica)
+    linhas = _consultar(
+        f"SELECT run_id, iniciado_em, avaliacoes, {metrica} AS media FROM medias_por_run "
+        "WHERE modelo = ? ORDER BY iniciado_em DESC LIMIT ?",
+        (modelo, limite), caminho,
+    )
+    return linhas[::-1]
+
+
+def comparar_runs(run_a: str, run_b: str, caminho: str = ARQUIVO_ARMAZEM) -> dict:
+    """{modelo: {metrica: (media_a, media_b)}} para os modelos presentes em algum dos dois runs."""
+    linhas = _consultar("SELECT * FROM medias_por_run WHERE run_id IN (?, ?)", (run_a, run_b), caminho)
+    comparacao = {}
+    for linha in linhas:
+        por_metrica = comparacao.setdefault(linha["modelo"], {m: [None, None] for m in METRICAS})
+        lado = 0 if linha["run_id"] == run_a else 1
+        for metrica in METRICAS:
+            por_metrica[metrica][lado] = linha[metrica]
+    return {modelo: {m: tuple(v) for m, v in metricas.items()} for modelo, metricas in comparacao.items()}
+
+
+def historico_pergunta(pergunta: str, modelo: str = None, caminho: str = ARQUIVO_ARMAZEM) -> list:
+    """Resultados de uma pergunta (texto exato) em todos os runs, opcionalmente de um só modelo."""
+    sql = (f"SELECT r.run_id, runs.iniciado_em, r.modelo, {', '.join('r.' + m for m in METRICAS)}, r.tempo_resposta "
+           "FROM resultados r JOIN runs USING (run_id) WHERE r.hash_pergunta = ?")
+    parametros = [hash_texto(pergunta)]
+    if modelo:
+        sql += " AND r.modelo = ?"
+        parametros.append(modelo)
+    return _consultar(sql + " ORDER BY runs.iniciado_em", parametros, caminho)
+
+
+def obter_texto(hash_: str, caminho: str = ARQUIVO_ARMAZEM):
+    linhas = _consultar("SELECT texto FROM textos WHERE hash = ?", (hash_,), caminho)
+    return linhas[0]["texto"] if linhas else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultas ao histórico de execuções (results/armazem.sqlite).")
+    parser.add_argument('--arquivo', default=ARQUIVO_ARMAZEM, help='Arquivo SQLite do armazém')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    p_runs = sub.add_parser('runs', help='Lista os runs mais recentes')
+    p_runs.add_argument('--limite', type=int, default=20)
+    p_tend = sub.add_parser('tendencia', help='Média de uma métrica do modelo ao longo dos runs')
+    p_tend.add_argument('modelo')
+    p_tend.add_argument('--metrica', default='faithfulness', choices=METRICAS + ['tempo_resposta'])
+    p_tend.add_argument('--limite', type=int, default=100)
+    p_comp = sub.add_parser('comparar', help='Compara as médias por modelo de dois runs')
+    p_comp.add_argument('run_a')
+    p_comp.add_argument('run_b')
+    args = parser.parse_args()
+
+    if args.comando == 'runs':
+        for run in listar_runs(args.limite, args.arquivo):
+            inicio = time.strftime('%Y-%m-%d %H:%M', time.localtime(run['iniciado_em']))
+            print(f"{run['run_id']:<24} {inicio}  {run['num_perguntas']:>4} perguntas  {run['modo_contexto'] or '-':<8} "
+                  f"prompts {run['hash_prompt_queries'] or '-'}/{run['hash_prompt_resposta'] or '-'}  {', '.join(run['modelos'])}")
+    elif args.comando == 'tendencia':
+        for linha in tendencia_modelo(args.modelo, args.metrica, args.limite, args.arquivo):
+            inicio = time.strftime('%Y-%m-%d %H:%M', time.localtime(linha['iniciado_em']))
+            print(f"{linha['run_id']:<24} {inicio}  n={linha['avaliacoes']:<4} {args.metrica}={linha['media']:.3f}")
+    elif args.comando == 'comparar':
+        for modelo, metricas in comparar_runs(args.run_a, args.run_b, args.arquivo).items():
+            print(modelo)
+            for metrica, (a, b) in metricas.items():
+                formatar = lambda v: f"{v:.3f}" if v is not None else "  -  "
+                print(f"  {metrica:<18} {formatar(a)}  ->  {formatar(b)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# benchmark_contexto.py
+# Compara o tamanho do contexto enviado no prompt de resposta: json.dumps (formato antigo)
+# versus a serialização compacta de contexto.py, usando as perguntas da avaliação rápida.
+import argparse
+import json
+import os
+
+from retriever import buscar_lexml
+from contexto import serializar_contexto
+from run import MOCK_PERGUNTAS
+
+
+def contar_tokens_fn():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return (lambda texto: len(encoding.encode(texto))), "tiktoken/cl100k_base"
+    except Exception:
+        # Aproximação usual de ~4 caracteres por token
+        return (lambda texto: len(texto) // 4), "aproximação chars/4"
+
+
+def medir(texto: str, contar_tokens):
+    return {
+        "chars": len(texto),
+        "bytes_utf8": len(texto.encode("utf-8")),
+        "tokens": contar_tokens(texto),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede a economia de prompt da serialização compacta de contexto.")
+    parser.add_argument('--quantidade', type=int, default=10, help='Documentos buscados na LexML por pergunta')
+    parser.add_argument('--saida', type=str, default='results/benchmark_contexto.json', help='Arquivo JSON com as medições')
+    args = parser.parse_args()
+
+    contar_tokens, tokenizador = contar_tokens_fn()
+    print(f"[INFO] Contagem de tokens: {tokenizador}")
+
+    medicoes = []
+    for pergunta in MOCK_PERGUNTAS:
+        documentos = buscar_lexml(pergunta, quantidade=args.quantidade)
+        antigo = medir(json.dumps(documentos), contar_tokens)
+        novo = medir(serializar_contexto(documentos), contar_tokens)
+        medicoes.append({"pergunta": pergunta, "num_documentos": len(documentos), "json_dumps": antigo, "compacto": novo})
+
+    print(f"\n{'Pergunta':<50} {'Docs':>5} {'Chars antigo':>13} {'Chars novo':>11} {'Tokens antigo':>14} {'Tokens novo':>12} {'Economia':>9}")
+    for m in medicoes:
+        economia = 1 - m["compacto"]["tokens"] / m["json_dumps"]["tokens"] if m["json_dumps"]["tokens"] else 0.0
+        print(f"{m['pergunta'][:50]:<50} {m['num_documentos']:>5} {m['json_dumps']['chars']:>13} {m['compacto']['chars']:>11} "
+              f"{m['json_dumps']['tokens']:>14} {m['compacto']['tokens']:>12} {economia:>8.1%}")
+
+    total_antigo = {k: sum(m["json_dumps"][k] for m in medicoes) for k in ("chars", "bytes_utf8", "tokens")}
+    total_novo = {k: sum(m["compacto"][k] for m in medicoes) for k in ("chars", "bytes_utf8", "tokens")}
+    print("\nTotais:")
+    for k in ("chars", "bytes_utf8", "tokens"):
+        economia = 1 - total_novo[k] / total_antigo[k] if total_antigo[k] else 0.0
+        print(f"  {k:<11} antigo={total_antigo[k]:>9} novo={total_novo[k]:>9} economia={economia:.1%}")
+
+    os.makedirs(os.path.dirname(args.saida) or ".", exist_ok=True)
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump({"tokenizador": tokenizador, "medicoes": medicoes, "total_json_dumps": total_antigo, "total_compacto": total_novo},
+                  f, ensure_ascii=False, indent=2)
+    print(f"[INFO] Medições salvas em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
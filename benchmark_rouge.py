@@ -0,0 +1,89 @@
+# benchmark_rouge.py
+# Vazão do ROUGE em português (rouge_pt.py) comparada ao rouge_score do jeito que a avaliação usava
+# (um RougeScorer com stemmer Porter por resposta). As respostas sintéticas misturam frases e palavras
+# das referências da avaliação rápida, para que haja sobreposição parcial de n-gramas.
+import argparse
+import json
+import os
+import random
+import time
+
+import rouge_pt
+from run import MOCK_GROUND_TRUTHS
+
+
+def gerar_respostas(referencias: list, respostas_por_referencia: int, rng: random.Random) -> list:
+    """[(referencia, [respostas])]: cada resposta tem trechos da referência, de outras referências e palavras embaralhadas."""
+    palavras = " ".join(referencias).split()
+    casos = []
+    for referencia in referencias:
+        respostas = []
+        for _ in range(respostas_por_referencia):
+            trechos = [referencia, rng.choice(referencias), " ".join(rng.sample(palavras, 40))]
+            rng.shuffle(trechos)
+            respostas.append(" ".join(trechos) * rng.randint(1, 4))
+        casos.append((referencia, respostas))
+    return casos
+
+
+def medir(funcao, casos: list, repeticoes: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(repeticoes):
+        for referencia, respostas in casos:
+            funcao(referencia, respostas)
+    duracao = time.perf_counter() - start
+    total = repeticoes * sum(len(respostas) for _, respostas in casos)
+    return {"respostas": total, "segundos": duracao, "respostas_por_segundo": total / duracao if duracao else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede a vazão do ROUGE em português contra o rouge_score.")
+    parser.add_argument('--respostas_por_referencia', type=int, default=8, help='Respostas (modelos) comparadas a cada referência')
+    parser.add_argument('--repeticoes', type=int, default=20, help='Vezes que o conjunto de perguntas é avaliado')
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--saida', type=str, default='results/benchmark_rouge.json', help='Arquivo JSON com as medições')
+    args = parser.parse_args()
+
+    casos = gerar_respostas(MOCK_GROUND_TRUTHS, args.respostas_por_referencia, random.Random(args.semente))
+    medicoes = {}
+
+    try:
+        from rouge_score import rouge_scorer
+
+        def rouge_score_por_resposta(referencia, respostas):
+            # Como metrics.avaliar_respostas fazia: um scorer novo (e a referência reprocessada) por modelo
+            for resposta in respostas:
+                rouge_scorer.RougeScorer(['rouge1', 'rouge2'], use_stemmer=True).score(referencia, resposta)
+
+        scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2'], use_stemmer=True)
+
+        def rouge_score_scorer_unico(referencia, respostas):
+            for resposta in respostas:
+                scorer.score(referencia, resposta)
+
+        medicoes["rouge_score_por_resposta"] = medir(rouge_score_por_resposta, casos, args.repeticoes)
+        medicoes["rouge_score_scorer_unico"] = medir(rouge_score_scorer_unico, casos, args.repeticoes)
+    except ImportError:
+        print("[WARN] rouge_score não instalado - medindo apenas rouge_pt")
+
+    # Primeira passada com caches vazios (stems e referências), depois com os caches já preenchidos
+    rouge_pt.stem.cache_clear()
+    rouge_pt.preparar_referencia.cache_clear()
+    medicoes["rouge_pt_cache_frio"] = medir(rouge_pt.pontuar_lote, casos, 1)
+    medicoes["rouge_pt"] = medir(rouge_pt.pontuar_lote, casos, args.repeticoes)
+
+    base = medicoes.get("rouge_score_por_resposta", {}).get("respostas_por_segundo")
+    print(f"\n{'Implementação':<28} {'Respostas':>10} {'Segundos':>9} {'Resp./s':>10} {'Ganho':>7}")
+    for nome, m in medicoes.items():
+        ganho = f"{m['respostas_por_segundo'] / base:.1f}x" if base and m["respostas_por_segundo"] else "-"
+        print(f"{nome:<28} {m['respostas']:>10} {m['segundos']:>9.3f} {m['respostas_por_segundo']:>10.0f} {ganho:>7}")
+
+    os.makedirs(os.path.dirname(args.saida) or ".", exist_ok=True)
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump({"respostas_por_referencia": args.respostas_por_referencia, "repeticoes": args.repeticoes, "medicoes": medicoes},
+                  f, ensure_ascii=False, indent=2)
+    print(f"[INFO] Medições salvas em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
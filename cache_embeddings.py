@@ -0,0 +1,131 @@
+# cache_embeddings.py
+# Cache em disco dos embeddings da avaliação (answer relevancy do ragas e fallback do BERTScore),
+# com chave (modelo, hash do texto). Cada modelo tem um arquivo de registros de tamanho fixo
+# (hash + vetor float32), lido por memmap; o índice hash -> linha é montado ao abrir o cache e
+# atualizado quando o arquivo cresce. Registros só são acrescentados, nunca reescritos.
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import estatisticas
+
+DIR_CACHE_EMBEDDINGS = os.path.join("cache", "embeddings")
+
+
+def _hash(texto: str) -> bytes:
+    # Hex (sem bytes nulos): o tipo "S" do numpy descarta nulos no fim da string
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32].encode("ascii")
+
+
+class CacheEmbeddings:
+    """Vetores de um modelo de embeddings em cache/embeddings/<modelo>/vetores.bin."""
+
+    def __init__(self, modelo: str, diretorio: str = DIR_CACHE_EMBEDDINGS):
+        self.modelo = modelo
+        self.diretorio = os.path.join(diretorio, re.sub(r"[^A-Za-z0-9_.-]+", "_", modelo))
+        self.caminho_vetores = os.path.join(self.diretorio, "vetores.bin")
+        self.caminho_meta = os.path.join(self.diretorio, "meta.json")
+        self.dimensao = None
+        self.acertos = 0
+        self.faltas = 0
+        self._lock = threading.Lock()
+        self._tipo = None
+        self._registros = None
+        self._lidos = 0
+        self._indice = {}
+        try:
+            with open(self.caminho_meta, "r", encoding="utf-8") as f:
+                self._definir_dimensao(json.load(f)["dimensao"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _definir_dimensao(self, dimensao: int):
+        self.dimensao = dimensao
+        self._tipo = np.dtype([("hash", "S32"), ("vetor", "<f4", (dimensao,))])
+
+    def _sincronizar(self):
+        """Remapeia o arquivo se ele cresceu (inclusive por outro processo) e indexa os registros novos."""
+        if self._tipo is None:
+            return
+        try:
+            total = os.path.getsize(self.caminho_vetores) // self._tipo.itemsize
+        except OSError:
+            return
+        if total == self._lidos:
+            return
+        self._registros = np.memmap(self.caminho_vetores, dtype=self._tipo, mode="r", shape=(total,))
+        for linha, chave in enumerate(self._registros["hash"][self._lidos:].tolist(), self._lidos):
+            self._indice.setdefault(chave, linha)
+        self._lidos = total
+
+    def buscar(self, textos: list) -> list:
+        """Vetor de cada texto (lista de floats) ou None quando ainda não está no cache."""
+        with self._lock:
+            self._sincronizar()
+            linhas = [self._indice.get(_hash(texto)) for texto in textos]
+            vetores = [self._registros["vetor"][linha].tolist() if linha is not None else None for linha in linhas]
+            acertos = sum(linha is not None for linha in linhas)
+            self.acertos += acertos
+            self.faltas += len(textos) - acertos
+        estatisticas.registrar("embeddings_cache_acertos", acertos)
+        estatisticas.registrar("embeddings_cache_faltas", len(textos) - acertos)
+        return vetores
+
+    def gravar(self, textos: list, vetores: list):
+        if not textos:
+            return
+        matriz = np.asarray(vetores, dtype="<f4")
+        with self._lock:
+            try:
+                if self._tipo is None:
+                    os.makedirs(self.diretorio, exist_ok=True)
+                    self._definir_dimensao(matriz.shape[1])
+                    with open(self.caminho_meta, "w", encoding="utf-8") as f:
+                        json.dump({"modelo": self.modelo, "dimensao": self.dimensao}, f)
+                if matriz.ndim != 2 or matriz.shape[1] != self.dimensao:
+                    print(f"[WARN] Embeddings com dimensão {matriz.shape[-1]} não cabem no cache de {self.modelo} ({self.dimensao})")
+                    return
+                registros = np.empty(len(textos), dtype=self._tipo)
+                registros["hash"] = [_hash(texto) for texto in textos]
+                registros["vetor"] = matriz
+                # Uma única escrita em modo append por lote: processos concorrentes não intercalam registros
+                with open(self.caminho_vetores, "ab") as f:
+                    f.write(registros.tobytes())
+            except OSError as e:
+                print(f"[WARN] Não foi possível gravar embeddings em cache: {e}")
+
+    def taxa_acerto(self) -> float:
+        total = self.acertos + self.faltas
+        return self.acertos / total if total else 0.0
+
+
+class EmbeddingsComCache(Embeddings):
+    """Embeddings do LangChain que consultam o cache antes de calcular; só textos inéditos vão ao modelo.
+
+    embed_query usa o mesmo cache que embed_documents: no HuggingFaceEmbeddings (sentence-transformers)
+    as duas codificações são idênticas.
+    """
+
+    def __init__(self, base: Embeddings, modelo: str = None, diretorio: str = DIR_CACHE_EMBEDDINGS):
+        self.base = base
+        self.cache = CacheEmbeddings(modelo or getattr(base, "model_name", type(base).__name__), diretorio)
+
+    def embed_documents(self, texts: list) -> list:
+        vetores = self.cache.buscar(texts)
+        faltantes = [i for i, vetor in enumerate(vetores) if vetor is None]
+        if faltantes:
+            ineditos = list(dict.fromkeys(texts[i] for i in faltantes))
+            novos = self.base.embed_documents(ineditos)
+            self.cache.gravar(ineditos, novos)
+            por_texto = dict(zip(ineditos, novos))
+            for i in faltantes:
+                vetores[i] = list(por_texto[texts[i]])
+        return vetores
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,126 @@
+# calibrar_juiz_local.py
+# Compara o juiz local (NLI na CPU, juiz_local.py) com o juiz LLM do ragas nas mesmas respostas e
+# contextos: correlação, erro absoluto, concordância no limiar de 0.5 e ordem dos modelos.
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from contexto import formatar_documento
+from main import SYSTEM_PROMPTS_PADRAO
+from metrics import avaliar_respostas, criar_juiz_llm, gerar_ground_truth
+from models import consultar_modelos
+from run import MOCK_PERGUNTAS, MOCK_GROUND_TRUTHS, ler_csv_perguntas
+import juiz_local
+
+METRICAS = ["faithfulness", "context_precision"]
+
+
+def _float(valor):
+    return None if valor is None or np.isnan(valor) else float(valor)
+
+
+def resumo_metrica(pares: pd.DataFrame) -> dict:
+    """Concordância entre as colunas "llm" e "local" de uma métrica."""
+    if pares.empty:
+        return {"pares": 0}
+    llm, local = pares["llm"], pares["local"]
+    por_modelo = pares.groupby("modelo", sort=False)[["llm", "local"]].mean()
+    return {
+        "pares": len(pares),
+        "media_llm": float(llm.mean()),
+        "media_local": float(local.mean()),
+        "pearson": _float(llm.corr(local)) if len(pares) > 1 else None,
+        "spearman": _float(llm.rank().corr(local.rank())) if len(pares) > 1 else None,
+        "erro_absoluto_medio": float((llm - local).abs().mean()),
+        "concordancia_limiar_0_5": float(((llm >= 0.5) == (local >= 0.5)).mean()),
+        "medias_por_modelo": {modelo: {"llm": float(linha["llm"]), "local": float(linha["local"])} for modelo, linha in por_modelo.iterrows()},
+        "mesma_ordem_de_modelos": por_modelo["llm"].sort_values(ascending=False).index.tolist() == por_modelo["local"].sort_values(ascending=False).index.tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibra o juiz local (NLI) contra o juiz LLM do ragas.")
+    parser.add_argument('--csv_file', type=str, help='CSV com colunas "pergunta" e "ground_truth" (padrão: perguntas da avaliação rápida)')
+    parser.add_argument('--limite', type=int, default=None, help='Número máximo de perguntas')
+    parser.add_argument('--modelos', nargs='+', default=['mistralai/mistral-7b-instruct', 'meta-llama/llama-3.3-70b-instruct'])
+    parser.add_argument('--num_queries', type=int, default=3)
+    parser.add_argument('--modo_contexto', type=str, default='truncar', choices=['truncar', 'resumir'])
+    parser.add_argument('--saida', type=str, default='results/calibracao_juiz_local.json', help='Arquivo JSON com o relatório')
+    args = parser.parse_args()
+
+    if args.csv_file:
+        with open(args.csv_file, 'r', encoding='utf-8') as f:
+            perguntas, ground_truths = ler_csv_perguntas(f)
+    else:
+        perguntas, ground_truths = MOCK_PERGUNTAS, MOCK_GROUND_TRUTHS
+    perguntas = perguntas[:args.limite] if args.limite else perguntas
+
+    llm = criar_juiz_llm()
+    linhas = []
+    tempo_llm = 0.0
+    tempo_local = 0.0
+    for i, pergunta in enumerate(perguntas):
+        print(f"[INFO] Pergunta {i + 1}/{len(perguntas)}: '{pergunta[:50]}...'")
+        respostas, logs, _, contextos, _ = consultar_modelos(pergunta, SYSTEM_PROMPTS_PADRAO, num_queries=args.num_queries, modelos=args.modelos, modo_contexto=args.modo_contexto)
+        referencia = ground_truths[i].strip() if i < len(ground_truths) and ground_truths[i].strip() else gerar_ground_truth(pergunta, llm)
+
+        # Mesmos critérios de avaliar_respostas: sem contexto ou resposta curta, as métricas não são calculadas
+        itens = {}
+        for modelo, resposta in respostas.items():
+            contexto_modelo = contextos.get(modelo, [])
+            contexto_modelo = [contexto_modelo] if isinstance(contexto_modelo, str) else contexto_modelo
+            if contexto_modelo and resposta and len(resposta.strip()) >= 50:
+                itens[modelo] = (resposta, [formatar_documento(ctx) for ctx in contexto_modelo])
+        if not itens:
+            continue
+
+        start = time.time()
+        metricas_llm = avaliar_respostas({m: respostas[m] for m in itens}, contextos, pergunta, logs, referencia)
+        tempo_llm += time.time() - start
+
+        start = time.time()
+        faith_local = juiz_local.pontuar_faithfulness_lote(list(itens.values()))
+        precision_local = juiz_local.pontuar_context_precision_lote([(referencia, ctx) for _, ctx in itens.values()])
+        tempo_local += time.time() - start
+
+        for modelo, f_local, p_local in zip(itens, faith_local, precision_local):
+            avaliacao = metricas_llm.get(modelo, {})
+            if "erro" in avaliacao:
+                continue
+            linhas.append({"pergunta": pergunta, "modelo": modelo, "metrica": "faithfulness", "llm": avaliacao.get("faithfulness", 0.0), "local": f_local})
+            linhas.append({"pergunta": pergunta, "modelo": modelo, "metrica": "context_precision", "llm": avaliacao.get("context_precision", 0.0), "local": p_local})
+
+    pares = pd.DataFrame(linhas, columns=["pergunta", "modelo", "metrica", "llm", "local"])
+    relatorio = {
+        "modelo_nli": juiz_local.MODELO_NLI,
+        "limiar_suporte": juiz_local.LIMIAR_SUPORTE,
+        "perguntas": len(perguntas),
+        # O tempo do juiz LLM inclui answer relevancy e as métricas textuais de avaliar_respostas
+        "tempo_llm_s": tempo_llm,
+        "tempo_local_s": tempo_local,
+        "metricas": {metrica: resumo_metrica(pares[pares["metrica"] == metrica]) for metrica in METRICAS},
+        "pares": linhas,
+    }
+
+    print(f"\n{'Métrica':<18} {'Pares':>6} {'Média LLM':>10} {'Média local':>12} {'Pearson':>8} {'Spearman':>9} {'EAM':>6} {'Concord.':>9}")
+    formatar = lambda v: f"{v:.3f}" if v is not None else "-"
+    for metrica, r in relatorio["metricas"].items():
+        if not r["pares"]:
+            print(f"{metrica:<18} {0:>6}")
+            continue
+        print(f"{metrica:<18} {r['pares']:>6} {r['media_llm']:>10.3f} {r['media_local']:>12.3f} {formatar(r['pearson']):>8} "
+              f"{formatar(r['spearman']):>9} {r['erro_absoluto_medio']:>6.3f} {r['concordancia_limiar_0_5']:>8.1%}")
+    print(f"Tempo: juiz LLM {tempo_llm:.1f}s (inclui relevancy e métricas textuais), juiz local {tempo_local:.1f}s")
+
+    os.makedirs(os.path.dirname(args.saida) or ".", exist_ok=True)
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"[INFO] Relatório salvo em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# contexto.py
+import re
+
+# Valores de preenchimento usados por buscar_lexml quando o campo não aparece na página.
+# Não carregam informação para o modelo, então são omitidos na serialização.
+VALORES_PADRAO = {
+    "titulo": "Título não disponível",
+    "ementa": "Ementa não disponível",
+    "link": "Link não disponível",
+    "autor": "Autor não informado",
+    "autoridade": "Autor não informado",
+    "data": "Data não informada",
+    "localidade": "Localidade não informada",
+    "subtitulo": "",
+}
+
+# Ordem de saída dos campos; campos desconhecidos vão ao final, em ordem alfabética
+ORDEM_CAMPOS = ["titulo", "subtitulo", "data", "autoridade", "localidade", "autor", "assuntos", "ementa", "link"]
+
+SEPARADOR_DOCUMENTOS = "\n\n"
+
+_espacos = re.compile(r"\s+")
+
+
+def _limpar(valor) -> str:
+    return _espacos.sub(" ", str(valor)).strip()
+
+
+def formatar_documento(doc, indice: int = None) -> str:
+    """Serializa um documento da LexML em formato compacto, uma linha por campo."""
+    if not isinstance(doc, dict):
+        return _limpar(doc)
+
+    campos = [c for c in ORDEM_CAMPOS if c in doc] + sorted(c for c in doc if c not in ORDEM_CAMPOS)
+    linhas = []
+    for campo in campos:
+        valor = _limpar(doc[campo]) if doc[campo] is not None else ""
+        if not valor or valor == VALORES_PADRAO.get(campo):
+            continue
+        if campo == "titulo":
+            linhas.insert(0, f"[{indice}] {valor}" if indice is not None else valor)
+        else:
+            linhas.append(f"{campo}: {valor}")
+    return "\n".join(linhas)
+
+
+def serializar_contexto(documentos) -> str:
+    """Serializa a lista de documentos recuperados para uso no prompt (UTF-8, sem padrões)."""
+    if isinstance(documentos, str):
+        return documentos
+    return SEPARADOR_DOCUMENTOS.join(formatar_documento(doc, i) for i, doc in enumerate(documentos, 1))
+
+
+def truncar_contexto(documentos: list, limite_chars: int):
+    """Mantém o maior prefixo de documentos cuja serialização cabe em limite_chars.
+
+    Retorna (documentos_truncados, contexto_str). Ao menos um documento é mantido.
+    """
+    if not documentos:
+        return [], ""
+    partes = [formatar_documento(doc, i) for i, doc in enumerate(documentos, 1)]
+    total = 0
+    num_items = 0
+    for parte in partes:
+        tamanho = len(parte) + (len(SEPARADOR_DOCUMENTOS) if num_items else 0)
+        if num_items and total + tamanho > limite_chars:
+            break
+        total += tamanho
+        num_items += 1
+    return documentos[:num_items], SEPARADOR_DOCUMENTOS.join(partes[:num_items])
@@ -0,0 +1,87 @@
+# dedup_queries.py
+import re
+import unicodedata
+
+import numpy as np
+
+from retriever import buscar_lexml
+
+LIMIAR_SIMILARIDADE_PADRAO = 0.9
+
+STOPWORDS_PT = {
+    "a", "ao", "aos", "as", "com", "como", "da", "das", "de", "do", "dos", "e", "em", "entre", "na", "nas",
+    "no", "nos", "o", "os", "ou", "para", "pela", "pelas", "pelo", "pelos", "por", "qual", "quais", "que",
+    "se", "sem", "sobre", "um", "uma", "uns", "umas",
+}
+
+_nao_alfanumerico = re.compile(r"[^0-9a-z]+")
+
+
+def normalizar_query(query: str) -> str:
+    """Forma canônica da query: minúsculas, sem acentos, sem pontuação e stopwords, termos ordenados."""
+    texto = unicodedata.normalize("NFKD", str(query).lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    termos = {t for t in _nao_alfanumerico.split(texto) if t and t not in STOPWORDS_PT}
+    return " ".join(sorted(termos))
+
+
+def _vetores_normalizados(textos: list) -> np.ndarray:
+    # Mesmo modelo (e backend, torch ou onnx) da avaliação, já carregado uma vez por metrics;
+    # import tardio porque metrics importa models, que importa este módulo
+    import metrics
+    vetores = np.asarray(metrics.carregar_embeddings().embed_documents(textos), dtype=np.float32)
+    return vetores / np.clip(np.linalg.norm(vetores, axis=1, keepdims=True), 1e-12, None)
+
+
+def agrupar_queries(queries: list, limiar: float = LIMIAR_SIMILARIDADE_PADRAO, usar_embeddings: bool = True) -> list:
+    """Agrupa queries equivalentes. Retorna, para cada query, o índice do seu grupo; o representante
+    de cada grupo é a primeira query que o originou.
+
+    Primeiro junta queries com a mesma forma canônica; depois, se usar_embeddings, junta grupos
+    cujos representantes têm similaridade de cosseno >= limiar (agrupamento por líder).
+    """
+    grupo_por_forma = {}
+    formas = []
+    grupo_da_query = []
+    for query in queries:
+        forma = normalizar_query(query)
+        if forma not in grupo_por_forma:
+            grupo_por_forma[forma] = len(formas)
+            formas.append(query)
+        grupo_da_query.append(grupo_por_forma[forma])
+
+    if not usar_embeddings or len(formas) < 2:
+        return grupo_da_query
+
+    try:
+        vetores = _vetores_normalizados(formas)
+    except Exception as e:
+        print(f"[WARN] Deduplicação semântica indisponível ({e}) - usando apenas a forma canônica")
+        return grupo_da_query
+
+    lideres = []
+    lider_da_forma = []
+    for i in range(len(formas)):
+        similares = [j for j in lideres if float(vetores[i] @ vetores[j]) >= limiar]
+        if similares:
+            lider_da_forma.append(lider_da_forma[similares[0]])
+        else:
+            lideres.append(i)
+            lider_da_forma.append(i)
+    return [lider_da_forma[g] for g in grupo_da_query]
+
+
+def buscar_queries_deduplicadas(queries: list, limiar: float = LIMIAR_SIMILARIDADE_PADRAO, usar_embeddings: bool = True, buscar=None):
+    """Executa uma busca por grupo de queries equivalentes e distribui os resultados.
+
+    Retorna (resultados, grupos): resultados[i] é a lista de documentos da query i e grupos[i]
+    o identificador do grupo a que ela pertence.
+    """
+    buscar = buscar or buscar_lexml
+    grupos = agrupar_queries(queries, limiar, usar_embeddings)
+    resultados_por_grupo = {}
+    for i, grupo in enumerate(grupos):
+        if grupo not in resultados_por_grupo:
+            resultados_por_grupo[grupo] = buscar(queries[i])
+    print(f"[INFO] Deduplicação de queries: {len(queries)} queries -> {len(resultados_por_grupo)} buscas na LexML")
+    return [resultados_por_grupo[g] for g in grupos], grupos
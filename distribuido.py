@@ -0,0 +1,343 @@
+# distribuido.py
+# Execução distribuída: o coordenador (run_pipeline com fila_distribuida) coloca cada célula
+# (pergunta, modelo) em uma fila SQLite e trabalhadores em outras máquinas, apontando para o mesmo
+# arquivo (pasta compartilhada), pegam células com prazo de posse renovado por batimentos. Célula de
+# trabalhador que morreu volta para a fila quando o prazo vence. O coordenador junta os resultados e
+# segue o pipeline normal (relatórios, armazém, estatísticas).
+#
+#   python run.py --csv_file perguntas.csv --fila_distribuida /mnt/compartilhado/fila.sqlite   # coordenador
+#   python distribuido.py --fila /mnt/compartilhado/fila.sqlite                                 # em cada máquina
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import progresso
+
+DURACAO_POSSE_PADRAO = 600.0
+MAX_TENTATIVAS_PADRAO = 3
+INTERVALO_CONSULTA = 10.0
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    criado_em REAL NOT NULL,
+    config TEXT NOT NULL,
+    max_tentativas INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS celulas (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    indice INTEGER NOT NULL,
+    modelo TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendente',   -- pendente | em_execucao | concluida | falhou
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    trabalhador TEXT,
+    posse_ate REAL,
+    atualizado_em REAL,
+    resultado TEXT,
+    erro TEXT,
+    PRIMARY KEY (run_id, indice, modelo)
+);
+CREATE INDEX IF NOT EXISTS idx_celulas_estado ON celulas (run_id, estado, posse_ate);
+
+-- Ground truth simulado de cada pergunta: o primeiro trabalhador a gerar grava, os demais reusam
+CREATE TABLE IF NOT EXISTS referencias (
+    run_id TEXT NOT NULL,
+    indice INTEGER NOT NULL,
+    texto TEXT NOT NULL,
+    PRIMARY KEY (run_id, indice)
+);
+"""
+
+
+class FilaDistribuida:
+    """Fila durável de células (pergunta, modelo) em SQLite.
+
+    Sem WAL: o arquivo pode estar em pasta de rede, onde o WAL (memória compartilhada) não funciona.
+    Cada operação é uma transação curta com BEGIN IMMEDIATE, então só um processo arrenda por vez.
+    """
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        self._conexao = sqlite3.connect(caminho, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conexao.row_factory = sqlite3.Row
+        self._conexao.execute("PRAGMA journal_mode=DELETE")
+        self._conexao.executescript(ESQUEMA)
+        self._lock = threading.Lock()
+
+    def _transacao(self, funcao):
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = funcao(self._conexao)
+                self._conexao.execute("COMMIT")
+                return resultado
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def criar_run(self, run_id: str, config: dict, num_perguntas: int, modelos: list, max_tentativas: int = MAX_TENTATIVAS_PADRAO) -> bool:
+        """Enfileira as células do run. Retorna False se o run já existia (retomada: nada é reenfileirado)."""
+        def criar(conexao):
+            if conexao.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+                return False
+            conexao.execute("INSERT INTO runs VALUES (?, ?, ?, ?)", (run_id, time.time(), json.dumps(config, ensure_ascii=False, default=str), max_tentativas))
+            conexao.executemany("INSERT INTO celulas (run_id, indice, modelo) VALUES (?, ?, ?)",
+                                [(run_id, indice, modelo) for indice in range(num_perguntas) for modelo in modelos])
+            return True
+        return self._transacao(criar)
+
+    def config(self, run_id: str) -> dict:
+        with self._lock:
+            linha = self._conexao.execute("SELECT config FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return json.loads(linha["config"]) if linha else None
+
+    @staticmethod
+    def _encerrar_vencidas(conexao, agora: float):
+        # Posse vencida na última tentativa: ninguém mais vai pegar a célula, então ela falha de vez
+        conexao.execute(
+            "UPDATE celulas SET estado = 'falhou', erro = 'posse vencida na última tentativa', atualizado_em = ? "
+            "WHERE estado = 'em_execucao' AND posse_ate < ? "
+            "AND tentativas >= (SELECT max_tentativas FROM runs WHERE runs.run_id = celulas.run_id)",
+            (agora, agora),
+        )
+
+    def arrendar(self, trabalhador: str, duracao: float, run_id: str = None):
+        """Pega a próxima célula pendente (ou com posse vencida) e a marca como deste trabalhador.
+        Retorna {"run_id", "indice", "modelo", "tentativas"} ou None se não houver trabalho."""
+        def arrendar(conexao):
+            agora = time.time()
+            self._encerrar_vencidas(conexao, agora)
+            filtro_run = "AND c.run_id = ?" if run_id else ""
+            linha = conexao.execute(
+                "SELECT c.run_id, c.indice, c.modelo, c.tentativas FROM celulas c JOIN runs r USING (run_id) "
+                "WHERE (c.estado = 'pendente' OR (c.estado = 'em_execucao' AND c.posse_ate < ?)) "
+                f"AND c.tentativas < r.max_tentativas {filtro_run} ORDER BY c.run_id, c.indice LIMIT 1",
+                (agora, run_id) if run_id else (agora,),
+            ).fetchone()
+            if linha is None:
+                return None
+            conexao.execute(
+                "UPDATE celulas SET estado = 'em_execucao', trabalhador = ?, posse_ate = ?, tentativas = tentativas + 1, atualizado_em = ? "
+                "WHERE run_id = ? AND indice = ? AND modelo = ?",
+                (trabalhador, agora + duracao, agora, linha["run_id"], linha["indice"], linha["modelo"]),
+            )
+            return {**dict(linha), "tentativas": linha["tentativas"] + 1}
+        return self._transacao(arrendar)
+
+    def _atualizar_minha(self, celula: dict, trabalhador: str, campos: str, valores: tuple) -> bool:
+        """UPDATE só se a célula ainda é deste trabalhador (outro pode tê-la pego após o prazo vencer)."""
+        def atualizar(conexao):
+            cursor = conexao.execute(
+                f"UPDATE celulas SET {campos}, atualizado_em = ? WHERE run_id = ? AND indice = ? AND modelo = ? "
+                "AND trabalhador = ? AND estado = 'em_execucao'",
+                (*valores, time.time(), celula["run_id"], celula["indice"], celula["modelo"], trabalhador),
+            )
+            return cursor.rowcount == 1
+        return self._transacao(atualizar)
+
+    def renovar(self, celula: dict, trabalhador: str, duracao: float) -> bool:
+        return self._atualizar_minha(celula, trabalhador, "posse_ate = ?", (time.time() + duracao,))
+
+    def concluir(self, celula: dict, trabalhador: str, resultado: dict) -> bool:
+        return self._atualizar_minha(celula, trabalhador, "estado = 'concluida', resultado = ?, erro = NULL",
+                                     (json.dumps(resultado, ensure_ascii=False),))
+
+    def falhar(self, celula: dict, trabalhador: str, erro: str, max_tentativas: int) -> bool:
+        """Devolve a célula para a fila, ou marca como falha definitiva após max_tentativas."""
+        estado = "falhou" if celula["tentativas"] >= max_tentativas else "pendente"
+        return self._atualizar_minha(celula, trabalhador, "estado = ?, erro = ?, posse_ate = NULL", (estado, erro))
+
+    def referencia(self, run_id: str, indice: int, gerar) -> str:
+        """Ground truth simulado compartilhado: gerado uma vez (por quem chegar primeiro) e reusado."""
+        with self._lock:
+            linha = self._conexao.execute("SELECT texto FROM referencias WHERE run_id = ? AND indice = ?", (run_id, indice)).fetchone()
+        if linha:
+            return linha["texto"]
+        texto = gerar()
+        self._transacao(lambda conexao: conexao.execute("INSERT OR IGNORE INTO referencias VALUES (?, ?, ?)", (run_id, indice, texto)))
+        with self._lock:
+            return self._conexao.execute("SELECT texto FROM referencias WHERE run_id = ? AND indice = ?", (run_id, indice)).fetchone()["texto"]
+
+    def situacao(self, run_id: str) -> dict:
+        self._transacao(lambda conexao: self._encerrar_vencidas(conexao, time.time()))
+        with self._lock:
+            linhas = self._conexao.execute("SELECT estado, COUNT(*) AS n FROM celulas WHERE run_id = ? GROUP BY estado", (run_id,)).fetchall()
+        return {linha["estado"]: linha["n"] for linha in linhas}
+
+    def finalizadas(self, run_id: str, conhecidas=()) -> list:
+        """Células concluídas ou com falha definitiva, exceto as (indice, modelo) em conhecidas.
+
+        Sem filtro por atualizado_em: o horário vem do relógio de cada trabalhador. O estado final
+        não muda mais, então só o resultado das células novas é lido."""
+        with self._lock:
+            chaves = self._conexao.execute(
+                "SELECT indice, modelo FROM celulas WHERE run_id = ? AND estado IN ('concluida', 'falhou') ORDER BY indice",
+                (run_id,),
+            ).fetchall()
+            novas = [(linha["indice"], linha["modelo"]) for linha in chaves if (linha["indice"], linha["modelo"]) not in conhecidas]
+            linhas = [
+                self._conexao.execute(
+                    "SELECT indice, modelo, estado, resultado, erro FROM celulas WHERE run_id = ? AND indice = ? AND modelo = ?",
+                    (run_id, indice, modelo),
+                ).fetchone()
+                for indice, modelo in novas
+            ]
+        return [dict(linha) for linha in linhas]
+
+    def fechar(self):
+        self._conexao.close()
+
+
+class Batimento:
+    """Renova a posse da célula a cada terço do prazo enquanto o trabalho roda."""
+
+    def __init__(self, fila: FilaDistribuida, celula: dict, trabalhador: str, duracao: float):
+        self.fila, self.celula, self.trabalhador, self.duracao = fila, celula, trabalhador, duracao
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._rodar, daemon=True)
+
+    def _rodar(self):
+        while not self._parar.wait(self.duracao / 3):
+            try:
+                if not self.fila.renovar(self.celula, self.trabalhador, self.duracao):
+                    print(f"[WARN] Posse da célula {self.celula['indice']}/{self.celula['modelo']} perdida - o resultado será descartado")
+                    return
+            except sqlite3.Error as e:
+                print(f"[WARN] Falha ao renovar posse: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+
+def coordenar(config: dict, system_prompts: dict, run_id: str, intervalo: float = INTERVALO_CONSULTA) -> list:
+    """Enfileira as células do run (ou retoma um run existente com o mesmo run_id), acompanha os
+    trabalhadores e devolve os resultados concluídos, na ordem das perguntas e dos modelos."""
+    perguntas = config.get('perguntas') or []
+    modelos = config.get('modelos') or []
+    fila = FilaDistribuida(config['fila_distribuida'])
+    # A chave da API não vai para a fila: cada trabalhador usa a do seu ambiente
+    config_trabalhadores = {k: v for k, v in config.items() if k not in ('fila_distribuida', 'api_key')}
+    config_trabalhadores['system_prompts'] = system_prompts
+    novo = fila.criar_run(run_id, config_trabalhadores, len(perguntas), modelos, config.get('max_tentativas', MAX_TENTATIVAS_PADRAO))
+    print(f"[INFO] Run distribuído {run_id} {'criado' if novo else 'retomado'}: {len(perguntas) * len(modelos)} células em {fila.caminho}")
+    print(f"[INFO] Inicie os trabalhadores com: python distribuido.py --fila {fila.caminho} --run_id {run_id}")
+
+    resultados = {}
+
+    def coletar():
+        for celula in fila.finalizadas(run_id, resultados):
+            chave = (celula["indice"], celula["modelo"])
+            resultados[chave] = json.loads(celula["resultado"]) if celula["estado"] == "concluida" else None
+            if resultados[chave] is None:
+                progresso.emitir("modelo_falhou", pergunta=celula["indice"] + 1, modelo=celula["modelo"], erro=celula["erro"])
+            else:
+                progresso.emitir("modelo_concluido", pergunta=celula["indice"] + 1, modelo=celula["modelo"], tempo_resposta=resultados[chave]["tempo_resposta"])
+
+    while True:
+        coletar()
+        situacao = fila.situacao(run_id)
+        print(f"[INFO] Células: {situacao.get('concluida', 0)} concluídas, {situacao.get('em_execucao', 0)} em execução, "
+              f"{situacao.get('pendente', 0)} pendentes, {situacao.get('falhou', 0)} com falha")
+        if not situacao.get('pendente') and not situacao.get('em_execucao'):
+            break
+        time.sleep(intervalo)
+    # Células finalizadas entre a última coleta e a consulta da situação
+    coletar()
+    fila.fechar()
+
+    posicao_modelo = {modelo: k for k, modelo in enumerate(modelos)}
+    return [resultados[chave] for chave in sorted(resultados, key=lambda c: (c[0], posicao_modelo.get(c[1], len(modelos)))) if resultados[chave]]
+
+
+def executar_celula(fila: FilaDistribuida, run_id: str, config: dict, indice: int, modelo: str) -> dict:
+    """Consulta e avalia um modelo em uma pergunta, como uma iteração de run_pipeline."""
+    # Importados aqui: main importa este módulo para o modo coordenador
+    from main import montar_resultado
+    from metrics import avaliar_respostas, criar_juiz_llm, gerar_ground_truth
+    from models import consultar_modelos
+    from estagios import GrafoEstagios
+
+    pergunta = config['perguntas'][indice]
+    system_prompts = config['system_prompts']
+    ground_truths = config.get('ground_truth') or []
+    ground_truth = ground_truths[indice].strip() if indice < len(ground_truths) and ground_truths[indice].strip() else None
+    grafo = GrafoEstagios(recalcular=config.get('recalcular')) if config.get('incremental') else None
+    try:
+        respostas, logs, queries, contextos, issues = consultar_modelos(
+            pergunta, system_prompts, num_queries=config.get('num_queries', 3), modelos=[modelo], modo_contexto=config.get('modo_contexto', 'truncar'),
+            dedup_queries=config.get('dedup_queries', True), limiar_dedup=config.get('limiar_dedup', 0.9), prazo_pergunta=config.get('prazo_pergunta'),
+            timeout_chamada=config.get('timeout_chamada', 300), hedge=config.get('hedge', False), grafo=grafo,
+            busca_federada=config.get('busca_federada'))
+        if modelo not in respostas:
+            raise RuntimeError("; ".join(issues.get(modelo, [])) or "modelo sem resposta")
+        if ground_truth is None and contextos.get(modelo):
+            # Todos os modelos da pergunta comparados com a mesma referência simulada
+            ground_truth = fila.referencia(run_id, indice, lambda: gerar_ground_truth(pergunta, criar_juiz_llm()))
+        juizes = {'faithfulness': config.get('juiz_faithfulness', 'llm'), 'context_precision': config.get('juiz_context_precision', 'llm')}
+        metricas = avaliar_respostas(respostas, contextos, pergunta, logs, ground_truth, juizes=juizes, grafo=grafo)
+    finally:
+        if grafo is not None:
+            grafo.fechar()
+    return montar_resultado(pergunta, modelo, respostas, logs, queries, contextos, issues, metricas, system_prompts)
+
+
+def trabalhar(caminho: str, trabalhador: str = None, run_id: str = None, duracao: float = DURACAO_POSSE_PADRAO, aguardar: bool = False):
+    """Processa células até a fila esvaziar (ou indefinidamente com aguardar=True)."""
+    trabalhador = trabalhador or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+    fila = FilaDistribuida(caminho)
+    configs = {}
+    concluidas = 0
+    print(f"[INFO] Trabalhador {trabalhador} usando a fila {caminho}")
+    while True:
+        celula = fila.arrendar(trabalhador, duracao, run_id)
+        if celula is None:
+            if not aguardar:
+                break
+            time.sleep(INTERVALO_CONSULTA)
+            continue
+        if celula["run_id"] not in configs:
+            configs[celula["run_id"]] = fila.config(celula["run_id"])
+        config = configs[celula["run_id"]]
+        max_tentativas = config.get('max_tentativas', MAX_TENTATIVAS_PADRAO)
+        pergunta = config['perguntas'][celula["indice"]]
+        print(f"[INFO] Célula {celula['indice'] + 1}/{len(config['perguntas'])} '{pergunta[:50]}...' / {celula['modelo']} (tentativa {celula['tentativas']})")
+        with Batimento(fila, celula, trabalhador, duracao):
+            try:
+                resultado = executar_celula(fila, celula["run_id"], config, celula["indice"], celula["modelo"])
+            except Exception as e:
+                print(f"[ERROR] Falha na célula: {e}")
+                fila.falhar(celula, trabalhador, str(e), max_tentativas)
+                continue
+        if fila.concluir(celula, trabalhador, resultado):
+            concluidas += 1
+        else:
+            print("[WARN] Célula reatribuída a outro trabalhador durante a execução - resultado descartado")
+    fila.fechar()
+    print(f"[INFO] Trabalhador {trabalhador} encerrado: {concluidas} células concluídas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trabalhador da execução distribuída: processa células (pergunta, modelo) da fila.")
+    parser.add_argument('--fila', required=True, help='Arquivo SQLite da fila (o mesmo passado ao coordenador em --fila_distribuida)')
+    parser.add_argument('--run_id', type=str, default=None, help='Processa apenas este run (padrão: qualquer run com trabalho)')
+    parser.add_argument('--trabalhador', type=str, default=None, help='Identificador deste trabalhador (padrão: host-pid)')
+    parser.add_argument('--duracao_posse', type=float, default=DURACAO_POSSE_PADRAO, help='Segundos de posse de uma célula sem batimento antes de ela voltar para a fila')
+    parser.add_argument('--aguardar', action='store_true', help='Continua esperando novas células quando a fila esvazia')
+    args = parser.parse_args()
+    trabalhar(args.fila, args.trabalhador, args.run_id, args.duracao_posse, args.aguardar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# embeddings_onnx.py
+# Backend opcional dos embeddings da avaliação: o paraphrase-multilingual-MiniLM-L12-v2 exportado
+# para ONNX com quantização dinâmica int8 e executado pelo onnxruntime na CPU, sem carregar o
+# PyTorch na avaliação. A exportação é feita uma vez e fica em cache/onnx/<modelo>/. Os textos são
+# codificados em lotes ordenados por tamanho (menos padding) com mean pooling, como no
+# sentence-transformers. Requer onnxruntime e transformers (a exportação também requer torch e onnx).
+#
+#   python embeddings_onnx.py --verificar      # deriva int8 x float nos textos do último run
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+MODELO_PADRAO = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+DIR_ONNX = os.path.join("cache", "onnx")
+ARQUIVO_MODELO = "modelo_int8.onnx"
+TAMANHO_LOTE = 32
+# Limite de tokens do modelo no sentence-transformers (textos maiores são truncados igualmente)
+MAX_TOKENS = 128
+# Similaridade de cosseno média mínima entre os vetores int8 e os do modelo float
+LIMIAR_DERIVA = 0.99
+
+
+def exportar(modelo: str = MODELO_PADRAO, diretorio: str = DIR_ONNX) -> str:
+    """Exporta o modelo para ONNX e quantiza os pesos em int8, se ainda não houver exportação.
+    Retorna a pasta com o modelo quantizado e o tokenizer."""
+    destino = os.path.join(diretorio, re.sub(r"[^A-Za-z0-9_.-]+", "_", modelo))
+    if os.path.exists(os.path.join(destino, ARQUIVO_MODELO)):
+        return destino
+
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    print(f"[INFO] Exportando {modelo} para ONNX int8 (só na primeira execução)...")
+    start = time.time()
+    os.makedirs(destino, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(modelo)
+    tokenizer.save_pretrained(destino)
+    rede = AutoModel.from_pretrained(modelo).eval()
+    exemplo = tokenizer(["exemplo de entrada"], return_tensors="pt")
+    caminho_float = os.path.join(destino, "modelo_float.onnx")
+    eixos = {0: "lote", 1: "tokens"}
+    with torch.no_grad():
+        torch.onnx.export(
+            rede, (exemplo["input_ids"], exemplo["attention_mask"]), caminho_float,
+            input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": eixos, "attention_mask": eixos, "last_hidden_state": eixos},
+            opset_version=17,
+        )
+    # Arquivo temporário + rename: outro processo nunca encontra um modelo pela metade
+    caminho_temporario = os.path.join(destino, f"modelo_int8.{os.getpid()}.onnx")
+    quantize_dynamic(caminho_float, caminho_temporario, weight_type=QuantType.QInt8)
+    os.replace(caminho_temporario, os.path.join(destino, ARQUIVO_MODELO))
+    os.remove(caminho_float)
+    print(f"[INFO] Modelo ONNX int8 salvo em {destino} ({time.time() - start:.2f}s)")
+    return destino
+
+
+class EmbeddingsOnnx(Embeddings):
+    """Embeddings do LangChain calculados pelo modelo ONNX int8.
+
+    threads: threads intra-op do onnxruntime (None = uma por núcleo). model_name é diferente do
+    modelo float, então o cache de embeddings não mistura vetores dos dois backends.
+    """
+
+    def __init__(self, modelo: str = MODELO_PADRAO, threads: int = None, tamanho_lote: int = TAMANHO_LOTE, diretorio: str = DIR_ONNX):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        destino = exportar(modelo, diretorio)
+        opcoes = onnxruntime.SessionOptions()
+        if threads:
+            opcoes.intra_op_num_threads = threads
+        opcoes.inter_op_num_threads = 1
+        self.sessao = onnxruntime.InferenceSession(os.path.join(destino, ARQUIVO_MODELO), opcoes, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(destino)
+        self.tamanho_lote = tamanho_lote
+        self.model_name = f"{modelo.split('/')[-1]}-onnx-int8"
+
+    def codificar(self, textos: list) -> np.ndarray:
+        """Matriz (len(textos), dimensão) float32, na ordem de textos."""
+        vetores = [None] * len(textos)
+        # Lotes de textos de tamanho parecido: o padding de cada lote fica pequeno
+        ordem = sorted(range(len(textos)), key=lambda i: len(textos[i]))
+        for inicio in range(0, len(ordem), self.tamanho_lote):
+            indices = ordem[inicio:inicio + self.tamanho_lote]
+            entradas = self.tokenizer([textos[i] for i in indices], padding=True, truncation=True, max_length=MAX_TOKENS, return_tensors="np")
+            mascara = entradas["attention_mask"].astype(np.int64)
+            estados = self.sessao.run(["last_hidden_state"], {"input_ids": entradas["input_ids"].astype(np.int64), "attention_mask": mascara})[0]
+            pesos = mascara[..., None].astype(np.float32)
+            medias = (estados * pesos).sum(axis=1) / np.clip(pesos.sum(axis=1), 1e-9, None)
+            for i, vetor in zip(indices, medias):
+                vetores[i] = vetor
+        if not vetores:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(vetores).astype(np.float32)
+
+    def embed_documents(self, texts: list) -> list:
+        return self.codificar(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+def _normalizar(matriz: np.ndarray) -> np.ndarray:
+    return matriz / np.clip(np.linalg.norm(matriz, axis=1, keepdims=True), 1e-12, None)
+
+
+def textos_avaliacao(csv_file: str = None, max_textos: int = 500) -> list:
+    """Textos que a avaliação codifica: perguntas e referências do CSV ou, sem ele, perguntas,
+    queries geradas e respostas do último run (results/resultados.json); sem nenhum dos dois,
+    as perguntas e referências da avaliação rápida."""
+    from run import MOCK_GROUND_TRUTHS, MOCK_PERGUNTAS, ler_csv_perguntas
+    if csv_file:
+        with open(csv_file, "r", encoding="utf-8") as f:
+            perguntas, referencias = ler_csv_perguntas(f)
+        textos = list(perguntas) + list(referencias)
+    else:
+        try:
+            import esquema
+            textos = []
+            for resultado in esquema.carregar():
+                textos.extend([resultado.get("pergunta"), resultado.get("resposta")] + list(resultado.get("queries_geradas") or []))
+        except (OSError, ValueError):
+            textos = list(MOCK_PERGUNTAS) + list(MOCK_GROUND_TRUTHS)
+    textos = [t for t in dict.fromkeys(textos) if t and t.strip()]
+    return textos[:max_textos]
+
+
+def verificar_deriva(textos: list, modelo: str = MODELO_PADRAO, threads: int = None) -> dict:
+    """Compara os vetores int8 com os do modelo float (sentence-transformers) nos mesmos textos:
+    cosseno entre os dois vetores de cada texto e diferença nas similaridades entre pares de textos
+    (o que o answer relevancy e o fallback do BERTScore de fato usam)."""
+    from sentence_transformers import SentenceTransformer
+
+    referencia = SentenceTransformer(modelo, device="cpu")
+    start = time.perf_counter()
+    vetores_float = referencia.encode(textos, batch_size=TAMANHO_LOTE, convert_to_numpy=True, show_progress_bar=False)
+    tempo_float = time.perf_counter() - start
+
+    onnx = EmbeddingsOnnx(modelo, threads=threads)
+    start = time.perf_counter()
+    vetores_int8 = onnx.codificar(textos)
+    tempo_int8 = time.perf_counter() - start
+
+    float_norm = _normalizar(vetores_float)
+    int8_norm = _normalizar(vetores_int8)
+    cossenos = (float_norm * int8_norm).sum(axis=1)
+    diferencas = np.abs(float_norm @ float_norm.T - int8_norm @ int8_norm.T)
+    return {
+        "textos": len(textos),
+        "cosseno_medio": float(cossenos.mean()),
+        "cosseno_minimo": float(cossenos.min()),
+        "cosseno_p5": float(np.percentile(cossenos, 5)),
+        "diferenca_similaridade_media": float(diferencas.mean()),
+        "diferenca_similaridade_maxima": float(diferencas.max()),
+        "tempo_float_s": tempo_float,
+        "tempo_int8_s": tempo_int8,
+        "ganho_velocidade": tempo_float / tempo_int8 if tempo_int8 else None,
+        "aprovado": bool(cossenos.mean() >= LIMIAR_DERIVA),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta o modelo de embeddings para ONNX int8 e mede a deriva em relação ao modelo float.")
+    parser.add_argument('--verificar', action='store_true', help='Compara int8 e float nos textos do último run (ou do CSV / avaliação rápida)')
+    parser.add_argument('--csv_file', type=str, default=None, help='CSV de perguntas usado quando não há results/resultados.json')
+    parser.add_argument('--max_textos', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=None, help='Threads intra-op do onnxruntime')
+    parser.add_argument('--saida', type=str, default='results/deriva_embeddings_onnx.json')
+    args = parser.parse_args()
+
+    destino = exportar()
+    if not args.verificar:
+        print(f"[INFO] Modelo pronto em {destino}")
+        return
+
+    textos = textos_avaliacao(args.csv_file, args.max_textos)
+    print(f"[INFO] Comparando int8 e float em {len(textos)} textos...")
+    resultado = verificar_deriva(textos, threads=args.threads)
+    print(f"[INFO] Cosseno int8 x float: médio {resultado['cosseno_medio']:.4f}, mínimo {resultado['cosseno_minimo']:.4f}, p5 {resultado['cosseno_p5']:.4f}")
+    print(f"[INFO] Diferença nas similaridades entre pares: média {resultado['diferenca_similaridade_media']:.4f}, máxima {resultado['diferenca_similaridade_maxima']:.4f}")
+    print(f"[INFO] Tempo: float {resultado['tempo_float_s']:.2f}s, int8 {resultado['tempo_int8_s']:.2f}s")
+    if resultado["aprovado"]:
+        print(f"[INFO] Deriva dentro do limite (cosseno médio >= {LIMIAR_DERIVA})")
+    else:
+        print(f"[WARN] Cosseno médio abaixo de {LIMIAR_DERIVA} - prefira o backend torch para estes dados")
+
+    os.makedirs(os.path.dirname(args.saida) or ".", exist_ok=True)
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump({"modelo": MODELO_PADRAO, "limiar": LIMIAR_DERIVA, **resultado}, f, ensure_ascii=False, indent=2)
+    print(f"[INFO] Resultado salvo em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
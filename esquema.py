@@ -0,0 +1,134 @@
+# esquema.py
+# Formato normalizado de results/resultados.json. Cada linha plana repete os dois system prompts
+# inteiros, a pergunta e os documentos de contexto (os mesmos para vários modelos); aqui esses
+# conteúdos ficam uma vez em tabelas endereçadas pelo hash e as linhas guardam só os hashes.
+# Durante o run, main.montar_resultado já guarda nas linhas só os hashes dos documentos, que ficam
+# uma vez na TabelaConteudo do run e são passados a salvar(). carregar() devolve a lista plana, com
+# os documentos, e também lê os arquivos antigos (lista plana) e a versão comprimida com zstd (.zst,
+# requer zstandard).
+import hashlib
+import json
+import os
+
+FORMATO = "evalai-resultados-normalizado"
+VERSAO = 1
+ARQUIVO_RESULTADOS = os.path.join("results", "resultados.json")
+NIVEL_ZSTD = 10
+
+# Campos de texto guardados na tabela "textos"
+CAMPOS_TEXTO = ("pergunta", "system_prompt_queries", "system_prompt_resposta")
+CAMPOS_LISTA_TEXTO = ("queries_geradas",)
+# Documentos (ou o resumo, no modo_contexto resumir) guardados na tabela "documentos"
+CAMPO_CONTEXTOS = "contextos"
+
+
+def hash_conteudo(valor) -> str:
+    conteudo = valor if isinstance(valor, str) else json.dumps(valor, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()[:16]
+
+
+class TabelaConteudo:
+    """{hash: conteúdo}, com cada conteúdo guardado uma vez."""
+
+    def __init__(self):
+        self.itens = {}
+
+    def guardar(self, valor) -> str:
+        chave = hash_conteudo(valor)
+        self.itens.setdefault(chave, valor)
+        return chave
+
+    def guardar_contextos(self, contextos):
+        """Hashes dos documentos (ou do resumo, no modo_contexto resumir), guardados na tabela."""
+        if isinstance(contextos, list):
+            return [self.guardar(documento) for documento in contextos]
+        return self.guardar(contextos)
+
+    def contem(self, contextos) -> bool:
+        """Se contextos já são hashes desta tabela (linhas de montar_resultado com a tabela do run)."""
+        if isinstance(contextos, list):
+            return all(isinstance(chave, str) and chave in self.itens for chave in contextos)
+        return isinstance(contextos, str) and contextos in self.itens
+
+
+def normalizar(resultados: list, documentos_run: TabelaConteudo = None) -> dict:
+    """documentos_run: tabela em que as linhas já guardam os documentos pelo hash; linhas com os
+    documentos inteiros (ex.: vindas do modo distribuído) também são aceitas."""
+    textos = TabelaConteudo()
+    documentos = TabelaConteudo()
+    linhas = []
+    for resultado in resultados:
+        linha = dict(resultado)
+        for campo in CAMPOS_TEXTO:
+            if isinstance(linha.get(campo), str):
+                linha[campo] = textos.guardar(linha[campo])
+        for campo in CAMPOS_LISTA_TEXTO:
+            if isinstance(linha.get(campo), list):
+                linha[campo] = [textos.guardar(texto) for texto in linha[campo]]
+        contextos = linha.get(CAMPO_CONTEXTOS)
+        if contextos is not None:
+            if documentos_run is not None and documentos_run.contem(contextos):
+                for chave in contextos if isinstance(contextos, list) else [contextos]:
+                    documentos.itens.setdefault(chave, documentos_run.itens[chave])
+            else:
+                linha[CAMPO_CONTEXTOS] = documentos.guardar_contextos(contextos)
+        linhas.append(linha)
+    return {"formato": FORMATO, "versao": VERSAO, "textos": textos.itens, "documentos": documentos.itens, "resultados": linhas}
+
+
+def linhas_planas(dados: dict):
+    """Gera as linhas planas a partir do formato normalizado. Linhas que citam o mesmo conteúdo
+    recebem o mesmo objeto, então a lista reidratada também não duplica texto em memória."""
+    textos = dados.get("textos", {})
+    documentos = dados.get("documentos", {})
+    for linha in dados.get("resultados", []):
+        plana = dict(linha)
+        for campo in CAMPOS_TEXTO:
+            if campo in plana and plana[campo] in textos:
+                plana[campo] = textos[plana[campo]]
+        for campo in CAMPOS_LISTA_TEXTO:
+            if isinstance(plana.get(campo), list):
+                plana[campo] = [textos[chave] for chave in plana[campo]]
+        contextos = plana.get(CAMPO_CONTEXTOS)
+        if isinstance(contextos, list):
+            plana[CAMPO_CONTEXTOS] = [documentos[chave] for chave in contextos]
+        elif contextos is not None:
+            plana[CAMPO_CONTEXTOS] = documentos[contextos]
+        yield plana
+
+
+def salvar(resultados: list, caminho: str = ARQUIVO_RESULTADOS, comprimir: bool = False, documentos: TabelaConteudo = None) -> str:
+    """Grava os resultados no formato normalizado; com comprimir=True, em caminho + ".zst".
+    documentos é a tabela do run, quando as linhas guardam só os hashes dos documentos.
+    Remove a outra variante (comprimida ou não) de um run anterior. Retorna o caminho gravado."""
+    conteudo = json.dumps(normalizar(resultados, documentos), ensure_ascii=False, indent=2).encode("utf-8")
+    destino = caminho
+    if comprimir:
+        try:
+            import zstandard
+            conteudo = zstandard.ZstdCompressor(level=NIVEL_ZSTD).compress(conteudo)
+            destino = caminho + ".zst"
+        except ImportError:
+            print("zstandard não instalado - resultados gravados sem compressão")
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    with open(destino, "wb") as f:
+        f.write(conteudo)
+    for antigo in (caminho, caminho + ".zst"):
+        if antigo != destino and os.path.exists(antigo):
+            os.remove(antigo)
+    return destino
+
+
+def carregar(caminho: str = ARQUIVO_RESULTADOS) -> list:
+    """Lista plana de resultados de caminho (ou caminho + ".zst"), em qualquer um dos formatos."""
+    if not os.path.exists(caminho) and os.path.exists(caminho + ".zst"):
+        caminho = caminho + ".zst"
+    with open(caminho, "rb") as f:
+        conteudo = f.read()
+    if caminho.endswith(".zst"):
+        import zstandard
+        conteudo = zstandard.ZstdDecompressor().decompress(conteudo)
+    dados = json.loads(conteudo)
+    if isinstance(dados, list):
+        return dados
+    return list(linhas_planas(dados))
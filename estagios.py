@@ -0,0 +1,171 @@
+# estagios.py
+# Saídas dos estágios do pipeline (queries -> recuperação -> contexto -> resposta -> cada métrica ->
+# relatório) guardadas por hash das entradas em cache/estagios.sqlite. Uma célula só é calculada
+# quando não há saída guardada para exatamente as mesmas entradas; como as entradas de um estágio
+# incluem as saídas dos anteriores, mudar um prompt ou adicionar um modelo recalcula apenas as
+# células que dependem da mudança. No modo simulação nada é calculado: as células sem saída
+# guardada (e tudo o que depende delas) entram no plano como "recalcular".
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+import perfil
+
+ARQUIVO_ESTAGIOS = os.path.join("cache", "estagios.sqlite")
+
+# Versão da lógica de cada estágio: incrementar invalida as saídas guardadas daquele estágio
+VERSOES = {
+    "queries": 1,
+    "recuperacao": 1,
+    "contexto": 1,
+    "resposta": 2,
+    "ground_truth": 1,
+    "faithfulness": 1,
+    "answer_relevancy": 1,
+    "context_precision": 1,
+    "rouge": 1,
+    "bertscore": 1,
+}
+ORDEM_ESTAGIOS = list(VERSOES) + ["relatorio"]
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS celulas (
+    estagio TEXT NOT NULL,
+    chave TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    criado_em REAL NOT NULL,
+    PRIMARY KEY (estagio, chave)
+) WITHOUT ROWID;
+"""
+
+
+class _Pendente:
+    """Saída ainda não calculada (modo simulação)."""
+
+    def __repr__(self):
+        return "<pendente>"
+
+
+PENDENTE = _Pendente()
+
+
+def _json(valor) -> str:
+    return json.dumps(valor, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def chave_celula(estagio: str, entradas: dict) -> str:
+    """Hash do estágio, da versão dele e das entradas (JSON canônico)."""
+    conteudo = _json({"estagio": estagio, "versao": VERSOES.get(estagio, 1), "entradas": entradas})
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+def _pendente(entradas: dict) -> bool:
+    return any(valor is PENDENTE for valor in entradas.values())
+
+
+class GrafoEstagios:
+    """Executa as células de cada estágio, reaproveitando as saídas guardadas.
+
+    caminho=None desativa o armazenamento (tudo é calculado, como antes dos estágios existirem).
+    simulacao=True não calcula nada e só monta o plano. recalcular: estágios que devem ser
+    recalculados mesmo com saída guardada (ex.: "recuperacao" para buscar de novo na LexML).
+    """
+
+    def __init__(self, caminho: str = ARQUIVO_ESTAGIOS, simulacao: bool = False, recalcular=()):
+        self.caminho = caminho
+        self.simulacao = simulacao
+        self.recalcular = set(recalcular or ())
+        self.contagem = defaultdict(Counter)
+        self.plano = []
+        self._lock = threading.Lock()
+        self._conexao = None
+        if caminho:
+            os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+            self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.executescript(ESQUEMA)
+
+    def _ler(self, estagio: str, chave: str):
+        if self._conexao is None or estagio in self.recalcular:
+            return PENDENTE
+        with self._lock:
+            linha = self._conexao.execute("SELECT valor FROM celulas WHERE estagio = ? AND chave = ?", (estagio, chave)).fetchone()
+        return json.loads(linha[0]) if linha else PENDENTE
+
+    def _gravar(self, estagio: str, chave: str, valor):
+        if self._conexao is None:
+            return
+        with self._lock, self._conexao:
+            self._conexao.execute("INSERT OR REPLACE INTO celulas VALUES (?, ?, ?, ?)", (estagio, chave, _json(valor), time.time()))
+
+    def existe(self, estagio: str, entradas: dict) -> bool:
+        return not _pendente(entradas) and self._ler(estagio, chave_celula(estagio, entradas)) is not PENDENTE
+
+    def celulas_lote(self, estagio: str, lista_entradas: list, calcular_lote, descricoes: list = None, guardar=None) -> list:
+        """Saídas das células do estágio, na ordem de lista_entradas.
+
+        calcular_lote(indices) recebe os índices das células sem saída guardada e devolve as saídas
+        delas, na mesma ordem: estágios que ganham com lote (busca deduplicada, juiz local) calculam
+        todas de uma vez. guardar(saida) -> bool decide se a saída vai para o cache (falhas não vão,
+        para serem tentadas de novo no próximo run). Exceções de calcular_lote não são guardadas.
+        """
+        descricoes = descricoes or [""] * len(lista_entradas)
+        chaves = [None if _pendente(entradas) else chave_celula(estagio, entradas) for entradas in lista_entradas]
+        valores = [PENDENTE if chave is None else self._ler(estagio, chave) for chave in chaves]
+        faltantes = [i for i, valor in enumerate(valores) if valor is PENDENTE]
+
+        if self.caminho or self.simulacao:
+            with self._lock:
+                self.contagem[estagio]["reaproveitadas"] += len(valores) - len(faltantes)
+                self.contagem[estagio]["calculadas"] += len(faltantes)
+                self.plano.extend((estagio, descricoes[i]) for i in faltantes)
+        if not faltantes or self.simulacao:
+            return valores
+
+        with perfil.etapa(estagio):
+            saidas = calcular_lote(faltantes)
+        for i, valor in zip(faltantes, saidas):
+            valores[i] = valor
+            if guardar is None or guardar(valor):
+                self._gravar(estagio, chaves[i], valor)
+        return valores
+
+    def celula(self, estagio: str, entradas: dict, calcular, descricao: str = "", guardar=None):
+        return self.celulas_lote(estagio, [entradas], lambda _: [calcular()], [descricao], guardar)[0]
+
+    def marcar(self, estagio: str, descricao: str = ""):
+        """Registra no plano um estágio sempre recalculado (ex.: relatório)."""
+        with self._lock:
+            self.contagem[estagio]["calculadas"] += 1
+            self.plano.append((estagio, descricao))
+
+    def resumo(self) -> dict:
+        return {estagio: dict(self.contagem[estagio]) for estagio in ORDEM_ESTAGIOS if estagio in self.contagem}
+
+    def imprimir_plano(self, detalhar: bool = True):
+        print("\n[INFO] Plano do modo incremental (simulação):" if self.simulacao else "\n[INFO] Células do modo incremental:")
+        print(f"  {'Estágio':<18} {'Reaproveitar':>12} {'Recalcular':>11}")
+        for estagio, contagem in self.resumo().items():
+            print(f"  {estagio:<18} {contagem.get('reaproveitadas', 0):>12} {contagem.get('calculadas', 0):>11}")
+        if detalhar and self.plano:
+            print("\nCélulas a recalcular:" if self.simulacao else "\nCélulas calculadas:")
+            for estagio, descricao in self.plano:
+                print(f"  {estagio:<18} {descricao}")
+
+    def fechar(self):
+        if self._conexao is not None:
+            self._conexao.close()
+            self._conexao = None
+
+
+# Sem armazenamento: comportamento de sempre, tudo calculado a cada run
+SEM_CACHE = GrafoEstagios(caminho=None)
+
+
+def descrever(pergunta: str, modelo: str = None) -> str:
+    texto = f"'{pergunta[:50]}'"
+    return f"{texto} / {modelo.split('/')[-1]}" if modelo else texto
@@ -0,0 +1,74 @@
+# estatisticas.py
+# Contadores e latências das chamadas de rede, compartilhados entre threads.
+import json
+import os
+import threading
+from collections import deque
+
+MAX_AMOSTRAS_LATENCIA = 200
+
+_lock = threading.Lock()
+_contadores = {}
+_latencias = {}
+
+
+def registrar(campo: str, valor=1):
+    with _lock:
+        _contadores[campo] = _contadores.get(campo, 0) + valor
+
+
+def registrar_latencia(chave: str, segundos: float):
+    with _lock:
+        if chave not in _latencias:
+            _latencias[chave] = deque(maxlen=MAX_AMOSTRAS_LATENCIA)
+        _latencias[chave].append(segundos)
+
+
+def _percentil(valores: list, p: float):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def percentil_latencia(chave: str, p: float = 0.95, min_amostras: int = 1):
+    with _lock:
+        amostras = list(_latencias.get(chave, ()))
+    if len(amostras) < min_amostras:
+        return None
+    return _percentil(amostras, p)
+
+
+def obter_estatisticas() -> dict:
+    with _lock:
+        contadores = dict(_contadores)
+        latencias = {chave: list(valores) for chave, valores in _latencias.items()}
+    return {
+        "contadores": contadores,
+        "latencias": {
+            chave: {
+                "amostras": len(valores),
+                "p50": _percentil(valores, 0.5),
+                "p95": _percentil(valores, 0.95),
+                "max": max(valores),
+            }
+            for chave, valores in latencias.items() if valores
+        },
+    }
+
+
+def zerar_estatisticas():
+    with _lock:
+        _contadores.clear()
+        _latencias.clear()
+
+
+def salvar_estatisticas(caminho: str = "results/estatisticas_chamadas.json", extras: dict = None):
+    try:
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump({**obter_estatisticas(), **(extras or {})}, f, ensure_ascii=False, indent=2)
+        print(f"{caminho} salvo")
+    except Exception as e:
+        print(f"Erro ao salvar estatísticas de chamadas: {e}")
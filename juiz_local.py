@@ -0,0 +1,147 @@
+# juiz_local.py
+# Juiz local (CPU) para faithfulness e context precision, alternativa ao juiz LLM do ragas.
+# O texto avaliado é dividido em afirmações (frases) e cada afirmação é confrontada com os trechos
+# do contexto mais parecidos lexicalmente por um cross-encoder de NLI multilíngue. Os pares de
+# todas as respostas de uma chamada vão ao modelo juntos, em lotes, e pares repetidos entre
+# modelos (mesmos documentos) são avaliados uma vez só.
+import re
+import threading
+import time
+
+MODELO_NLI = "MoritzLaurer/mDeBERTa-v3-base-xnli-multilingual-nli-2mil7"
+# Probabilidade mínima de "entailment" para considerar a afirmação sustentada pelo trecho
+LIMIAR_SUPORTE = 0.5
+TAMANHO_LOTE = 32
+MAX_CHARS_TRECHO = 600
+MIN_CHARS_AFIRMACAO = 20
+# Trechos candidatos por afirmação (os de maior sobreposição de palavras) enviados ao NLI
+TRECHOS_POR_AFIRMACAO = 3
+
+_modelo = None
+_indice_entailment = 0
+_lock = threading.Lock()
+
+# Fim de frase seguido de maiúscula (não quebra "art. 5º" nem "n. 8.078") ou quebra de linha
+_FIM_FRASE = re.compile(r"(?<=[.!?])\s+(?=[A-ZÁÉÍÓÚÂÊÔÃÕÇ\"“(])|\n+")
+_MARCADORES = re.compile(r"^\s*(?:[-*•#>]+|\d+[.)])\s*")
+_PALAVRAS = re.compile(r"\w{3,}")
+
+
+def carregar_modelo():
+    """Carrega (uma vez por processo) o cross-encoder de NLI na CPU."""
+    global _modelo, _indice_entailment
+    with _lock:
+        if _modelo is None:
+            from sentence_transformers import CrossEncoder
+            print(f"[INFO] Carregando juiz local ({MODELO_NLI})...")
+            start = time.time()
+            _modelo = CrossEncoder(MODELO_NLI, device="cpu", max_length=512)
+            rotulos = {str(rotulo).lower(): int(indice) for indice, rotulo in _modelo.model.config.id2label.items()}
+            _indice_entailment = rotulos.get("entailment", 0)
+            print(f"[INFO] Juiz local carregado em {time.time() - start:.2f}s")
+    return _modelo
+
+
+def dividir_frases(texto: str) -> list:
+    frases = (_MARCADORES.sub("", f).strip() for f in _FIM_FRASE.split(texto or ""))
+    return [f for f in frases if f]
+
+
+def dividir_afirmacoes(texto: str) -> list:
+    """Frases do texto com conteúdo suficiente para serem verificadas (títulos e fragmentos ficam de fora)."""
+    return [f for f in dividir_frases(texto) if len(f) >= MIN_CHARS_AFIRMACAO]
+
+
+def dividir_trechos(contextos: list, max_chars: int = MAX_CHARS_TRECHO) -> list:
+    """Trechos de até max_chars de cada contexto, sem quebrar frases (frases maiores viram um trecho só)."""
+    trechos = []
+    for contexto in contextos:
+        atual = ""
+        for frase in dividir_frases(contexto):
+            if atual and len(atual) + 1 + len(frase) > max_chars:
+                trechos.append(atual)
+                atual = ""
+            atual = f"{atual} {frase}" if atual else frase
+        if atual:
+            trechos.append(atual)
+    return trechos
+
+
+def _palavras(texto: str) -> set:
+    return set(_PALAVRAS.findall(texto.lower()))
+
+
+def _candidatos(afirmacao: str, trechos: list, palavras_trechos: list, k: int) -> list:
+    palavras = _palavras(afirmacao)
+    ordem = sorted(range(len(trechos)), key=lambda i: len(palavras & palavras_trechos[i]), reverse=True)
+    return [trechos[i] for i in ordem[:k]]
+
+
+def probabilidades_entailment(pares: list) -> dict:
+    """{(premissa, hipotese): P(entailment)} para pares únicos, avaliados em lotes."""
+    unicos = list(dict.fromkeys(pares))
+    if not unicos:
+        return {}
+    modelo = carregar_modelo()
+    probabilidades = modelo.predict(unicos, batch_size=TAMANHO_LOTE, apply_softmax=True, show_progress_bar=False)
+    return {par: float(p[_indice_entailment]) for par, p in zip(unicos, probabilidades)}
+
+
+def pontuar_faithfulness_lote(itens: list) -> list:
+    """itens: [(resposta, [contexto em texto, ...])]. Para cada item, fração das afirmações da resposta
+    sustentadas por algum trecho do contexto (mesma definição do faithfulness do ragas)."""
+    planos = []
+    pares = []
+    for resposta, contextos in itens:
+        trechos = dividir_trechos(contextos)
+        palavras_trechos = [_palavras(t) for t in trechos]
+        plano = [(afirmacao, _candidatos(afirmacao, trechos, palavras_trechos, TRECHOS_POR_AFIRMACAO))
+                 for afirmacao in dividir_afirmacoes(resposta)]
+        planos.append(plano)
+        pares.extend((trecho, afirmacao) for afirmacao, candidatos in plano for trecho in candidatos)
+
+    probabilidades = probabilidades_entailment(pares)
+    scores = []
+    for plano in planos:
+        if not plano:
+            scores.append(0.0)
+            continue
+        sustentadas = sum(
+            1 for afirmacao, candidatos in plano
+            if any(probabilidades[(trecho, afirmacao)] >= LIMIAR_SUPORTE for trecho in candidatos)
+        )
+        scores.append(sustentadas / len(plano))
+    return scores
+
+
+def pontuar_context_precision_lote(itens: list) -> list:
+    """itens: [(referencia, [contexto em texto, ...])]. Um contexto é relevante quando algum trecho dele
+    sustenta alguma afirmação da referência; o score é a precisão média pela ordem dos contextos
+    (mesma definição do context precision do ragas)."""
+    planos = []
+    pares = []
+    for referencia, contextos in itens:
+        afirmacoes = dividir_afirmacoes(referencia) or ([referencia.strip()] if referencia and referencia.strip() else [])
+        plano = []
+        for contexto in contextos:
+            trechos = dividir_trechos([contexto])
+            palavras_trechos = [_palavras(t) for t in trechos]
+            candidatos = [(afirmacao, trecho) for afirmacao in afirmacoes
+                          for trecho in _candidatos(afirmacao, trechos, palavras_trechos, 1)]
+            plano.append(candidatos)
+            pares.extend((trecho, afirmacao) for afirmacao, trecho in candidatos)
+        planos.append(plano)
+
+    probabilidades = probabilidades_entailment(pares)
+    scores = []
+    for plano in planos:
+        relevantes = [any(probabilidades[(trecho, afirmacao)] >= LIMIAR_SUPORTE for afirmacao, trecho in candidatos)
+                      for candidatos in plano]
+        acumulado = 0
+        soma_precisoes = 0.0
+        for posicao, relevante in enumerate(relevantes, 1):
+            if relevante:
+                acumulado += 1
+                soma_precisoes += acumulado / posicao
+        scores.append(soma_precisoes / acumulado if acumulado else 0.0)
+    return scores
@@ -0,0 +1,215 @@
+# limitador.py
+# Controle de concorrência (AIMD) por modelo e de taxa (token bucket) por provedor, compartilhado
+# por todas as chamadas ao OpenRouter: geração de queries, respostas, resumos e o juiz do ragas.
+import threading
+import time
+
+import estatisticas
+
+CONFIG = {
+    "limite_inicial": 4,
+    "limite_min": 1,
+    "limite_max": 16,
+    # Aumento aditivo: +1 no limite a cada "limite" sucessos; redução multiplicativa em 429
+    "fator_reducao": 0.5,
+    # 429s que chegam juntos (mesmo evento de congestionamento) reduzem o limite uma vez só
+    "janela_reducao_s": 2.0,
+    "requisicoes_por_segundo": 5.0,
+    "rajada": 10,
+}
+
+_lock_registro = threading.Lock()
+_limitadores = {}
+_baldes = {}
+
+
+def configurar(**valores):
+    """Altera os parâmetros dos limitadores, inclusive dos já criados: os registros persistem
+    entre execuções no mesmo processo (interface web)."""
+    desconhecidos = set(valores) - set(CONFIG)
+    if desconhecidos:
+        raise ValueError(f"Parâmetros desconhecidos: {sorted(desconhecidos)}")
+    CONFIG.update({k: v for k, v in valores.items() if v is not None})
+    with _lock_registro:
+        limitadores = list(_limitadores.values())
+        baldes = list(_baldes.values())
+    for l in limitadores:
+        l.reconfigurar()
+    for b in baldes:
+        b.reconfigurar(CONFIG["requisicoes_por_segundo"], CONFIG["rajada"])
+
+
+class LimitadorAIMD:
+    """Limita quantas chamadas ao mesmo modelo ficam em andamento, ajustando o limite por AIMD
+    e pausando todos os chamadores enquanto vigora um Retry-After."""
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.limite = float(min(CONFIG["limite_inicial"], CONFIG["limite_max"]))
+        self.em_uso = 0
+        self.bloqueado_ate = 0.0
+        self.ultima_reducao = 0.0
+        self.sucessos = 0
+        self.rate_limits = 0
+        self.esperas = 0
+        self.tempo_espera_total = 0.0
+        self.tempo_espera_max = 0.0
+        self._cond = threading.Condition()
+
+    def adquirir(self, prazo: float = None, bloquear: bool = True) -> bool:
+        inicio = time.monotonic()
+        with self._cond:
+            while True:
+                agora = time.monotonic()
+                espera_bloqueio = self.bloqueado_ate - agora
+                if self.em_uso < int(self.limite) and espera_bloqueio <= 0:
+                    break
+                if not bloquear:
+                    return False
+                espera = espera_bloqueio if espera_bloqueio > 0 else None
+                if prazo is not None:
+                    restante = prazo - agora
+                    if restante <= 0:
+                        return False
+                    espera = restante if espera is None else min(espera, restante)
+                self._cond.wait(espera)
+            self.em_uso += 1
+            esperado = time.monotonic() - inicio
+            if esperado > 0.001:
+                self.esperas += 1
+                self.tempo_espera_total += esperado
+                self.tempo_espera_max = max(self.tempo_espera_max, esperado)
+        if esperado > 0.001:
+            estatisticas.registrar_latencia(f"espera_limitador|{self.nome}", esperado)
+        return True
+
+    def liberar(self, resultado: str = "sucesso", retry_after: float = None):
+        """resultado: 'sucesso', 'rate_limit' ou 'erro'."""
+        with self._cond:
+            self.em_uso = max(0, self.em_uso - 1)
+            agora = time.monotonic()
+            if resultado == "sucesso":
+                self.sucessos += 1
+                self.limite = min(CONFIG["limite_max"], self.limite + 1.0 / self.limite)
+            elif resultado == "rate_limit":
+                self.rate_limits += 1
+                if agora - self.ultima_reducao > CONFIG["janela_reducao_s"]:
+                    self.limite = max(CONFIG["limite_min"], self.limite * CONFIG["fator_reducao"])
+                    self.ultima_reducao = agora
+                    print(f"[WARN] Rate limit em {self.nome}: concorrência reduzida para {int(self.limite)}")
+                if retry_after:
+                    self.bloqueado_ate = max(self.bloqueado_ate, agora + retry_after)
+            self._cond.notify_all()
+
+    def reconfigurar(self):
+        """Aplica os limites atuais de CONFIG, mantendo o limite aprendido quando ele cabe neles."""
+        with self._cond:
+            self.limite = float(min(CONFIG["limite_max"], max(CONFIG["limite_min"], self.limite)))
+            self._cond.notify_all()
+
+    def metricas(self) -> dict:
+        with self._cond:
+            return {
+                "limite": int(self.limite),
+                "em_uso": self.em_uso,
+                "bloqueado_por_s": max(0.0, self.bloqueado_ate - time.monotonic()),
+                "sucessos": self.sucessos,
+                "rate_limits": self.rate_limits,
+                "esperas": self.esperas,
+                "tempo_espera_total_s": self.tempo_espera_total,
+                "tempo_espera_max_s": self.tempo_espera_max,
+            }
+
+
+class BaldeTokens:
+    """Token bucket: até 'rajada' requisições imediatas, reabastecido a 'taxa' por segundo."""
+
+    def __init__(self, nome: str, taxa: float, rajada: int):
+        self.nome = nome
+        self.taxa = taxa
+        self.capacidade = rajada
+        self.tokens = float(rajada)
+        self.atualizado = time.monotonic()
+        self.tempo_espera_total = 0.0
+        self._lock = threading.Lock()
+
+    def consumir(self, prazo: float = None) -> bool:
+        inicio = time.monotonic()
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+                self.atualizado = agora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.tempo_espera_total += agora - inicio
+                    return True
+                espera = (1 - self.tokens) / self.taxa
+            if prazo is not None and time.monotonic() + espera >= prazo:
+                return False
+            time.sleep(espera)
+
+    def reconfigurar(self, taxa: float, rajada: int):
+        with self._lock:
+            agora = time.monotonic()
+            self.tokens = min(rajada, self.tokens + (agora - self.atualizado) * self.taxa)
+            self.atualizado = agora
+            self.taxa = taxa
+            self.capacidade = rajada
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {"taxa_por_s": self.taxa, "tokens_disponiveis": self.tokens, "tempo_espera_total_s": self.tempo_espera_total}
+
+
+def provedor(modelo: str) -> str:
+    return modelo.split("/")[0]
+
+
+def obter_limitador(modelo: str) -> LimitadorAIMD:
+    with _lock_registro:
+        if modelo not in _limitadores:
+            _limitadores[modelo] = LimitadorAIMD(modelo)
+        return _limitadores[modelo]
+
+
+def obter_balde(modelo: str) -> BaldeTokens:
+    nome = provedor(modelo)
+    with _lock_registro:
+        if nome not in _baldes:
+            _baldes[nome] = BaldeTokens(nome, CONFIG["requisicoes_por_segundo"], CONFIG["rajada"])
+        return _baldes[nome]
+
+
+def adquirir(modelo: str, prazo: float = None, bloquear: bool = True) -> bool:
+    """Reserva uma vaga de concorrência do modelo e um token de taxa do provedor.
+    Retorna False se o prazo acabar (ou, sem bloquear, se não houver vaga)."""
+    limitador = obter_limitador(modelo)
+    if not limitador.adquirir(prazo, bloquear):
+        return False
+    if not obter_balde(modelo).consumir(prazo if bloquear else time.monotonic()):
+        limitador.liberar("erro")
+        return False
+    return True
+
+
+def liberar(modelo: str, resultado: str = "sucesso", retry_after: float = None):
+    obter_limitador(modelo).liberar(resultado, retry_after)
+
+
+def interpretar_retry_after(valor) -> float:
+    """Converte o cabeçalho Retry-After (segundos) em float; ignora formatos de data."""
+    try:
+        return max(0.0, float(valor))
+    except (TypeError, ValueError):
+        return None
+
+
+def obter_metricas() -> dict:
+    with _lock_registro:
+        limitadores = dict(_limitadores)
+        baldes = dict(_baldes)
+    return {
+        "modelos": {nome: l.metricas() for nome, l in limitadores.items()},
+        "provedores": {nome: b.metricas() for nome, b in baldes.items()},
+    }
@@ -1,15 +1,23 @@
 # main.py
-from models import consultar_modelos
-from metrics import avaliar_respostas
+from models import consultar_modelos, gerar_queries_lote, entradas_queries
+from metrics import avaliar_respostas, configurar_embeddings
 from report import salvar_resultados
+import estatisticas
+import limitador
+import progresso
+import random
+import queue
+import threading
+from sequencial import TesteSequencialPareado, score_ranking
+from estagios import GrafoEstagios
+import armazem
+import distribuido
+import esquema
+import perfil
+from pool_metricas import PoolMetricas
 
-def run_pipeline(config):
-    import time
-    start_total = time.time()
-    print("[INFO] Iniciando pipeline de avaliação de modelos de IA")
-    
-    SYSTEM_PROMPTS = config.get('system_prompts', {
-        "queries": """Você é um especialista em pesquisa jurídica brasileira. Sua tarefa é gerar queries de busca precisas e eficazes para encontrar informações relevantes sobre legislação, jurisprudência e normas brasileiras.
+SYSTEM_PROMPTS_PADRAO = {
+    "queries": """Você é um especialista em pesquisa jurídica brasileira. Sua tarefa é gerar queries de busca precisas e eficazes para encontrar informações relevantes sobre legislação, jurisprudência e normas brasileiras.
 
 Diretrizes:
 - Use termos jurídicos específicos e precisos
@@ -17,8 +25,8 @@ Diretrizes:
 - Considere diferentes níveis de governo (federal, estadual, municipal)
 - Foque em aspectos práticos e procedimentais
 - Use linguagem formal e técnica apropriada""",
-        
-        "resposta": """Você é um assistente jurídico especializado em direito brasileiro. Sua função é fornecer respostas claras, precisas e bem fundamentadas sobre questões legais, baseando-se exclusivamente no contexto fornecido.
+    
+    "resposta": """Você é um assistente jurídico especializado em direito brasileiro. Sua função é fornecer respostas claras, precisas e bem fundamentadas sobre questões legais, baseando-se exclusivamente no contexto fornecido.
 
 Diretrizes:
 - Base suas respostas APENAS no contexto fornecido
@@ -27,7 +35,89 @@ Diretrizes:
 - Estruture a resposta de forma lógica e organizada
 - Se o contexto for insuficiente, indique claramente essa limitação
 - Não invente informações que não estejam no contexto"""
-    })
+}
+
+def montar_resultado(pergunta, modelo, respostas, logs, queries, contextos, issues, metricas, system_prompts, documentos=None):
+    """Linha de resultado de um modelo em uma pergunta (formato usado pelos relatórios e pelo armazém).
+    Com documentos (esquema.TabelaConteudo do run), a linha guarda só os hashes dos documentos de
+    contexto, que ficam uma vez na tabela em vez de uma cópia por modelo."""
+    metricas_modelo = metricas.get(modelo, {}) if isinstance(metricas.get(modelo, {}), dict) else {}
+    return {
+        "pergunta": pergunta,
+        "modelo": modelo,
+        "resposta": respostas[modelo],
+        "queries_geradas": queries.get(modelo, []),
+        "num_contextos": len(contextos.get(modelo, [])),
+        "contextos": contextos.get(modelo, []) if documentos is None else documentos.guardar_contextos(contextos.get(modelo, [])),
+        "tempo_geracao_queries": logs[modelo]["tempo_geracao_queries"],
+        "tempo_resposta": logs[modelo]["tempo_resposta"],
+        "tokens_resposta": logs[modelo]["tokens_resposta"],
+        "faithfulness": metricas_modelo.get("faithfulness", 0.0),
+        "answer_relevancy": metricas_modelo.get("answer_relevancy", 0.0),
+        "context_precision": metricas_modelo.get("context_precision", 0.0),
+        "rouge_1_f1": metricas_modelo.get("rouge_1_f1", 0.0),
+        "rouge_2_f1": metricas_modelo.get("rouge_2_f1", 0.0),
+        "bertscore_f1": metricas_modelo.get("bertscore_f1", 0.0),
+        "issues": issues.get(modelo, []),
+        "system_prompt_queries": system_prompts["queries"],
+        "system_prompt_resposta": system_prompts["resposta"]
+    }
+
+def consultas_sobrepostas(passos, consultar, profundidade=0):
+    """Gera (passo, i, consulta, erro) na ordem de passos, com consulta = consultar(passo, i).
+
+    Com profundidade > 0, uma thread consulta as perguntas seguintes (rede) enquanto quem consome o
+    gerador avalia a atual (CPU). A fila guarda no máximo profundidade consultas prontas e a thread
+    espera quando ela enche, então a memória não cresce com o número de perguntas. Fechar o gerador
+    (parada antecipada) interrompe a thread depois da consulta em andamento.
+    """
+    def executar(passo, i):
+        try:
+            return passo, i, consultar(passo, i), None
+        except Exception as e:
+            return passo, i, None, e
+
+    if profundidade <= 0:
+        for passo, i in passos:
+            yield executar(passo, i)
+        return
+
+    fila = queue.Queue(maxsize=profundidade)
+    parar = threading.Event()
+    fim = object()
+
+    def produzir():
+        try:
+            for passo, i in passos:
+                if parar.is_set():
+                    return
+                fila.put(executar(passo, i))
+        finally:
+            fila.put(fim)
+
+    thread = threading.Thread(target=produzir, name="consultas", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = fila.get()
+            if item is fim:
+                return
+            yield item
+    finally:
+        parar.set()
+        # Esvazia a fila para liberar a thread se ela estiver bloqueada esperando espaço
+        while thread.is_alive():
+            try:
+                fila.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def run_pipeline(config):
+    import time
+    start_total = time.time()
+    print("[INFO] Iniciando pipeline de avaliação de modelos de IA")
+    
+    SYSTEM_PROMPTS = config.get('system_prompts', SYSTEM_PROMPTS_PADRAO)
     
     print(f"[DEBUG] System prompts carregados: queries ({len(SYSTEM_PROMPTS['queries'])} chars), resposta ({len(SYSTEM_PROMPTS['resposta'])} chars)")
     
@@ -42,60 +132,202 @@ Diretrizes:
     print(f"[INFO] Processando {len(perguntas)} perguntas com modo_contexto='{modo_contexto}'")
     
     todos_resultados = []
+    # Documentos de contexto do run, uma vez cada; as linhas de todos_resultados guardam os hashes
+    documentos = esquema.TabelaConteudo()
+    juizes = {'faithfulness': config.get('juiz_faithfulness', 'llm'), 'context_precision': config.get('juiz_context_precision', 'llm')}
+    limitador.configurar(limite_max=config.get('max_concorrencia'), requisicoes_por_segundo=config.get('requisicoes_por_segundo'))
+    configurar_embeddings(config.get('backend_embeddings', 'torch'), config.get('threads_onnx'))
+    
+    # Modo incremental: saídas de cada estágio guardadas por hash das entradas; só o que mudou é recalculado.
+    # Na simulação nada é chamado: o pipeline percorre as perguntas só para montar o plano.
+    grafo = None
+    simular = config.get('simular', False)
+    if config.get('incremental') or simular:
+        grafo = GrafoEstagios(simulacao=simular, recalcular=config.get('recalcular'))
+        print(f"[INFO] Modo incremental{' (simulação)' if simular else ''}: células em {grafo.caminho}")
+    
+    distribuir = bool(config.get('fila_distribuida')) and not simular
+    # Avaliação em processos filhos que herdam os modelos já carregados (criados antes de qualquer thread do pipeline)
+    pool = None
+    if (config.get('processos_metricas') or 0) > 1 and not simular and not distribuir:
+        if PoolMetricas.disponivel():
+            pool = PoolMetricas(config['processos_metricas'], juizes, caminho_estagios=grafo.caminho if grafo else None, recalcular=config.get('recalcular'))
+        else:
+            print("[WARN] Pool de avaliação requer fork (Linux/macOS) - avaliando no processo principal")
+    avaliar = pool.avaliar if pool else avaliar_respostas
+    
+    # Geração de queries em lote: uma chamada por modelo a cada lote_queries perguntas
+    # (no modo incremental, só para as perguntas sem queries guardadas)
+    queries_por_pergunta = [{} for _ in perguntas]
+    lote_queries = config.get('lote_queries') or 0
+    if lote_queries > 1 and config.get('modelos') and not simular and not distribuir:
+        for modelo in config.get('modelos'):
+            indices = [k for k, pergunta in enumerate(perguntas) if grafo is None or not grafo.existe("queries", entradas_queries(pergunta, modelo, SYSTEM_PROMPTS["queries"], config.get('num_queries', 3)))]
+            if not indices:
+                continue
+            with perfil.etapa("queries_lote"):
+                geradas = gerar_queries_lote([perguntas[k] for k in indices], modelo, SYSTEM_PROMPTS["queries"], config.get('num_queries', 3), tamanho_lote=lote_queries, max_chars_lote=config.get('max_chars_lote_queries', 20000), timeout=config.get('timeout_chamada', 300), hedge=config.get('hedge', False), api_key=config.get('api_key'))
+            for indice, resultado in geradas.items():
+                queries_por_pergunta[indices[indice]][modelo] = resultado
+    
+    modelos = config.get('modelos') or []
+    progresso.emitir("inicio", total_perguntas=len(perguntas), modelos=modelos, total=len(perguntas) * len(modelos))
     
-    for i, pergunta in enumerate(perguntas, 1):
-        print(f"[INFO] Pergunta {i}/{len(perguntas)}: '{pergunta[:50]}...'")
+    # Modo adaptativo: perguntas em ordem aleatória e parada assim que o líder estiver confirmado
+    ordem = list(range(1, len(perguntas) + 1))
+    teste = None
+    if config.get('adaptativo'):
+        semente = config.get('semente')
+        random.Random(semente).shuffle(ordem)
+        teste = TesteSequencialPareado(modelos, confianca=config.get('confianca', 0.95), min_perguntas=config.get('min_perguntas', 10))
+        print(f"[INFO] Modo adaptativo: confiança {config.get('confianca', 0.95)}, mínimo de {config.get('min_perguntas', 10)} perguntas, semente {semente}")
+    orcamento_usd = config.get('orcamento_usd')
+    orcamento_tempo = config.get('orcamento_tempo')
+    custo_inicial = estatisticas.obter_estatisticas()["contadores"].get("custo_estimado_usd", 0.0)
+    parada = {"motivo": "todas_as_perguntas"}
+    passo = 0
+    
+    # Modo distribuído: as células (pergunta, modelo) vão para a fila e são executadas pelos trabalhadores;
+    # aqui só se acompanha o andamento e se juntam os resultados
+    run_id = None
+    if distribuir:
+        if teste is not None or orcamento_usd is not None or orcamento_tempo is not None:
+            print("[WARN] Modo adaptativo e orçamentos não se aplicam ao modo distribuído - todas as células serão executadas")
+        run_id = config.get('run_distribuido') or armazem.novo_run_id()
+        todos_resultados = distribuido.coordenar(config, SYSTEM_PROMPTS, run_id)
+        ordem = []
+        passo = len({r["pergunta"] for r in todos_resultados})
+    
+    def consultar(passo, i):
+        pergunta = perguntas[i-1]
+        print(f"[INFO] Pergunta {passo}/{len(perguntas)}: consultando modelos ('{pergunta[:50]}...')")
+        progresso.emitir("etapa", pergunta=passo, total_perguntas=len(perguntas), etapa="consultando modelos")
+        start_consulta = time.time()
+        with perfil.etapa("consulta"):
+            consulta = consultar_modelos(pergunta, SYSTEM_PROMPTS, num_queries=config.get('num_queries', 3), modelos=config.get('modelos'), modo_contexto=modo_contexto, queries_pre_geradas=queries_por_pergunta[i-1], dedup_queries=config.get('dedup_queries', True), limiar_dedup=config.get('limiar_dedup', 0.9), prazo_pergunta=config.get('prazo_pergunta'), timeout_chamada=config.get('timeout_chamada', 300), hedge=config.get('hedge', False), grafo=grafo, busca_federada=config.get('busca_federada'), api_key=config.get('api_key'))
+        print(f"[INFO] Pergunta {passo}/{len(perguntas)}: consulta concluída em {time.time() - start_consulta:.2f}s. Respostas obtidas de {len(consulta[0])} modelos")
+        return consulta
+    
+    # Sobreposição: as próximas perguntas são consultadas (rede) enquanto a atual é avaliada (CPU)
+    sobreposicao = config.get('sobreposicao', 0) or 0
+    if sobreposicao > 0 and ordem:
+        print(f"[INFO] Consultas sobrepostas à avaliação: até {sobreposicao} perguntas prontas na fila")
+    consultas = consultas_sobrepostas(list(enumerate(ordem, 1)), consultar, sobreposicao)
+    
+    for passo, i, consulta, erro_consulta in consultas:
+        pergunta = perguntas[i-1]
         
         ground_truth_for_this = None
         if i-1 < len(ground_truths) and ground_truths[i-1].strip():
             ground_truth_for_this = ground_truths[i-1].strip()
         
         try:
-            print("[INFO] Consultando modelos...")
-            start_consulta = time.time()
-            respostas, logs, queries, contextos, issues = consultar_modelos(pergunta, SYSTEM_PROMPTS, num_queries=config.get('num_queries'), modelos=config.get('modelos'), modo_contexto=modo_contexto)
-            end_consulta = time.time()
-            print(f"[INFO] Consulta concluída em {end_consulta - start_consulta:.2f}s. Respostas obtidas de {len(respostas)} modelos")
+            if erro_consulta is not None:
+                raise erro_consulta
+            respostas, logs, queries, contextos, issues = consulta
             
-            print("[INFO] Avaliando respostas...")
+            print(f"[INFO] Pergunta {passo}/{len(perguntas)}: avaliando respostas...")
+            progresso.emitir("etapa", pergunta=passo, total_perguntas=len(perguntas), etapa="avaliando respostas")
             start_avalia = time.time()
-            metricas = avaliar_respostas(respostas, contextos, pergunta, logs, ground_truth_for_this) 
+            with perfil.etapa("avaliacao"):
+                metricas = avaliar(respostas, contextos, pergunta, logs, ground_truth_for_this, juizes=juizes, grafo=grafo, api_key=config.get('api_key'))
             end_avalia = time.time()
             print(f"[INFO] Avaliação concluída em {end_avalia - start_avalia:.2f}s")
+            if simular:
+                continue
             
             for modelo in respostas:
-                resultado = {
-                    "pergunta": pergunta,
-                    "modelo": modelo,
-                    "resposta": respostas[modelo],
-                    "queries_geradas": queries.get(modelo, []),
-                    "num_contextos": len(contextos.get(modelo, [])),
-                    "tempo_geracao_queries": logs[modelo]["tempo_geracao_queries"],
-                    "tempo_resposta": logs[modelo]["tempo_resposta"],
-                    "tokens_resposta": logs[modelo]["tokens_resposta"],
-                    "faithfulness": metricas.get(modelo, {}).get("faithfulness", 0.0) if isinstance(metricas.get(modelo, {}), dict) else 0.0,
-                    "answer_relevancy": metricas.get(modelo, {}).get("answer_relevancy", 0.0) if isinstance(metricas.get(modelo, {}), dict) else 0.0,
-                    "context_precision": metricas.get(modelo, {}).get("context_precision", 0.0) if isinstance(metricas.get(modelo, {}), dict) else 0.0,
-                    "rouge_1_f1": metricas.get(modelo, {}).get("rouge_1_f1", 0.0) if isinstance(metricas.get(modelo, {}), dict) else 0.0,
-                    "rouge_2_f1": metricas.get(modelo, {}).get("rouge_2_f1", 0.0) if isinstance(metricas.get(modelo, {}), dict) else 0.0,
-                    "bertscore_f1": metricas.get(modelo, {}).get("bertscore_f1", 0.0) if isinstance(metricas.get(modelo, {}), dict) else 0.0,
-                    "issues": issues.get(modelo, []),
-                    "system_prompt_queries": SYSTEM_PROMPTS["queries"],
-                    "system_prompt_resposta": SYSTEM_PROMPTS["resposta"]
-                }
+                resultado = montar_resultado(pergunta, modelo, respostas, logs, queries, contextos, issues, metricas, SYSTEM_PROMPTS, documentos)
                 todos_resultados.append(resultado)
+                progresso.emitir("modelo_concluido", pergunta=passo, modelo=modelo, tempo_resposta=resultado["tempo_resposta"])
+            for modelo in modelos:
+                if modelo not in respostas:
+                    progresso.emitir("modelo_falhou", pergunta=passo, modelo=modelo)
+            if teste is not None:
+                teste.atualizar({m: score_ranking(v) for m, v in metricas.items() if isinstance(v, dict) and "erro" not in v})
                 
         except Exception as e:
             print(f"[ERROR] Erro ao processar pergunta '{pergunta}': {e}")
-            continue
+            concluidos = {r["modelo"] for r in todos_resultados if r["pergunta"] == pergunta}
+            for modelo in modelos:
+                if modelo not in concluidos:
+                    progresso.emitir("modelo_falhou", pergunta=passo, modelo=modelo, erro=str(e))
+        
+        # Critérios de parada antecipada, verificados após cada pergunta
+        custo = estatisticas.obter_estatisticas()["contadores"].get("custo_estimado_usd", 0.0) - custo_inicial
+        motivo = None
+        if teste is not None and teste.lider_confirmado() is not None:
+            motivo = "confianca_atingida"
+        elif orcamento_usd is not None and custo >= orcamento_usd:
+            motivo = "orcamento_custo"
+        elif orcamento_tempo is not None and time.time() - start_total >= orcamento_tempo:
+            motivo = "orcamento_tempo"
+        if motivo and passo < len(ordem):
+            print(f"[INFO] Parada antecipada após {passo}/{len(perguntas)} perguntas: {motivo}")
+            parada["motivo"] = motivo
+            break
+    # Interrompe as consultas antecipadas que não serão mais avaliadas
+    consultas.close()
+    if pool is not None:
+        pool.imprimir_memoria()
+        pool.fechar()
+    
+    parada.update({
+        "perguntas_avaliadas": passo,
+        "total_perguntas": len(perguntas),
+        "custo_estimado_usd": estatisticas.obter_estatisticas()["contadores"].get("custo_estimado_usd", 0.0) - custo_inicial,
+        "duracao_s": time.time() - start_total
+    })
+    if teste is not None:
+        parada["lider_confirmado"] = teste.lider_confirmado()
+        parada["teste_sequencial"] = teste.resumo()
+    progresso.emitir("parada", **parada)
+    
+    if simular:
+        grafo.marcar("relatorio")
+        grafo.imprimir_plano()
+        grafo.fechar()
+        return
     
     print(f"[INFO] Salvando {len(todos_resultados)} resultados...")
     
     try:
-        salvar_resultados(todos_resultados)
+        metadados = {
+            "run_id": run_id,
+            "iniciado_em": start_total,
+            "modelos": modelos,
+            "modo_contexto": modo_contexto,
+            "num_queries": config.get('num_queries', 3),
+            "system_prompts": SYSTEM_PROMPTS,
+            "config": {**{k: v for k, v in config.items() if k not in ('perguntas', 'ground_truth', 'system_prompts', 'api_key')}, "parada": parada}
+        }
+        with perfil.etapa("relatorio"):
+            salvar_resultados(todos_resultados, metadados, comprimir=config.get('comprimir_resultados', False), documentos=documentos)
         print("[INFO] Resultados salvos com sucesso")
     except Exception as e:
         print(f"[ERROR] Erro ao salvar resultados: {e}")
     
+    contadores = estatisticas.obter_estatisticas()["contadores"]
+    print(f"[INFO] Chamadas: {contadores.get('chamadas', 0)}, tentativas: {contadores.get('tentativas', 0)}, prazos esgotados: {contadores.get('prazos_esgotados', 0)}, hedges: {contadores.get('hedges_disparados', 0)} (duplicatas cobradas: {contadores.get('abandonadas_cobradas', 0)})")
+    consultas_embeddings = contadores.get('embeddings_cache_acertos', 0) + contadores.get('embeddings_cache_faltas', 0)
+    if consultas_embeddings:
+        print(f"[INFO] Cache de embeddings: {contadores.get('embeddings_cache_acertos', 0)}/{consultas_embeddings} acertos ({contadores.get('embeddings_cache_acertos', 0) / consultas_embeddings:.0%})")
+    tokens_prompt = sum(v for campo, v in contadores.items() if campo.startswith("tokens_prompt|"))
+    tokens_cache = sum(v for campo, v in contadores.items() if campo.startswith("tokens_cache|"))
+    if tokens_prompt:
+        print(f"[INFO] Cache de prompt: {tokens_cache}/{tokens_prompt} tokens de prompt lidos do cache ({tokens_cache / tokens_prompt:.0%})")
+    for modelo, metricas in limitador.obter_metricas()["modelos"].items():
+        print(f"[INFO] Limitador {modelo.split('/')[-1]}: limite {metricas['limite']}, 429s: {metricas['rate_limits']}, espera total {metricas['tempo_espera_total_s']:.1f}s")
+    extras = {"limitadores": limitador.obter_metricas(), "parada": parada}
+    if pool is not None:
+        extras["pool_metricas"] = pool.resumo()
+    if grafo is not None:
+        grafo.marcar("relatorio")
+        grafo.imprimir_plano(detalhar=False)
+        extras["estagios"] = grafo.resumo()
+        grafo.fechar()
+    estatisticas.salvar_estatisticas(extras=extras)
+    
     end_total = time.time()
     print(f"[INFO] Pipeline concluído em {end_total - start_total:.2f}s total")
+    progresso.emitir("fim", resultados=len(todos_resultados), duracao=end_total - start_total)
@@ -5,164 +5,297 @@ from datasets import Dataset
 from langchain_openai import ChatOpenAI
 import os
 import sys
+import threading
 import io
 from dotenv import load_dotenv
 #import traceback
 
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from rouge_score import rouge_scorer
-from bert_score import score as bert_score_fn
+import rouge_pt
+from bert_score import BERTScorer
 #import re
-from sentence_transformers import util
+import numpy as np
 #import pandas as pd
-import json
+from contexto import formatar_documento
+from cache_embeddings import EmbeddingsComCache
+import juiz_local
+import estagios
+from langchain_core.callbacks import BaseCallbackHandler
+import limitador
+from models import registrar_uso
 
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 embeddings_model = None
+bert_scorer = None
+# Backend dos embeddings: "torch" (HuggingFaceEmbeddings) ou "onnx" (embeddings_onnx, int8 na CPU)
+backend_embeddings = "torch"
+threads_embeddings = None
 
-def avaliar_respostas(respostas, contextos, pergunta, logs, ground_truth=None):
+MODELO_JUIZ = "google/gemini-2.5-flash"
+MODELO_EMBEDDINGS = "paraphrase-multilingual-MiniLM-L12-v2"
+_lock_embeddings = threading.Lock()
+
+
+class ControleLimitador(BaseCallbackHandler):
+    """Faz cada chamada do juiz (ragas e ground truth simulado) passar pelo limitador compartilhado
+    com models.chamar_openrouter."""
+
+    def __init__(self, modelo: str):
+        self.modelo = modelo
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        limitador.adquirir(self.modelo)
+
+    def on_llm_end(self, response, **kwargs):
+        limitador.liberar(self.modelo, "sucesso")
+        # token_usage é o "usage" da resposta, com prompt_tokens_details.cached_tokens quando o
+        # provedor reaproveitou o prefixo do prompt (instruções e exemplos do ragas, no Gemini)
+        registrar_uso(self.modelo, (response.llm_output or {}).get("token_usage") or {})
+
+    def on_llm_error(self, error, **kwargs):
+        if getattr(error, "status_code", None) == 429:
+            headers = getattr(getattr(error, "response", None), "headers", None) or {}
+            limitador.liberar(self.modelo, "rate_limit", limitador.interpretar_retry_after(headers.get("retry-after")))
+        else:
+            limitador.liberar(self.modelo, "erro")
+
+
+def configurar_embeddings(backend: str = "torch", threads: int = None):
+    """Escolhe o backend dos embeddings; trocar de backend descarta o modelo já carregado."""
+    global embeddings_model, backend_embeddings, threads_embeddings
+    backend = backend or "torch"
+    if (backend, threads) != (backend_embeddings, threads_embeddings):
+        embeddings_model = None
+    backend_embeddings, threads_embeddings = backend, threads
+
+
+def carregar_embeddings():
+    """Modelo de embeddings da avaliação (com cache em disco), carregado uma vez por processo.
+    Também usado pela deduplicação de queries, para não haver uma segunda cópia do modelo."""
     global embeddings_model
-    print("[INFO] Iniciando avaliação das respostas dos modelos")
-    avaliacoes = {}
+    import time
+    with _lock_embeddings:
+        if embeddings_model is None:
+            print("[INFO] Carregando modelo de embeddings (pode demorar na primeira execução)...")
+            start = time.time()
+            base = None
+            if backend_embeddings == "onnx":
+                try:
+                    from embeddings_onnx import EmbeddingsOnnx
+                    base = EmbeddingsOnnx(threads=threads_embeddings)
+                except Exception as e:
+                    print(f"[WARN] Backend ONNX indisponível: {e} - usando o modelo PyTorch")
+            if base is None:
+                base = HuggingFaceEmbeddings(model_name=MODELO_EMBEDDINGS)
+            # Embeddings já calculados (perguntas, perguntas geradas pelo ragas) vêm do cache em disco
+            embeddings_model = EmbeddingsComCache(base)
+            end = time.time()
+            print(f"[INFO] Embeddings carregados em {end - start:.2f}s")
+        return embeddings_model
+
+def identificar_embeddings(carregar: bool = True) -> str:
+    """Nome do modelo de embeddings em uso (o do cache em disco), para as chaves das células que
+    dependem dele: trocar de backend (float -> int8) recalcula essas métricas. O ONNX pode cair para
+    o PyTorch ao carregar, então com ele o modelo é carregado antes (exceto com carregar=False, na
+    simulação); no PyTorch o nome é conhecido sem carregar nada."""
+    if carregar and backend_embeddings == "onnx":
+        carregar_embeddings()
+    if embeddings_model is not None:
+        return embeddings_model.cache.modelo
+    return f"{MODELO_EMBEDDINGS}-onnx-int8" if backend_embeddings == "onnx" else MODELO_EMBEDDINGS
 
-    # Configurar LLM com parâmetros otimizados para RAGAS e ground truth
-    llm = ChatOpenAI(
-        model="google/gemini-2.5-flash",
-        api_key=os.getenv("OPENAI_API_KEY"),
+def carregar_modelos():
+    """Carrega (uma vez por processo) os modelos locais usados na avaliação: embeddings e BERTScore.
+    Retorna {"embeddings": ..., "bertscore": ...}; bertscore fica None se o modelo não puder ser carregado."""
+    global bert_scorer
+    import time
+    carregar_embeddings()
+
+    if bert_scorer is None:
+        try:
+            os.environ['TRANSFORMERS_CACHE'] = os.environ.get('HF_HUB_CACHE', r'D:\HF_Cache')
+            start = time.time()
+            bert_scorer = BERTScorer(model_type='bert-base-multilingual-cased', lang='pt', rescale_with_baseline=True)
+            print(f"[INFO] Modelo do BERTScore carregado em {time.time() - start:.2f}s")
+        except Exception as e:
+            print(f"[WARN] Erro ao carregar BERTScore: {e} - será usado o fallback por embeddings")
+
+    return {"embeddings": embeddings_model, "bertscore": bert_scorer}
+
+def criar_juiz_llm(api_key: str = None):
+    """LLM juiz do ragas e do ground truth simulado.
+
+    Sem retries no cliente: cada nova tentativa (do ragas ou do with_retry) passa pelo limitador,
+    que assim enxerga os 429 e o Retry-After."""
+    return ChatOpenAI(
+        model=MODELO_JUIZ,
+        api_key=api_key or os.getenv("OPENAI_API_KEY"),
         base_url="https://openrouter.ai/api/v1",
         max_tokens=10000,
         temperature=0.0,
         request_timeout=300,
-        max_retries=3
+        max_retries=0,
+        callbacks=[ControleLimitador(MODELO_JUIZ)]
     )
 
-    if embeddings_model is None:
-        print("[INFO] Carregando modelo de embeddings (pode demorar na primeira execução)...")
-        import time
-        start = time.time()
-        embeddings_model = HuggingFaceEmbeddings(model_name='paraphrase-multilingual-MiniLM-L12-v2')
-        end = time.time()
-        print(f"[INFO] Embeddings carregados em {end - start:.2f}s")
+def gerar_ground_truth(pergunta, llm):
+    """Resposta de referência simulada (aproximada) quando a pergunta não tem ground truth."""
+    prompt_gt = f"Baseado na pergunta: '{pergunta}' e contexts legais, gere uma resposta de referência concisa, no estilo de normativas. Apenas gere a resposta e nada mais."
+    return llm.with_retry(stop_after_attempt=4).invoke([{"role": "user", "content": prompt_gt}]).content
+
+def _score_ragas(dados, metrica, coluna, llm):
+    """Executa uma métrica do ragas em uma única linha. Sem valor válido, levanta erro (e nada vai para o cache)."""
+    resultado = evaluate(Dataset.from_dict(dados), metrics=[metrica], llm=llm)
+    df = resultado.to_pandas() if resultado is not None else None
+    valor = df[coluna].iloc[0] if df is not None and coluna in df.columns and len(df) > 0 else None
+    if valor is None or str(valor).lower() in ['nan', 'none']:
+        raise ValueError(f"ragas não retornou {coluna}")
+    return float(valor)
+
+def calcular_faithfulness(pergunta, resposta, contextos_texto, llm):
+    print("[INFO] Calculando faithfulness...")
+    return _score_ragas({"question": [pergunta], "answer": [resposta], "contexts": [contextos_texto]}, Faithfulness(), 'faithfulness', llm)
+
+def calcular_answer_relevancy(pergunta, resposta, llm):
+    print("[INFO] Calculando relevância da resposta...")
+    carregar_modelos()
+    return _score_ragas({"question": [pergunta], "answer": [resposta]}, AnswerRelevancy(embeddings=embeddings_model), 'answer_relevancy', llm)
+
+def calcular_context_precision(pergunta, contextos_texto, referencia, llm):
+    print("[INFO] Calculando context precision...")
+    return _score_ragas({"question": [pergunta], "contexts": [contextos_texto], "ground_truth": [referencia]}, ContextPrecision(), 'context_precision', llm)
+
+def calcular_rouge(referencia, resposta):
+    # A referência é a mesma para todos os modelos: tokenizada e reduzida a stems uma vez só
+    scores = rouge_pt.pontuar(referencia, resposta)
+    return {"rouge_1_f1": scores["rouge_1_f1"], "rouge_2_f1": scores["rouge_2_f1"]}
+
+def calcular_bertscore(referencia, resposta):
+    """{"f1": ..., "fallback": bool}; o fallback (cosseno dos embeddings) não vai para o cache."""
+    carregar_modelos()
+    try:
+        if bert_scorer is None:
+            raise RuntimeError("modelo do BERTScore indisponível")
+        P, R, F1_bert = bert_scorer.score([resposta], [referencia])
+        return {"f1": F1_bert.mean().item() if F1_bert.numel() > 0 else 0.0, "fallback": False}
+    except Exception as e:
+        print(f"[WARN] Erro em BERTScore: {e} - usando fallback")
+        emb_resp, emb_ref = np.asarray(embeddings_model.embed_documents([resposta, referencia]))
+        return {"f1": float(emb_resp @ emb_ref / (np.linalg.norm(emb_resp) * np.linalg.norm(emb_ref) or 1.0)), "fallback": True}
+
+def _celula_metrica(grafo, estagio, entradas, calcular, descricao, guardar=None):
+    """Célula de uma métrica; erro vira 0.0 (como sempre foi) e não fica no cache."""
+    try:
+        valor = grafo.celula(estagio, entradas, calcular, descricao=descricao, guardar=guardar)
+    except Exception as e:
+        print(f"[ERROR] Erro em {estagio}: {e}")
+        return 0.0
+    if valor is not estagios.PENDENTE:
+        print(f"[DEBUG] {estagio}: {valor}")
+    return valor
+
+def truncar_pergunta(pergunta):
+    MAX_PERGUNTA_LENGTH = 128000 
+    if len(pergunta) > MAX_PERGUNTA_LENGTH:
+        pergunta_truncada = pergunta[:MAX_PERGUNTA_LENGTH] + "..."
+        print(f"[WARN] Pergunta truncada para {len(pergunta_truncada)} chars")
+        return pergunta_truncada
+    return pergunta
+
+
+def obter_referencia(pergunta, respostas, contextos, ground_truth, grafo, llm):
+    """Ground truth: fornecido ou simulado uma vez por pergunta, se algum modelo tiver contexto.
+    llm() devolve o cliente do juiz (só chamado se for preciso gerar)."""
+    reference_str = ground_truth.strip() if ground_truth and ground_truth.strip() else None
+    if reference_str:
+        print("[INFO] Usando ground truth fornecido")
+    elif any(contextos.get(modelo) for modelo in respostas):
+        print("[INFO] Gerando ground truth simulado (aproximado)")
+        pergunta_truncada = truncar_pergunta(pergunta)
+        reference_str = grafo.celula("ground_truth", {"pergunta": pergunta_truncada, "modelo": MODELO_JUIZ},
+                                     lambda: gerar_ground_truth(pergunta_truncada, llm()), descricao=estagios.descrever(pergunta))
+    return reference_str
+
+
+def avaliar_respostas(respostas, contextos, pergunta, logs, ground_truth=None, juizes=None, grafo=None, api_key=None):
+    """Métricas de cada resposta. Cada métrica é uma célula do grafo de estágios (grafo=None: sem cache).
+
+    juizes: {"faithfulness": "llm" | "local", "context_precision": "llm" | "local"} (padrão: llm).
+    Com "local", a métrica é calculada pelo juiz_local, em lote para todas as respostas da pergunta.
+    """
+    print("[INFO] Iniciando avaliação das respostas dos modelos")
+    grafo = grafo or estagios.SEM_CACHE
+    avaliacoes = {}
+    juizes = juizes or {}
+    faith_local = juizes.get("faithfulness") == "local"
+    precision_local = juizes.get("context_precision") == "local"
+    pendentes_faith = {}
+    pendentes_precision = {}
+    PENDENTE = estagios.PENDENTE
+
+    # O cliente do juiz só é criado se alguma célula precisar dele
+    juiz = []
+    def llm():
+        if not juiz:
+            juiz.append(criar_juiz_llm(api_key))
+        return juiz[0]
+
+    pergunta_truncada = truncar_pergunta(pergunta)
+    reference_str = obter_referencia(pergunta, respostas, contextos, ground_truth, grafo, llm)
 
     for modelo, resposta in respostas.items():
         modelo_nome = modelo.split('/')[-1]
         print(f"[INFO] Avaliando modelo: {modelo_nome}")
         contexto_modelo = contextos.get(modelo, [])
+        descricao = estagios.descrever(pergunta, modelo)
         
         # Garantir lista
         if isinstance(contexto_modelo, str):
             contexto_modelo = [contexto_modelo]
         
-        print(f"[DEBUG] Contexto disponível: {len(contexto_modelo)} itens")
-        
-        if len(contexto_modelo) == 0:
-            print(f"[WARN] Nenhum contexto para {modelo_nome} - pulando métricas")
-            avaliacoes[modelo] = {
-                "faithfulness": 0.0,
-                "answer_relevancy": 0.0,
-                "context_precision": 0.0,
-                "rouge_1_f1": 0.0,
-                "rouge_2_f1": 0.0,
-                "bertscore_f1": 0.0
-            }
-            continue
-        
-
-        # Truncar pergunta se necessário
-        pergunta_truncada = pergunta
-        MAX_PERGUNTA_LENGTH = 128000 
-        if len(pergunta) > MAX_PERGUNTA_LENGTH:
-            pergunta_truncada = pergunta[:MAX_PERGUNTA_LENGTH] + "..."
-            print(f"[WARN] Pergunta truncada para {len(pergunta_truncada)} chars")
-        
-
-        # Ground truth
-        if ground_truth and ground_truth.strip():
-            reference_str = ground_truth.strip()
-            print("[INFO] Usando ground truth fornecido")
-        else:
-            print("[INFO] Gerando ground truth simulado (aproximado)")
-            prompt_gt = f"Baseado na pergunta: '{pergunta_truncada}' e contexts legais, gere uma resposta de referência concisa, no estilo de normativas. Apenas gere a resposta e nada mais."
-            ground_truth = llm.invoke([{"role": "user", "content": prompt_gt}]).content
+        if contexto_modelo is not PENDENTE:
+            print(f"[DEBUG] Contexto disponível: {len(contexto_modelo)} itens")
+            if len(contexto_modelo) == 0:
+                print(f"[WARN] Nenhum contexto para {modelo_nome} - pulando métricas")
+                avaliacoes[modelo] = {
+                    "faithfulness": 0.0,
+                    "answer_relevancy": 0.0,
+                    "context_precision": 0.0,
+                    "rouge_1_f1": 0.0,
+                    "rouge_2_f1": 0.0,
+                    "bertscore_f1": 0.0
+                }
+                continue
 
         try:
-            reference_str = ground_truth
+            faithfulness_score = 0.0
+            relevancy_score = 0.0
+            context_precision_score = 0.0
+            contexts_str = PENDENTE if contexto_modelo is PENDENTE else [formatar_documento(ctx) for ctx in contexto_modelo]
 
-            # Faithfulness
-            if not resposta or len(resposta.strip()) < 50:
+            # Métricas RAGAS
+            if resposta is not PENDENTE and (not resposta or len(resposta.strip()) < 50):
                 print("[WARN] Resposta muito curta - pulando faithfulness")
-                faithfulness_score = 0.0
-                relevancy_score = 0.0
-                context_precision_score = 0.0
             else:
-                print("[INFO] Calculando faithfulness...")
-                faithfulness_score = 0.0
-                relevancy_score = 0.0
-                context_precision_score = 0.0
-                try:
-                    contexts_str = [json.dumps(ctx) if isinstance(ctx, dict) else str(ctx) for ctx in contexto_modelo]
-                    data_faith = Dataset.from_dict({
-                        "question": [pergunta_truncada],
-                        "answer": [resposta],
-                        "contexts": [contexts_str],
-                    })
-                    faithfulness_metric = Faithfulness()
-                    resultado_faith = evaluate(data_faith, metrics=[faithfulness_metric], llm=llm)
-                    if resultado_faith is not None:
-                        df_faith = resultado_faith.to_pandas()
-                        if 'faithfulness' in df_faith.columns and len(df_faith) > 0:
-                            faith_val = df_faith['faithfulness'].iloc[0]
-                            if faith_val is not None and str(faith_val).lower() not in ['nan', 'none']:
-                                faithfulness_score = float(faith_val)
-                    print(f"[DEBUG] Faithfulness: {faithfulness_score}")
-                except Exception as faith_error:
-                    print(f"[ERROR] Erro em faithfulness: {faith_error}")
-                    faithfulness_score = 0.0
-                
-                # Answer Relevancy
-                print("[INFO] Calculando relevância da resposta...")
-                try:
-                    data_rel = Dataset.from_dict({
-                        "question": [pergunta_truncada],
-                        "answer": [resposta]
-                    })
-                    relevancy_metric = AnswerRelevancy(embeddings=embeddings_model)
-                    resultado_rel = evaluate(data_rel, metrics=[relevancy_metric], llm=llm)
-                    if resultado_rel is not None:
-                        df_rel = resultado_rel.to_pandas()
-                        if 'answer_relevancy' in df_rel.columns and len(df_rel) > 0:
-                            rel_val = df_rel['answer_relevancy'].iloc[0]
-                            if rel_val is not None and str(rel_val).lower() not in ['nan', 'none']:
-                                relevancy_score = float(rel_val)
-                    print(f"[DEBUG] Relevancy: {relevancy_score}")
-                except Exception as rel_error:
-                    print(f"[ERROR] Erro em relevancy: {rel_error}")
-                    relevancy_score = 0.0
-
-                # Context Precision
-                print("[INFO] Calculando relevância da resposta...")
-                try:
-                    print("Calculando context_precision...")
-                    data_precision = Dataset.from_dict({
-                        "question": [pergunta_truncada],
-                        "contexts": [contexts_str],
-                        "ground_truth": [reference_str]
-                    })
-                    precision_metric = ContextPrecision()
-                    resultado_precision = evaluate(data_precision, metrics=[precision_metric], llm=llm)
-                    if resultado_precision is not None:
-                        df_precision = resultado_precision.to_pandas()
-                        if 'context_precision' in df_precision.columns and len(df_precision) > 0:
-                            precision_val = df_precision['context_precision'].iloc[0]
-                            if precision_val is not None and str(precision_val).lower() not in ['nan', 'none']:
-                                context_precision_score = float(precision_val)
-                    print(f"[DEBUG] Context Precision: {context_precision_score}")
-                except Exception as e:
-                    print(f"[ERROR] Erro em context_precision: {e}")
-                    context_precision_score = 0.0
+                if faith_local:
+                    # Calculado depois do laço, junto com as demais respostas da pergunta
+                    pendentes_faith[modelo] = {"resposta": resposta, "contextos": contexts_str}
+                else:
+                    faithfulness_score = _celula_metrica(
+                        grafo, "faithfulness", {"pergunta": pergunta_truncada, "resposta": resposta, "contextos": contexts_str, "juiz": MODELO_JUIZ},
+                        lambda: calcular_faithfulness(pergunta_truncada, resposta, contexts_str, llm()), descricao)
+
+                relevancy_score = _celula_metrica(
+                    grafo, "answer_relevancy", {"pergunta": pergunta_truncada, "resposta": resposta, "juiz": MODELO_JUIZ, "embeddings": identificar_embeddings(not grafo.simulacao)},
+                    lambda: calcular_answer_relevancy(pergunta_truncada, resposta, llm()), descricao)
 
-            
+                if precision_local:
+                    pendentes_precision[modelo] = {"referencia": reference_str, "contextos": contexts_str}
+                else:
+                    context_precision_score = _celula_metrica(
+                        grafo, "context_precision", {"pergunta": pergunta_truncada, "contextos": contexts_str, "referencia": reference_str, "juiz": MODELO_JUIZ},
+                        lambda: calcular_context_precision(pergunta_truncada, contexts_str, reference_str, llm()), descricao)
 
             # ROUGE e BERTScore
             # =====================================================
@@ -173,25 +306,14 @@ def avaliar_respostas(respostas, contextos, pergunta, logs, ground_truth=None):
                 rouge_2_f1 = 0.0
             else:
                 print("[INFO] Calculando métricas textuais...")
-                rouge_scorer_obj = rouge_scorer.RougeScorer(['rouge1', 'rouge2'], use_stemmer=True)
-                rouge_scores = rouge_scorer_obj.score(reference_str, resposta)
-                rouge_1_f1 = rouge_scores['rouge1'].fmeasure
-                rouge_2_f1 = rouge_scores['rouge2'].fmeasure
-                
-                try:
-                    os.environ['TRANSFORMERS_CACHE'] = os.environ.get('HF_HUB_CACHE', r'D:\HF_Cache')
-                    
-                    P, R, F1_bert = bert_score_fn([resposta], [reference_str], model_type='bert-base-multilingual-cased',lang='pt', rescale_with_baseline=True)
-                    bertscore_f1 = F1_bert.mean().item() if F1_bert.numel() > 0 else 0.0
-                except Exception as e:
-                    print(f"[WARN] Erro em BERTScore: {e} - usando fallback")
-                    model_emb = embeddings_model
-                    emb_resp = model_emb.encode([resposta], convert_to_tensor=True)
-                    emb_ref = model_emb.encode(reference_str, convert_to_tensor=True)
-                    bertscore_f1 = util.cos_sim(emb_resp, emb_ref).item()
-
-
-                print(f"[DEBUG] ROUGE-1: {rouge_1_f1:.3f}, ROUGE-2: {rouge_2_f1:.3f}, BERTScore: {bertscore_f1:.3f}, Context Precision: {context_precision_score:.3f}")
+                rouge = grafo.celula("rouge", {"referencia": reference_str, "resposta": resposta}, lambda: calcular_rouge(reference_str, resposta), descricao=descricao)
+                bertscore = grafo.celula("bertscore", {"referencia": reference_str, "resposta": resposta}, lambda: calcular_bertscore(reference_str, resposta),
+                                         descricao=descricao, guardar=lambda v: not v["fallback"])
+                if rouge is PENDENTE or bertscore is PENDENTE:
+                    rouge_1_f1 = rouge_2_f1 = bertscore_f1 = PENDENTE
+                else:
+                    rouge_1_f1, rouge_2_f1, bertscore_f1 = rouge["rouge_1_f1"], rouge["rouge_2_f1"], bertscore["f1"]
+                    print(f"[DEBUG] ROUGE-1: {rouge_1_f1:.3f}, ROUGE-2: {rouge_2_f1:.3f}, BERTScore: {bertscore_f1:.3f}")
     
             avaliacoes[modelo] = {
                 "faithfulness": faithfulness_score,
@@ -208,5 +330,28 @@ def avaliar_respostas(respostas, contextos, pergunta, logs, ground_truth=None):
                 "erro": "Erro na avaliação",
             }
 
+    # Juiz local: um lote com as respostas de todos os modelos da pergunta
+    for metrica, pendentes, pontuar, campos in (
+        ("faithfulness", pendentes_faith, juiz_local.pontuar_faithfulness_lote, ("resposta", "contextos")),
+        ("context_precision", pendentes_precision, juiz_local.pontuar_context_precision_lote, ("referencia", "contextos")),
+    ):
+        pendentes = {m: item for m, item in pendentes.items() if "erro" not in avaliacoes.get(m, {"erro": True})}
+        if not pendentes:
+            continue
+        modelos_lote = list(pendentes)
+        entradas = [dict(pendentes[m], juiz=juiz_local.MODELO_NLI, limiar=juiz_local.LIMIAR_SUPORTE) for m in modelos_lote]
+        try:
+            scores = grafo.celulas_lote(
+                metrica, entradas,
+                lambda indices: pontuar([tuple(entradas[i][campo] for campo in campos) for i in indices]),
+                descricoes=[estagios.descrever(pergunta, m) for m in modelos_lote])
+        except Exception as e:
+            print(f"[ERROR] Erro no juiz local ({metrica}): {e}")
+            continue
+        for modelo, score in zip(modelos_lote, scores):
+            avaliacoes[modelo][metrica] = score
+            if score is not PENDENTE:
+                print(f"[DEBUG] {metrica} (local) {modelo.split('/')[-1]}: {score:.3f}")
+
     print("[INFO] Avaliação concluída")
     return avaliacoes
@@ -3,7 +3,16 @@ import time
 import requests
 import json
 import random
-from retriever import buscar_lexml
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from retriever import buscar_lexml, buscar_lexml_federado
+from contexto import serializar_contexto, truncar_contexto
+from resumo import resumir_contexto
+from dedup_queries import buscar_queries_deduplicadas, LIMIAR_SIMILARIDADE_PADRAO
+from registro_modelos import orcamento_contexto_chars, suporta_json, obter_capacidades, estimar_custo, usa_cache_control
+import estatisticas
+import estagios
+import limitador
 from dotenv import load_dotenv
 import os
 import sys
@@ -13,13 +22,226 @@ sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 load_dotenv()
 
-def chamar_openrouter(modelo: str, system_prompt: str, user_prompt: str, json_output: bool = False):
+# Estimativa de tokens de saída por query gerada, usada para limitar o tamanho dos lotes
+TOKENS_POR_QUERY_ESTIMADOS = 40
+
+TIMEOUT_CHAMADA_PADRAO = 300
+# Hedge só é disparado depois de amostras suficientes para um p95 confiável
+MIN_AMOSTRAS_HEDGE = 10
+MIN_ATRASO_HEDGE = 2.0
+# Requisições ao OpenRouter em andamento ao mesmo tempo (incluindo duplicatas do hedge), em um
+# executor e uma sessão (pool de conexões) compartilhados por todas as chamadas
+MAX_REQUISICOES_SIMULTANEAS = 64
+_executor_requisicoes = ThreadPoolExecutor(max_workers=MAX_REQUISICOES_SIMULTANEAS, thread_name_prefix="openrouter")
+_sessao = requests.Session()
+_sessao.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=MAX_REQUISICOES_SIMULTANEAS))
+
+def _chave_latencia(modelo: str, json_output: bool) -> str:
+    # Chamadas JSON (queries) e de texto livre (respostas) têm latências muito diferentes
+    return f"{modelo}|{'json' if json_output else 'texto'}"
+
+def _atraso_hedge(chave_latencia: str):
+    p95 = estatisticas.percentil_latencia(chave_latencia, 0.95, min_amostras=MIN_AMOSTRAS_HEDGE)
+    if p95 is None:
+        return None
+    return max(p95, MIN_ATRASO_HEDGE)
+
+class RequisicaoAbandonada(Exception):
+    """A requisição foi abandonada (hedge perdido ou prazo esgotado) e a leitura interrompida."""
+
+def _resposta_concluida(futuro):
+    """Resposta de um futuro concluído, ou None se ele falhou ou foi cancelado antes de começar."""
+    if futuro.cancelled() or futuro.exception() is not None:
+        return None
+    return futuro.result()
+
+def _abandonar(futuro):
+    """Desiste de uma requisição em andamento: se ainda não começou, é cancelada; se já está
+    lendo a resposta, a leitura para no próximo pedaço do stream e a conexão é fechada. Se ela
+    ainda assim concluir com sucesso, foi cobrada."""
+    estatisticas.registrar("requisicoes_abandonadas")
+    futuro.abandonada.set()
+    futuro.cancel()
+    def ao_concluir(f):
+        resp = _resposta_concluida(f)
+        if resp is not None and resp.ok:
+            estatisticas.registrar("abandonadas_cobradas")
+        else:
+            estatisticas.registrar("abandonadas_canceladas")
+    futuro.add_done_callback(ao_concluir)
+
+def _resultado_limitador(resp) -> str:
+    if resp is None:
+        return "erro"
+    if resp.status_code == 429:
+        return "rate_limit"
+    return "sucesso" if resp.ok else "erro"
+
+def _retry_after(resp):
+    if resp is None:
+        return None
+    return limitador.interpretar_retry_after(resp.headers.get("Retry-After"))
+
+def _post_streaming(url: str, headers: dict, payload: dict, timeout: float, abandonada: threading.Event):
+    """POST com a resposta em streaming (SSE). O OpenRouter envia os tokens em pedaços e, enquanto
+    o modelo não começa a responder, comentários de keep-alive; a cada pedaço a leitura confere se
+    a requisição foi abandonada e, se foi, fecha a conexão (o OpenRouter interrompe a geração e
+    cobra só os tokens já gerados). Devolve a resposta com o corpo remontado no formato sem
+    streaming ({"choices": [{"message": {"content"}}], "usage"}), para resp.json() funcionar igual.
+    usage.include pede o uso (tokens, tokens em cache) no último evento do stream."""
+    resp = _sessao.post(url, headers=headers, json={**payload, "stream": True, "usage": {"include": True}}, timeout=timeout, stream=True)
+    if resp.status_code != 200 or not resp.headers.get("Content-Type", "").startswith("text/event-stream"):
+        resp.content
+        return resp
+    prazo = time.monotonic() + timeout
+    partes = []
+    uso = {}
+    erro = None
+    resp.encoding = "utf-8"
+    try:
+        for linha in resp.iter_lines(chunk_size=None, decode_unicode=True):
+            if abandonada.is_set():
+                raise RequisicaoAbandonada()
+            if time.monotonic() > prazo:
+                raise requests.exceptions.Timeout(f"Resposta não concluída em {timeout:.1f}s")
+            # Linhas vazias separam eventos; ": OPENROUTER PROCESSING" é keep-alive
+            if not linha or not linha.startswith("data:"):
+                continue
+            dados = linha[len("data:"):].strip()
+            if dados == "[DONE]":
+                break
+            evento = json.loads(dados)
+            if evento.get("error"):
+                erro = evento["error"]
+                break
+            for escolha in evento.get("choices") or []:
+                partes.append((escolha.get("delta") or {}).get("content") or "")
+            uso = evento.get("usage") or uso
+    finally:
+        resp.close()
+    if erro is not None:
+        # Erro do provedor no meio do stream: tratado como falha do servidor (nova tentativa)
+        resp.status_code = 502
+        resp.reason = str(erro.get("message", "erro no stream"))
+        corpo = {"error": erro}
+    else:
+        corpo = {"choices": [{"message": {"content": "".join(partes)}}], "usage": uso}
+    resp._content = json.dumps(corpo).encode("utf-8")
+    return resp
+
+def _enviar_requisicao(url: str, headers: dict, payload: dict, timeout: float, atraso_hedge: float = None, modelo: str = None):
+    """Envia o POST esperando no máximo timeout segundos no total (não apenas por leitura de socket).
+
+    Com atraso_hedge, uma requisição duplicada é disparada se a primeira não responder nesse tempo;
+    vale a primeira resposta bem-sucedida e a outra é abandonada. Com modelo, a duplicata só é
+    disparada se houver vaga livre no limitador do modelo, e a devolve ao terminar.
+
+    Requisições abandonadas param no próximo pedaço do stream (ver _post_streaming). O que sobra:
+    até o primeiro byte chegar, a thread continua esperando a conexão/cabeçalhos (limitada pelo
+    timeout), e os tokens gerados antes do abandono são cobrados.
+    """
+    def disparar(timeout_requisicao):
+        abandonada = threading.Event()
+        futuro = _executor_requisicoes.submit(_post_streaming, url, headers, payload, timeout_requisicao, abandonada)
+        futuro.abandonada = abandonada
+        return futuro
+
+    inicio = time.monotonic()
+    futuros = [disparar(timeout)]
+    try:
+        if atraso_hedge is not None and atraso_hedge < timeout:
+            concluidos, _ = wait(futuros, timeout=atraso_hedge)
+            if not concluidos and modelo is not None and not limitador.adquirir(modelo, bloquear=False):
+                estatisticas.registrar("hedges_sem_vaga")
+            elif not concluidos:
+                print(f"[INFO] Sem resposta em {atraso_hedge:.1f}s (p95) - disparando requisição duplicada")
+                estatisticas.registrar("hedges_disparados")
+                duplicata = disparar(timeout - atraso_hedge)
+                if modelo is not None:
+                    duplicata.add_done_callback(lambda f: limitador.liberar(
+                        modelo, _resultado_limitador(_resposta_concluida(f)), _retry_after(_resposta_concluida(f))))
+                futuros.append(duplicata)
+
+        pendentes = set(futuros)
+        falhas = []
+        while pendentes:
+            restante = timeout - (time.monotonic() - inicio)
+            concluidos, pendentes = wait(pendentes, timeout=max(0.0, restante), return_when=FIRST_COMPLETED)
+            if not concluidos:
+                break
+            for futuro in concluidos:
+                if futuro.exception() is None and futuro.result().ok:
+                    if futuro is not futuros[0]:
+                        estatisticas.registrar("hedges_vencidos_pela_duplicata")
+                    for outro in pendentes:
+                        _abandonar(outro)
+                    return futuro.result()
+                falhas.append(futuro)
+
+        for futuro in pendentes:
+            _abandonar(futuro)
+        if falhas:
+            falhas.sort(key=futuros.index)
+            return falhas[0].result()
+        raise requests.exceptions.Timeout(f"Sem resposta em {timeout:.1f}s")
+    except BaseException:
+        # Exceção inesperada (ou KeyboardInterrupt) durante a espera: nenhuma requisição fica órfã
+        for futuro in futuros:
+            if not futuro.done() and not futuro.abandonada.is_set():
+                _abandonar(futuro)
+        raise
+
+def registrar_uso(modelo: str, uso: dict):
+    """Acumula tokens (incluindo os lidos e gravados no cache de prompt do provedor) e o custo
+    estimado (preços do registro de modelos) nas estatísticas. uso é o campo "usage" da resposta."""
+    tokens_prompt = uso.get("prompt_tokens") or 0
+    tokens_completion = uso.get("completion_tokens") or 0
+    detalhes = uso.get("prompt_tokens_details") or {}
+    tokens_cache = detalhes.get("cached_tokens") or 0
+    tokens_escrita_cache = detalhes.get("cache_write_tokens") or 0
+    estatisticas.registrar(f"tokens_prompt|{modelo}", tokens_prompt)
+    estatisticas.registrar(f"tokens_completion|{modelo}", tokens_completion)
+    if tokens_cache:
+        estatisticas.registrar(f"tokens_cache|{modelo}", tokens_cache)
+    if tokens_escrita_cache:
+        estatisticas.registrar(f"tokens_escrita_cache|{modelo}", tokens_escrita_cache)
+    estatisticas.registrar("custo_estimado_usd", estimar_custo(modelo, tokens_prompt, tokens_completion, tokens_cache, tokens_escrita_cache))
+
+def mensagem_usuario(modelo: str, user_prompt: str, prefixo_cache: str = None):
+    """Conteúdo da mensagem do usuário com o prefixo estável (contexto) antes do restante, para o
+    cache de prompt do provedor reaproveitá-lo. Nos provedores que exigem, o prefixo vai em um
+    bloco próprio marcado com cache_control; nos demais o cache do prefixo é automático."""
+    if not prefixo_cache:
+        return user_prompt
+    if usa_cache_control(modelo):
+        return [
+            {"type": "text", "text": prefixo_cache, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": user_prompt},
+        ]
+    return prefixo_cache + user_prompt
+
+def _aguardar(delay: float, prazo: float = None) -> bool:
+    """Dorme delay segundos, a menos que isso ultrapasse o prazo (time.monotonic)."""
+    if prazo is not None and time.monotonic() + delay >= prazo:
+        return False
+    time.sleep(delay)
+    return True
+
+def chamar_openrouter(modelo: str, system_prompt: str, user_prompt: str, json_output: bool = False, timeout: float = TIMEOUT_CHAMADA_PADRAO, prazo: float = None, hedge: bool = False, prefixo_cache: str = None, api_key: str = None):
+    """Chama o modelo via OpenRouter. Retorna (conteudo, tempo, erro).
+
+    timeout limita cada tentativa; prazo (instante em time.monotonic) limita a chamada inteira,
+    incluindo novas tentativas e esperas. Com hedge, uma requisição duplicada é disparada quando a
+    tentativa passa do p95 de latência observado para o modelo. prefixo_cache (ex.: o contexto)
+    vai no início da mensagem do usuário, logo após o system prompt, marcado para o cache de prompt.
+    api_key (da execução, ex.: interface web) tem precedência sobre OPENAI_API_KEY do ambiente.
+    """
     url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+    headers = {"Authorization": f"Bearer {api_key or os.getenv('OPENAI_API_KEY')}"}
     
     messages = [
         {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
+        {"role": "user", "content": mensagem_usuario(modelo, user_prompt, prefixo_cache)}
     ]
     
     payload = {
@@ -31,19 +253,39 @@ def chamar_openrouter(modelo: str, system_prompt: str, user_prompt: str, json_ou
 
     max_retries = 5
     base_delay = 1.0
+    chave_latencia = _chave_latencia(modelo, json_output)
+    estatisticas.registrar("chamadas")
 
     for attempt in range(max_retries):
+        resp = None
         resp_json = {}
+        restante = None if prazo is None else prazo - time.monotonic()
+        if restante is not None and restante <= 0:
+            print(f"[WARN] Prazo esgotado para {modelo.split('/')[-1]} - desistindo da chamada")
+            estatisticas.registrar("prazos_esgotados")
+            return "", 0.0, "deadline"
         try:
             print(f"[DEBUG] Chamando {modelo.split('/')[-1]} (tentativa {attempt + 1})...")
+            estatisticas.registrar("tentativas")
             
-            inicio = time.time()
-            resp = requests.post(url, headers=headers, json=payload, timeout=300)
+            if not limitador.adquirir(modelo, prazo):
+                print(f"[WARN] Prazo esgotado aguardando vaga para {modelo.split('/')[-1]} - desistindo da chamada")
+                estatisticas.registrar("prazos_esgotados")
+                return "", 0.0, "deadline"
+            try:
+                restante = None if prazo is None else prazo - time.monotonic()
+                timeout_tentativa = timeout if restante is None else max(0.0, min(timeout, restante))
+                inicio = time.time()
+                resp = _enviar_requisicao(url, headers, payload, timeout_tentativa, _atraso_hedge(chave_latencia) if hedge else None, modelo)
+            finally:
+                limitador.liberar(modelo, _resultado_limitador(resp), _retry_after(resp))
             resp.raise_for_status()
             resp_json = resp.json()
             fim = time.time()
             
             conteudo = resp_json["choices"][0]["message"]["content"]
+            registrar_uso(modelo, resp_json.get("usage") or {})
+            estatisticas.registrar_latencia(chave_latencia, fim - inicio)
             print(f"[INFO] Resposta recebida em {fim - inicio:.2f}s")
             return conteudo, fim - inicio, None
         
@@ -58,9 +300,16 @@ def chamar_openrouter(modelo: str, system_prompt: str, user_prompt: str, json_ou
                 elif status == 429:
                     print(f"[WARN] Rate limit excedido (status {status}). Aguardando mais tempo...")
                     if attempt < max_retries - 1:
+                        retry_after = _retry_after(resp)
+                        if retry_after:
+                            # O limitador segura esta e as demais chamadas ao modelo até o Retry-After
+                            print(f"[WARN] Retry-After de {retry_after:.0f}s - aguardando o limitador")
+                            continue
                         delay = base_delay * (3 ** attempt) + random.uniform(5, 10)
                         print(f"[WARN] Tentando novamente em {delay:.2f}s...")
-                        time.sleep(delay)
+                        if not _aguardar(delay, prazo):
+                            estatisticas.registrar("prazos_esgotados")
+                            return "", 0.0, "deadline"
                         continue
                 elif status == 500:
                     print(f"[WARN] Erro interno do servidor (status {status}). Tentando novamente...")
@@ -73,7 +322,9 @@ def chamar_openrouter(modelo: str, system_prompt: str, user_prompt: str, json_ou
             if attempt < max_retries - 1:
                 delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
                 print(f"[WARN] Erro na tentativa {attempt + 1}: {e}. Resposta: {resp_json}. Tentando novamente em {delay:.2f}s...")
-                time.sleep(delay)
+                if not _aguardar(delay, prazo):
+                    estatisticas.registrar("prazos_esgotados")
+                    return "", 0.0, "deadline"
             else:
                 print(f"[ERROR] Falha após {max_retries} tentativas: {e}")
                 return "", 0.0, "other"
@@ -81,7 +332,215 @@ def chamar_openrouter(modelo: str, system_prompt: str, user_prompt: str, json_ou
             print(f"[ERROR] Resposta inválida da API: {resp_json}")
             return "", 0.0, "other"
 
-def consultar_modelos(pergunta: str, system_prompts: dict, num_queries: int = 3, modelos: list = ["meta-llama/llama-3.3-70b-instruct", "mistralai/mistral-7b-instruct"], modo_contexto: str = "truncar", max_contexto_padrao: int = 700000):
+def _parse_json_robusto(texto):
+    try:
+        return json.loads(texto)
+    except json.JSONDecodeError:
+        corrigido = texto.replace("'", '"')
+        try:
+            return json.loads(corrigido)
+        except json.JSONDecodeError:
+            return None
+
+def extrair_queries(queries_json_str: str):
+    """Extrai a lista de queries da resposta do modelo. Retorna (queries, erro_parsing)."""
+    try:
+        # Parsing robusto de JSON
+        queries_json_str = queries_json_str.strip()
+        print(f"[DEBUG] Resposta JSON bruta (primeiros 200 chars): {queries_json_str[:200]}...")
+        
+        queries_data = _parse_json_robusto(queries_json_str)
+        if queries_data is None or not isinstance(queries_data, dict):
+            raise ValueError("Parsing falhou")
+        queries = queries_data.get("queries", [])
+        if not isinstance(queries, list):
+            raise ValueError("Queries não é uma lista")
+        print(f"[INFO] Queries geradas com sucesso: {len(queries)}")
+        return queries, None
+    except (json.JSONDecodeError, ValueError, AttributeError) as e:
+        print(f"[ERROR] Falha no parsing JSON de queries: {e}. Usando fallback...")
+        # Fallback: extrair queries manualmente se possível
+        queries = []
+        lines = queries_json_str.split('\n')
+        for line in lines:
+            line = line.strip()
+            if line.startswith('"') and line.endswith('"'):
+                queries.append(line.strip('"'))
+            elif line.startswith('- ') or line.startswith('* '):
+                queries.append(line[2:].strip())
+        if queries:
+            print(f"[INFO] Fallback: {len(queries)} queries extraídas")
+            return queries, None
+        print("[WARN] Fallback falhou - prosseguindo sem queries")
+        return queries, str(e)
+
+def gerar_queries(pergunta: str, modelo: str, system_prompt: str, num_queries: int, **opcoes_chamada):
+    """Gera as queries de busca de uma pergunta. Retorna (queries, tempo, erro_chamada, erro_parsing)."""
+    user_prompt_queries = f"Para a pergunta '{pergunta}', gere exatamente {num_queries} queries de busca em português. As queries devem estar em um formato JSON, como uma lista de strings na chave 'queries'. Exemplo: {{'queries': ['query 1', 'query 2']}}"
+    
+    queries_json_str, tempo_queries, erro_queries = chamar_openrouter(
+        modelo, 
+        system_prompt, 
+        user_prompt_queries, 
+        json_output=suporta_json(modelo),
+        **opcoes_chamada
+    )
+    if erro_queries:
+        return [], tempo_queries, erro_queries, None
+    queries, erro_parsing = extrair_queries(queries_json_str)
+    return queries, tempo_queries, None, erro_parsing
+
+def _dividir_lotes(perguntas: list, tamanho_lote: int, max_chars_lote: int):
+    lotes = []
+    atual = []
+    chars = 0
+    for i, pergunta in enumerate(perguntas):
+        if atual and (len(atual) >= tamanho_lote or chars + len(pergunta) > max_chars_lote):
+            lotes.append(atual)
+            atual, chars = [], 0
+        atual.append(i)
+        chars += len(pergunta)
+    if atual:
+        lotes.append(atual)
+    return lotes
+
+def gerar_queries_lote(perguntas: list, modelo: str, system_prompt: str, num_queries: int, tamanho_lote: int = 10, max_chars_lote: int = 20000, **opcoes_chamada):
+    """Gera queries para várias perguntas com uma chamada por lote de até tamanho_lote perguntas.
+
+    Cada lote pede um mapa JSON {id_pergunta: [queries]}; perguntas cuja entrada vier ausente
+    ou inválida são refeitas individualmente com gerar_queries. max_chars_lote limita o tamanho
+    das perguntas somadas em uma chamada. Retorna {indice_pergunta: (queries, tempo, erro_chamada, erro_parsing)}.
+    """
+    # Limitar o lote para que a saída esperada caiba no máximo de tokens de resposta do modelo
+    max_completion = obter_capacidades(modelo)["max_completion_tokens"]
+    if max_completion:
+        tamanho_lote = max(1, min(tamanho_lote, max_completion // (max(1, num_queries or 1) * TOKENS_POR_QUERY_ESTIMADOS)))
+
+    resultados = {}
+    lotes = _dividir_lotes(perguntas, tamanho_lote, max_chars_lote)
+    print(f"[INFO] Gerando queries em lote para {modelo.split('/')[-1]}: {len(perguntas)} perguntas em {len(lotes)} chamadas")
+    for lote in lotes:
+        if len(lote) == 1:
+            resultados[lote[0]] = gerar_queries(perguntas[lote[0]], modelo, system_prompt, num_queries, **opcoes_chamada)
+            continue
+
+        ids = {f"q{n}": i for n, i in enumerate(lote, 1)}
+        lista_perguntas = "\n".join(f"{id_pergunta}: {perguntas[i]}" for id_pergunta, i in ids.items())
+        user_prompt_lote = (
+            f"Para cada pergunta abaixo, gere exatamente {num_queries} queries de busca em português. "
+            "Responda apenas com um objeto JSON que mapeia o id de cada pergunta para a sua lista de queries. "
+            f'Exemplo: {{"q1": ["query 1", "query 2"], "q2": ["query 1", "query 2"]}}\n\nPerguntas:\n{lista_perguntas}'
+        )
+        texto, tempo_lote, erro_lote = chamar_openrouter(modelo, system_prompt, user_prompt_lote, json_output=suporta_json(modelo), **opcoes_chamada)
+        dados = _parse_json_robusto(texto.strip()) if not erro_lote else None
+        if isinstance(dados, dict) and isinstance(dados.get("queries"), dict):
+            dados = dados["queries"]
+        if not isinstance(dados, dict):
+            dados = {}
+
+        falhas = []
+        tempo_por_pergunta = tempo_lote / len(lote)
+        for id_pergunta, i in ids.items():
+            queries = dados.get(id_pergunta)
+            if isinstance(queries, list):
+                queries = [q.strip() for q in queries if isinstance(q, str) and q.strip()]
+            if queries:
+                resultados[i] = (queries[:num_queries], tempo_por_pergunta, None, None)
+            else:
+                falhas.append(i)
+
+        print(f"[INFO] Lote de {len(lote)} perguntas: {len(lote) - len(falhas)} válidas, {len(falhas)} refeitas individualmente")
+        for i in falhas:
+            resultados[i] = gerar_queries(perguntas[i], modelo, system_prompt, num_queries, **opcoes_chamada)
+    return resultados
+
+def entradas_queries(pergunta: str, modelo: str, system_prompt: str, num_queries: int) -> dict:
+    """Entradas da célula de queries (também usadas pelo main para saber quais faltam gerar em lote)."""
+    return {"pergunta": pergunta, "modelo": modelo, "system_prompt": system_prompt, "num_queries": num_queries}
+
+def montar_contexto(pergunta: str, modelo: str, documentos: list, limite: int, modo_contexto: str, opcoes_chamada: dict):
+    """Estágio de empacotamento: cabe os documentos no orçamento do modelo, resumindo ou truncando.
+    Retorna {"contexto": documentos usados ou resumo, "texto": contexto serializado, "falha_resumo": bool}."""
+    contextos_str = serializar_contexto(documentos)
+    if len(contextos_str) > limite and modo_contexto == "resumir":
+        # Resumir antes da primeira chamada em vez de esperar o erro de limite
+        print(f"[INFO] Contexto excede {limite} chars - resumindo antes da primeira chamada")
+        resumo, erro_resumo = resumir_contexto(documentos, max_chars_final=limite, opcoes_chamada=opcoes_chamada)
+        if erro_resumo is None:
+            return {"contexto": resumo, "texto": resumo, "falha_resumo": False}
+        if resumo and len(resumo) <= limite:
+            # Resumo parcial: usado nesta execução, mas fora do cache para ser refeito na próxima
+            print(f"[WARN] Usando resumo parcial ({erro_resumo})")
+            return {"contexto": resumo, "texto": resumo, "falha_resumo": True}
+        falha_resumo = True
+    else:
+        falha_resumo = False
+    if len(contextos_str) > limite:
+        # Truncar a lista de contextos, não a string
+        contexto_truncado, contextos_str = truncar_contexto(documentos, limite)
+        print(f"[INFO] Contexto truncado para {len(contexto_truncado)} itens ({len(contextos_str)} chars, limite {limite})")
+    else:
+        contexto_truncado = documentos
+        print(f"[INFO] Contexto dentro do limite: {len(contextos_str)} chars")
+    return {"contexto": contexto_truncado, "texto": contextos_str, "falha_resumo": falha_resumo}
+
+def prompt_resposta(pergunta: str, contexto: str):
+    """(prefixo, restante) da mensagem de resposta: o contexto vem antes da pergunta, então system
+    prompt + contexto formam o prefixo estável que o provedor pode guardar em cache."""
+    return f"Contexto: {contexto}\n", f"Pergunta: {pergunta}\nResponda de forma clara e objetiva."
+
+def gerar_resposta(pergunta: str, modelo: str, system_prompt: str, documentos: list, empacotado: dict, limite: int, modo_contexto: str, opcoes_chamada: dict):
+    """Estágio de resposta, com a estratégia de modo_contexto quando o provedor recusa por limite de tokens.
+    Retorna {"resposta", "tempo", "erro", "contexto", "falha_resumo"} (contexto = o que foi de fato enviado
+    ao modelo; falha_resumo = foi enviado um resumo parcial, que não deve ir para o cache)."""
+    modelo_nome = modelo.split('/')[-1]
+    print("[INFO] Gerando resposta baseada no contexto...")
+    prefixo, user_prompt_resposta = prompt_resposta(pergunta, empacotado['texto'])
+    resposta, tempo_resposta, erro = chamar_openrouter(modelo, system_prompt, user_prompt_resposta, prefixo_cache=prefixo, **opcoes_chamada)
+    contexto_usado = empacotado["contexto"]
+    falha_resumo = False
+
+    if erro == "token_limit":
+        print(f"[WARN] Limite de tokens atingido para {modelo_nome} - aplicando estratégia '{modo_contexto}'")
+        if modo_contexto == "truncar":
+            print("[INFO] Aplicando truncamento regressivo...")
+            limites = [l for l in [100000, 50000, 28000] if l < limite] or [limite // 2]
+            for limite_truncamento in limites:
+                contexto_truncado, contextos_str = truncar_contexto(documentos, limite_truncamento)
+                prefixo, user_prompt_resposta = prompt_resposta(pergunta, contextos_str)
+                resposta, tempo_resposta, erro = chamar_openrouter(modelo, system_prompt, user_prompt_resposta, prefixo_cache=prefixo, **opcoes_chamada)
+                if erro is None:
+                    print(f"[INFO] Sucesso com truncamento de {limite_truncamento} chars")
+                    contexto_usado = contexto_truncado
+                    break
+            else:
+                print("[ERROR] Falha mesmo com truncamento mínimo")
+                resposta = ""
+                contexto_usado = []
+        elif modo_contexto == "resumir":
+            print("[INFO] Gerando resumo map-reduce com Gemini...")
+            resumo, erro_resumo = resumir_contexto(documentos, max_chars_final=min(28000, limite // 2), opcoes_chamada=opcoes_chamada)
+            if erro_resumo is not None and resumo and len(resumo) <= min(28000, limite // 2):
+                print(f"[WARN] Usando resumo parcial ({erro_resumo})")
+                falha_resumo = True
+                erro_resumo = None
+            if erro_resumo is None:
+                prefixo, user_prompt_resposta = prompt_resposta(pergunta, resumo)
+                resposta, tempo_resposta, erro = chamar_openrouter(modelo, system_prompt, user_prompt_resposta, prefixo_cache=prefixo, **opcoes_chamada)
+                print("[INFO] Resumo gerado e resposta obtida")
+                contexto_usado = resumo
+            else:
+                print("[ERROR] Falha ao gerar resumo")
+                resposta = ""
+                contexto_usado = []
+    else:
+        print("[INFO] Resposta gerada com sucesso na primeira tentativa")
+    return {"resposta": resposta or "", "tempo": tempo_resposta, "erro": erro, "contexto": contexto_usado, "falha_resumo": falha_resumo}
+
+def consultar_modelos(pergunta: str, system_prompts: dict, num_queries: int = 3, modelos: list = ["meta-llama/llama-3.3-70b-instruct", "mistralai/mistral-7b-instruct"], modo_contexto: str = "truncar", max_contexto_padrao: int = 700000, queries_pre_geradas: dict = None, dedup_queries: bool = True, limiar_dedup: float = LIMIAR_SIMILARIDADE_PADRAO, prazo_pergunta: float = None, timeout_chamada: float = TIMEOUT_CHAMADA_PADRAO, hedge: bool = False, grafo=None, busca_federada: dict = None, api_key: str = None):
+    """Queries -> recuperação -> contexto -> resposta de cada modelo, cada etapa como célula do grafo
+    de estágios (grafo=None: sem cache). Na simulação, as saídas não calculadas vêm como PENDENTE."""
+    grafo = grafo or estagios.SEM_CACHE
     print(f"[INFO] Iniciando consulta para pergunta: '{pergunta[:50]}...'")
     respostas = {}
     logs = {}
@@ -90,161 +549,112 @@ def consultar_modelos(pergunta: str, system_prompts: dict, num_queries: int = 3,
     issues = {}
     for modelo in modelos:
         issues[modelo] = []
+    
+    # Prazo da pergunta inteira, propagado para todas as chamadas (queries, resumo e resposta)
+    prazo = time.monotonic() + prazo_pergunta if prazo_pergunta else None
+    opcoes_chamada = {"timeout": timeout_chamada, "prazo": prazo, "hedge": hedge, "api_key": api_key}
 
+    # 1. Gerar Queries (chamadas com erro não ficam no cache)
+    celulas_queries = {}
     for modelo in modelos:
         modelo_nome = modelo.split('/')[-1]
         print(f"[INFO] Processando modelo: {modelo_nome}")
-        
-        # 1. Gerar Queries
-        print(f"[INFO] Gerando {num_queries} queries de busca...")
-        user_prompt_queries = f"Para a pergunta '{pergunta}', gere exatamente {num_queries} queries de busca em português. As queries devem estar em um formato JSON, como uma lista de strings na chave 'queries'. Exemplo: {{'queries': ['query 1', 'query 2']}}"
-        
-        queries_json_str, tempo_queries, erro_queries = chamar_openrouter(
-            modelo, 
-            system_prompts["queries"], 
-            user_prompt_queries, 
-            json_output=True
-        )
-        
-        if erro_queries:
-            print(f"[ERROR] Falha ao gerar queries para {modelo_nome}: {erro_queries}")
-            queries = []
-            issues[modelo].append(f"Erro ao gerar queries: {erro_queries}")
-            continue
-        
-        try:
-            # Parsing robusto de JSON
-            queries_json_str = queries_json_str.strip()
-            print(f"[DEBUG] Resposta JSON bruta (primeiros 200 chars): {queries_json_str[:200]}...")
-            
-            def parse_json_robust(text):
-                try:
-                    return json.loads(text)
-                except json.JSONDecodeError:
-                    corrected = text.replace("'", '"')
-                    try:
-                        return json.loads(corrected)
-                    except json.JSONDecodeError:
-                        return None
-            
-            queries_data = parse_json_robust(queries_json_str)
-            if queries_data is None or not isinstance(queries_data, dict):
-                raise ValueError("Parsing falhou")
-            queries = queries_data.get("queries", [])
-            if not isinstance(queries, list):
-                raise ValueError("Queries não é uma lista")
-            print(f"[INFO] Queries geradas com sucesso: {len(queries)}")
-        except (json.JSONDecodeError, ValueError, AttributeError) as e:
-            print(f"[ERROR] Falha no parsing JSON de queries: {e}. Usando fallback...")
-            # Fallback: extrair queries manualmente se possível
-            queries = []
-            lines = queries_json_str.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.startswith('"') and line.endswith('"'):
-                    queries.append(line.strip('"'))
-                elif line.startswith('- ') or line.startswith('* '):
-                    queries.append(line[2:].strip())
-            if queries:
-                print(f"[INFO] Fallback: {len(queries)} queries extraídas")
+
+        def calcular_queries(modelo=modelo):
+            if queries_pre_geradas and modelo in queries_pre_geradas:
+                queries, tempo_queries, erro_queries, erro_parsing = queries_pre_geradas[modelo]
+                print(f"[INFO] Usando {len(queries or [])} queries geradas em lote")
             else:
-                print("[WARN] Fallback falhou - prosseguindo sem queries")
-                issues[modelo].append(f"Falha no parsing de queries JSON: {e}")
-        
-        queries_geradas[modelo] = queries
-        
-        # 2. Buscar Contexto
-        print(f"[INFO] Buscando contexto com {len(queries)} queries...")
-        contexto_modelo = []
-        for query in queries[:num_queries]:
-            resultados = buscar_lexml(query)
-            contexto_modelo.extend(resultados)
+                print(f"[INFO] Gerando {num_queries} queries de busca...")
+                queries, tempo_queries, erro_queries, erro_parsing = gerar_queries(pergunta, modelo, system_prompts["queries"], num_queries, **opcoes_chamada)
+            return {"queries": queries or [], "tempo": tempo_queries, "erro": erro_queries, "erro_parsing": erro_parsing}
+
+        celula = grafo.celula("queries", entradas_queries(pergunta, modelo, system_prompts["queries"], num_queries), calcular_queries,
+                              descricao=estagios.descrever(pergunta, modelo), guardar=lambda v: not v["erro"])
+        if celula is not estagios.PENDENTE:
+            if celula["erro"]:
+                print(f"[ERROR] Falha ao gerar queries para {modelo_nome}: {celula['erro']}")
+                issues[modelo].append(f"Erro ao gerar queries: {celula['erro']}")
+                continue
+            if celula["erro_parsing"]:
+                issues[modelo].append(f"Falha no parsing de queries JSON: {celula['erro_parsing']}")
+            queries_geradas[modelo] = celula["queries"]
+        celulas_queries[modelo] = celula
+    
+    # 2. Buscar Contexto: queries equivalentes (do mesmo modelo ou entre modelos) são buscadas uma vez;
+    # com busca_federada ({autoridade: cota}), cada query é buscada em paralelo em cada autoridade
+    modelos_busca = list(celulas_queries)
+    buscar = (lambda query: buscar_lexml_federado(query, busca_federada)) if busca_federada else buscar_lexml
+
+    def recuperar(indices):
+        pedidos = [(k, query) for k in indices for query in celulas_queries[modelos_busca[k]]["queries"][:num_queries]]
+        print(f"[INFO] Buscando contexto com {len(pedidos)} queries...")
+        if dedup_queries:
+            resultados_pedidos, grupos_pedidos = buscar_queries_deduplicadas([query for _, query in pedidos], limiar=limiar_dedup, buscar=buscar)
+        else:
+            resultados_pedidos = [buscar(query) for _, query in pedidos]
+            grupos_pedidos = list(range(len(pedidos)))
+        recuperados = {k: [] for k in indices}
+        grupos_usados = {k: set() for k in indices}
+        for (k, _), resultados, grupo in zip(pedidos, resultados_pedidos, grupos_pedidos):
+            # Duas queries equivalentes do mesmo modelo não duplicam os documentos
+            if grupo in grupos_usados[k]:
+                continue
+            grupos_usados[k].add(grupo)
+            recuperados[k].extend(resultados)
+        return [recuperados[k] for k in indices]
+
+    documentos_por_modelo = dict(zip(modelos_busca, grafo.celulas_lote(
+        "recuperacao",
+        [{"queries": celulas_queries[m] if celulas_queries[m] is estagios.PENDENTE else celulas_queries[m]["queries"][:num_queries],
+          "dedup": dedup_queries, "limiar": limiar_dedup if dedup_queries else None,
+          **({"federada": busca_federada} if busca_federada else {})} for m in modelos_busca],
+        recuperar,
+        descricoes=[estagios.descrever(pergunta, m) for m in modelos_busca],
+        # Busca sem nenhum documento pode ser falha da LexML: não fica no cache
+        guardar=bool,
+    )))
+    
+    for modelo in modelos_busca:
+        modelo_nome = modelo.split('/')[-1]
+        celula_queries = celulas_queries[modelo]
+        tempo_queries = 0.0 if celula_queries is estagios.PENDENTE else celula_queries["tempo"]
+        contexto_modelo = documentos_por_modelo[modelo]
+        descricao = estagios.descrever(pergunta, modelo)
         
-        print(f"[INFO] Contexto coletado: {len(contexto_modelo)} documentos ({len(json.dumps(contexto_modelo))} chars)")
+        if contexto_modelo is not estagios.PENDENTE:
+            print(f"[INFO] Contexto coletado para {modelo_nome}: {len(contexto_modelo)} documentos ({len(serializar_contexto(contexto_modelo))} chars)")
         contextos[modelo] = contexto_modelo
 
-        if len(contexto_modelo) == 0:
+        if contexto_modelo is not estagios.PENDENTE and len(contexto_modelo) == 0:
             print(f"[WARN] Nenhum contexto recuperado para {modelo_nome} - pulando geração de resposta")
             issues[modelo].append("Nenhum contexto recuperado - indica queries de pesquisa ruins ou erro na busca")
             resposta = ""
             tempo_resposta = 0.0
             erro = None
         else:
-            # 3. Gerar Resposta
-            print("[INFO] Gerando resposta baseada no contexto...")
-            
-            # Truncamento padrão
-            MAX_CONTEXT_LENGTH_PADRAO = max_contexto_padrao
-            contextos_str = json.dumps(contexto_modelo)
-            if len(contextos_str) > MAX_CONTEXT_LENGTH_PADRAO:
-                # Truncar a lista de contextos, não a string
-                if contexto_modelo:
-                    avg_size = len(contextos_str) / len(contexto_modelo)
-                    num_items = max(1, int(MAX_CONTEXT_LENGTH_PADRAO / avg_size))
-                    contexto_truncado = contexto_modelo[:num_items]
-                    contextos_str = json.dumps(contexto_truncado)
-                    while len(contextos_str) > MAX_CONTEXT_LENGTH_PADRAO and num_items > 1:
-                        num_items -= 1
-                        contexto_truncado = contexto_modelo[:num_items]
-                        contextos_str = json.dumps(contexto_truncado)
-                print(f"[INFO] Contexto truncado para {len(contexto_modelo)} itens ({len(contextos_str)} chars, limite 700k)")
-            else:
-                contexto_truncado = contexto_modelo
-                print(f"[INFO] Contexto dentro do limite: {len(contextos_str)} chars")
+            # 3. Empacotar o contexto: truncamento padrão dimensionado pelo registro de modelos antes da primeira chamada
+            limite = orcamento_contexto_chars(modelo, len(system_prompts["resposta"]) + len(pergunta) + 100, max_contexto_padrao)
+            empacotado = grafo.celula(
+                "contexto", {"documentos": contexto_modelo, "limite": limite, "modo_contexto": modo_contexto},
+                lambda: montar_contexto(pergunta, modelo, contexto_modelo, limite, modo_contexto, opcoes_chamada),
+                descricao=descricao, guardar=lambda v: not v["falha_resumo"])
 
-            user_prompt_resposta = f"Pergunta: {pergunta}\nContexto: {contextos_str}\nResponda de forma clara e objetiva."
-            
-            resposta, tempo_resposta, erro = chamar_openrouter(
-                modelo, 
-                system_prompts["resposta"], 
-                user_prompt_resposta
-            )
-            
-            if erro == "token_limit":
-                print(f"[WARN] Limite de tokens atingido para {modelo_nome} - aplicando estratégia '{modo_contexto}'")
-                if modo_contexto == "truncar":
-                    print("[INFO] Aplicando truncamento regressivo...")
-                    for limite in [100000, 50000, 28000]:
-                        if contexto_modelo:
-                            avg_size = len(json.dumps(contexto_modelo)) / len(contexto_modelo)
-                            num_items = max(1, int(limite / avg_size))
-                            contexto_truncado = contexto_modelo[:num_items]
-                            contextos_str = json.dumps(contexto_truncado)
-                            while len(contextos_str) > limite and num_items > 1:
-                                num_items -= 1
-                                contexto_truncado = contexto_modelo[:num_items]
-                                contextos_str = json.dumps(contexto_truncado)
-                        else:
-                            contexto_truncado = []
-                            contextos_str = "[]"
-                        user_prompt_resposta = f"Pergunta: {pergunta}\nContexto: {contextos_str}\nResponda de forma clara e objetiva."
-                        resposta, tempo_resposta, erro = chamar_openrouter(modelo, system_prompts["resposta"], user_prompt_resposta)
-                        if erro is None:
-                            print(f"[INFO] Sucesso com truncamento de {limite} chars")
-                            contextos[modelo] = contexto_truncado
-                            break
-                    else:
-                        print("[ERROR] Falha mesmo com truncamento mínimo")
-                        resposta = ""
-                        contextos[modelo] = []
-                elif modo_contexto == "resumir":
-                    print("[INFO] Gerando resumo com Gemini...")
-                    system_prompt_resumo = "Você é um assistente especializado em resumir textos legais. Sua tarefa é criar um resumo bem estruturado e rico do contexto fornecido, preservando todos os detalhes essenciais, dados importantes e informações chave. Não invente nada novo; use apenas o conteúdo existente. Estruture o resumo de forma clara, mantendo a riqueza do original."
-                    resumo, _, erro_resumo = chamar_openrouter("google/gemini-2.5-flash", system_prompt_resumo, f"Resuma o seguinte contexto: {contextos_str}", json_output=False)
-                    if erro_resumo is None:
-                        contextos_str = resumo
-                        user_prompt_resposta = f"Pergunta: {pergunta}\nContexto: {contextos_str}\nResponda de forma clara e objetiva."
-                        resposta, tempo_resposta, erro = chamar_openrouter(modelo, system_prompts["resposta"], user_prompt_resposta)
-                        print("[INFO] Resumo gerado e resposta obtida")
-                        contextos[modelo] = resumo
-                    else:
-                        print("[ERROR] Falha ao gerar resumo")
-                        resposta = ""
-                        contextos[modelo] = []
-            else:
-                print("[INFO] Resposta gerada com sucesso na primeira tentativa")
-                contextos[modelo] = contexto_truncado
+            # 4. Gerar Resposta (só respostas sem erro ficam no cache)
+            resultado = grafo.celula(
+                "resposta", {"pergunta": pergunta, "modelo": modelo, "system_prompt": system_prompts["resposta"], "contexto": empacotado,
+                             "documentos": contexto_modelo, "limite": limite, "modo_contexto": modo_contexto},
+                lambda: gerar_resposta(pergunta, modelo, system_prompts["resposta"], contexto_modelo, empacotado, limite, modo_contexto, opcoes_chamada),
+                descricao=descricao, guardar=lambda v: v["erro"] is None and bool(v["resposta"]) and not v.get("falha_resumo"))
+            if resultado is estagios.PENDENTE:
+                respostas[modelo] = estagios.PENDENTE
+                contextos[modelo] = estagios.PENDENTE
+                continue
+            resposta, tempo_resposta, erro = resultado["resposta"], resultado["tempo"], resultado["erro"]
+            contextos[modelo] = resultado["contexto"]
         
+        if erro == "deadline":
+            issues[modelo].append("Prazo da pergunta esgotado antes da resposta")
         if not resposta or len(resposta.strip()) < 10:
             issues[modelo].append("Resposta vazia ou muito curta gerada pelo modelo")
         
@@ -0,0 +1,220 @@
+# perfil.py
+# Perfil de CPU e memória por etapa do pipeline (run.py --profile cpu|mem). Cada estágio do grafo
+# (queries, recuperação, contexto, resposta, cada métrica) e as etapas de main (consulta, avaliação,
+# relatório) são marcados com etapa(nome). No modo cpu, uma thread amostra as pilhas das threads que
+# estão dentro de alguma etapa (tempo de parede: espera de rede aparece como espera) e grava, por
+# etapa, pilhas no formato "collapsed" do flamegraph.pl / speedscope. No modo mem, o tracemalloc
+# compara snapshots na entrada e na saída de cada etapa e grava os locais que mais alocaram e o
+# pico de memória da etapa.
+# Sem --profile, etapa() devolve um contexto vazio e não mede nada.
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+DIR_PERFIL = os.path.join("results", "profile")
+MODOS = ("cpu", "mem")
+INTERVALO_AMOSTRAGEM = 0.005
+TOP_ALOCACOES = 30
+
+_modo = None
+_lock = threading.Lock()
+_NADA = nullcontext()
+_etapas_thread = {}
+_tempos = defaultdict(lambda: {"chamadas": 0, "segundos": 0.0})
+_amostras = defaultdict(Counter)
+_alocacoes = defaultdict(Counter)
+_picos = defaultdict(int)
+_picos_thread = threading.local()
+_rotulos = {}
+_parar = threading.Event()
+_amostrador = None
+
+
+def ativo() -> bool:
+    return _modo is not None
+
+
+def etapa(nome: str):
+    """Contexto que atribui o trecho à etapa nome (etapas podem ser aninhadas)."""
+    if _modo is None:
+        return _NADA
+    return _medir(nome)
+
+
+@contextmanager
+def _medir(nome: str):
+    thread = threading.get_ident()
+    with _lock:
+        pilha = _etapas_thread.setdefault(thread, [])
+        pilha.append(nome)
+    antes = None
+    if _modo == "mem":
+        antes = _snapshot()
+        inicial, pico_anterior = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        abertas = _picos_thread.__dict__.setdefault("abertas", [])
+        abertas.append(0)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        if antes is not None:
+            # Inclui o que as etapas aninhadas (e outras threads no mesmo intervalo) alocaram
+            diferencas = _snapshot().compare_to(antes, "lineno")
+            # reset_peak zera o pico das etapas externas: o pico de cada etapa é o maior entre o
+            # atual e os das etapas aninhadas, repassado à etapa de fora ao sair
+            pico = max(tracemalloc.get_traced_memory()[1], abertas.pop())
+            if abertas:
+                abertas[-1] = max(abertas[-1], pico_anterior, pico)
+        with _lock:
+            pilha.pop()
+            if not pilha:
+                del _etapas_thread[thread]
+            _tempos[nome]["chamadas"] += 1
+            _tempos[nome]["segundos"] += duracao
+            if antes is not None:
+                _picos[nome] = max(_picos[nome], pico - inicial)
+                for diferenca in diferencas:
+                    if diferenca.size_diff:
+                        quadro = diferenca.traceback[0]
+                        _alocacoes[nome][f"{quadro.filename}:{quadro.lineno}"] += diferenca.size_diff
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+
+
+def _rotulo(codigo) -> str:
+    rotulo = _rotulos.get(codigo)
+    if rotulo is None:
+        rotulo = f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})".replace(";", ",")
+        _rotulos[codigo] = rotulo
+    return rotulo
+
+
+def _amostrar():
+    propria = threading.get_ident()
+    while not _parar.wait(INTERVALO_AMOSTRAGEM):
+        with _lock:
+            etapas = {thread: ";".join(pilha) for thread, pilha in _etapas_thread.items()}
+        if not etapas:
+            continue
+        quadros = sys._current_frames()
+        amostras = []
+        for thread, caminho_etapas in etapas.items():
+            quadro = quadros.get(thread)
+            if quadro is None or thread == propria:
+                continue
+            funcoes = []
+            while quadro is not None:
+                funcoes.append(_rotulo(quadro.f_code))
+                quadro = quadro.f_back
+            amostras.append((caminho_etapas, ";".join(reversed(funcoes))))
+        with _lock:
+            for caminho_etapas, pilha in amostras:
+                _amostras[caminho_etapas][pilha] += 1
+
+
+def iniciar(modo: str):
+    """Liga o perfil (modo "cpu" ou "mem"); modo vazio não faz nada."""
+    global _modo, _amostrador
+    if not modo:
+        return
+    if modo not in MODOS:
+        raise ValueError(f"Modo de perfil inválido: {modo} (use {', '.join(MODOS)})")
+    _modo = modo
+    if modo == "cpu":
+        _parar.clear()
+        _amostrador = threading.Thread(target=_amostrar, name="perfil", daemon=True)
+        _amostrador.start()
+    else:
+        # Um quadro por alocação basta para agrupar por linha e mantém o custo baixo
+        tracemalloc.start()
+    print(f"[INFO] Perfil de {'CPU' if modo == 'cpu' else 'memória'} ativo - resultados em {DIR_PERFIL}")
+
+
+def descartar():
+    """Desliga o perfil sem gravar nada. Usado nos processos criados com fork, que herdam o estado
+    do pai, mas não a thread de amostragem."""
+    global _modo, _amostrador
+    if _modo == "mem":
+        tracemalloc.stop()
+    _modo = None
+    _amostrador = None
+    _etapas_thread.clear()
+    _picos_thread.__dict__.clear()
+
+
+def _nome_arquivo(nome: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in nome)
+
+
+def finalizar(diretorio: str = DIR_PERFIL):
+    """Desliga o perfil e grava os arquivos por etapa e o resumo.json."""
+    global _modo, _amostrador
+    if _modo is None:
+        return
+    modo = _modo
+    pico_mb = None
+    if modo == "cpu":
+        _parar.set()
+        _amostrador.join()
+        _amostrador = None
+    else:
+        pico_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    _modo = None
+
+    os.makedirs(diretorio, exist_ok=True)
+    resumo = {"modo": modo, "etapas": {}}
+    if modo == "cpu":
+        resumo["intervalo_amostragem_s"] = INTERVALO_AMOSTRAGEM
+        por_etapa = defaultdict(Counter)
+        with open(os.path.join(diretorio, "cpu_todas.folded"), "w", encoding="utf-8") as todas:
+            for caminho_etapas, pilhas in _amostras.items():
+                for pilha, amostras in pilhas.items():
+                    # Etapas como raiz do flamegraph geral; nos arquivos por etapa, só a pilha
+                    todas.write(f"{caminho_etapas};{pilha} {amostras}\n")
+                    por_etapa[caminho_etapas.split(";")[-1]][pilha] += amostras
+        for nome, pilhas in por_etapa.items():
+            with open(os.path.join(diretorio, f"cpu_{_nome_arquivo(nome)}.folded"), "w", encoding="utf-8") as f:
+                for pilha, amostras in pilhas.most_common():
+                    f.write(f"{pilha} {amostras}\n")
+    else:
+        resumo["pico_memoria_rastreada_mb"] = pico_mb
+        for nome, locais in _alocacoes.items():
+            with open(os.path.join(diretorio, f"mem_{_nome_arquivo(nome)}.txt"), "w", encoding="utf-8") as f:
+                f.write(f"Locais com maior alocação líquida na etapa '{nome}' (inclui etapas aninhadas)\n")
+                for local, tamanho in sorted(locais.items(), key=lambda item: -abs(item[1]))[:TOP_ALOCACOES]:
+                    f.write(f"{tamanho / 1024:>12.1f} KiB  {local}\n")
+
+    for nome, tempo in _tempos.items():
+        dados = {"chamadas": tempo["chamadas"], "segundos": tempo["segundos"]}
+        if modo == "cpu":
+            dados["amostras"] = sum(sum(pilhas.values()) for caminho, pilhas in _amostras.items() if caminho.split(";")[-1] == nome)
+        else:
+            dados["alocacao_liquida_mb"] = sum(_alocacoes[nome].values()) / (1024 * 1024)
+            dados["pico_mb"] = _picos[nome] / (1024 * 1024)
+        resumo["etapas"][nome] = dados
+    with open(os.path.join(diretorio, "resumo.json"), "w", encoding="utf-8") as f:
+        json.dump(resumo, f, ensure_ascii=False, indent=2)
+
+    print(f"\n[INFO] Perfil por etapa ({modo}):")
+    for nome, dados in sorted(resumo["etapas"].items(), key=lambda item: -item[1]["segundos"]):
+        extra = f"{dados['amostras']:>8} amostras" if modo == "cpu" else f"{dados['alocacao_liquida_mb']:>9.1f} MB líquidos, pico {dados['pico_mb']:.1f} MB"
+        print(f"  {nome:<18} {dados['chamadas']:>6} chamadas {dados['segundos']:>9.2f}s {extra}")
+    print(f"[INFO] Arquivos do perfil salvos em {diretorio}")
+    _tempos.clear()
+    _amostras.clear()
+    _alocacoes.clear()
+    _picos.clear()
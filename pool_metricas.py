@@ -0,0 +1,155 @@
+# pool_metricas.py
+# Avaliação em vários processos sem carregar os modelos em cada um: o processo principal carrega
+# embeddings, BERTScore e (se usado) o juiz local, e só então cria os trabalhadores com fork, que
+# herdam os pesos já na memória e os compartilham com o pai (copy-on-write; os tensores não são
+# escritos na inferência). Cada pergunta vira um job por modelo, executado em paralelo (um job só
+# com o juiz local, para que o NLI avalie os modelos da pergunta em lote). Requer o método fork
+# (Linux/macOS); sem ele, a avaliação continua no processo principal.
+import gc
+import multiprocessing
+import os
+import sys
+from collections import Counter
+
+import estagios
+import estatisticas
+import juiz_local
+import limitador
+import metrics
+import perfil
+
+_grafo = None
+
+
+def memoria_processo(pid="self") -> dict:
+    """RSS, PSS (memória compartilhada dividida entre os processos que a usam) e memória privada, em MB.
+    PSS e privada vêm de /proc/<pid>/smaps_rollup (Linux); fora dele, só o pico de RSS."""
+    try:
+        campos = {}
+        with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as f:
+            for linha in f:
+                partes = linha.split()
+                if len(partes) >= 2 and partes[0].endswith(":") and partes[1].isdigit():
+                    campos[partes[0][:-1]] = int(partes[1]) / 1024
+        return {
+            "rss_mb": campos.get("Rss", 0.0),
+            "pss_mb": campos.get("Pss", 0.0),
+            "privada_mb": campos.get("Private_Clean", 0.0) + campos.get("Private_Dirty", 0.0),
+        }
+    except OSError:
+        import resource
+        # ru_maxrss: KB no Linux, bytes no macOS
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss_mb": pico / (1024 * 1024 if sys.platform == "darwin" else 1024)}
+
+
+def _iniciar_trabalhador(caminho_estagios, recalcular, threads, processos):
+    global _grafo
+    # O tempo dos jobs fica na etapa "avaliacao" do processo principal
+    perfil.descartar()
+    # O estado do limitador é copiado no fork: cada trabalhador fica com uma fração da concorrência
+    # e da taxa, para que juntos não passem dos limites configurados no processo principal
+    config = limitador.CONFIG
+    limitador.configurar(
+        limite_max=max(1, config["limite_max"] // processos),
+        limite_inicial=max(1, config["limite_inicial"] // processos),
+        requisicoes_por_segundo=config["requisicoes_por_segundo"] / processos,
+        rajada=max(1, config["rajada"] // processos),
+    )
+    # Conexão SQLite própria: a do pai não pode ser usada depois do fork
+    _grafo = estagios.GrafoEstagios(caminho_estagios, recalcular=recalcular) if caminho_estagios else None
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _avaliar_job(job):
+    """Executa avaliar_respostas para os modelos do job. Retorna as métricas e o que o pai precisa somar:
+    contagem de células, contadores de estatísticas e a memória do trabalhador."""
+    respostas, contextos, logs, pergunta, referencia, juizes, api_key = job
+    antes = dict(estatisticas.obter_estatisticas()["contadores"])
+    if _grafo is not None:
+        _grafo.contagem.clear()
+    avaliacoes = metrics.avaliar_respostas(respostas, contextos, pergunta, logs, referencia, juizes=juizes, grafo=_grafo, api_key=api_key)
+    depois = estatisticas.obter_estatisticas()["contadores"]
+    contadores = {campo: valor - antes.get(campo, 0) for campo, valor in depois.items() if isinstance(valor, (int, float)) and valor != antes.get(campo, 0)}
+    contagem = {estagio: dict(c) for estagio, c in _grafo.contagem.items()} if _grafo is not None else {}
+    return {modelo: avaliacoes.get(modelo, {"erro": "Erro na avaliação"}) for modelo in respostas}, contagem, contadores, os.getpid(), memoria_processo()
+
+
+class PoolMetricas:
+    """Trabalhadores criados com fork depois de os modelos serem carregados no processo principal."""
+
+    def __init__(self, processos: int, juizes: dict = None, caminho_estagios: str = None, recalcular=()):
+        self.processos = processos
+        self.memoria = {}
+        print("[INFO] Carregando modelos de avaliação antes de criar os trabalhadores...")
+        metrics.carregar_modelos()
+        if "local" in (juizes or {}).values():
+            juiz_local.carregar_modelo()
+        self.memoria_pai_antes = memoria_processo()
+        threads = max(1, (os.cpu_count() or 1) // processos)
+        # Objetos já existentes saem do coletor de lixo: a coleta nos trabalhadores não escreve
+        # nos cabeçalhos deles, o que copiaria as páginas compartilhadas
+        gc.freeze()
+        contexto = multiprocessing.get_context("fork")
+        self._pool = contexto.Pool(processos, initializer=_iniciar_trabalhador, initargs=(caminho_estagios, tuple(recalcular or ()), threads, processos))
+        print(f"[INFO] Pool de avaliação: {processos} processos, {threads} threads de CPU cada, modelos compartilhados com o processo principal "
+              f"(RSS do principal: {self.memoria_pai_antes['rss_mb']:.0f} MB)")
+
+    @staticmethod
+    def disponivel() -> bool:
+        return "fork" in multiprocessing.get_all_start_methods()
+
+    def avaliar(self, respostas, contextos, pergunta, logs, ground_truth=None, juizes=None, grafo=None, api_key=None):
+        """Mesma interface e resultado de metrics.avaliar_respostas, com um job por modelo (ou um só
+        job com o juiz local, que avalia em lote). O ground truth simulado é gerado aqui, uma vez,
+        e enviado a todos os jobs."""
+        grafo = grafo or estagios.SEM_CACHE
+        juiz = []
+        def llm():
+            if not juiz:
+                juiz.append(metrics.criar_juiz_llm(api_key))
+            return juiz[0]
+        referencia = metrics.obter_referencia(pergunta, respostas, contextos, ground_truth, grafo, llm)
+        grupos = [list(respostas)] if "local" in (juizes or {}).values() else [[modelo] for modelo in respostas]
+        jobs = [({m: respostas[m] for m in grupo}, {m: contextos.get(m, []) for m in grupo}, {m: logs.get(m) for m in grupo},
+                 pergunta, referencia, juizes, api_key) for grupo in grupos if grupo]
+        avaliacoes = {}
+        for metricas_job, contagem, contadores, pid, memoria in self._pool.map(_avaliar_job, jobs, chunksize=1):
+            avaliacoes.update(metricas_job)
+            with grafo._lock:
+                for estagio, valores in contagem.items():
+                    grafo.contagem[estagio].update(Counter(valores))
+            for campo, valor in contadores.items():
+                estatisticas.registrar(campo, valor)
+            self.memoria[pid] = memoria
+        return avaliacoes
+
+    def resumo(self) -> dict:
+        trabalhadores = list(self.memoria.values())
+        resumo = {
+            "processos": self.processos,
+            "principal": memoria_processo(),
+            "trabalhadores": {str(pid): memoria for pid, memoria in self.memoria.items()},
+        }
+        for campo in ("rss_mb", "pss_mb", "privada_mb"):
+            valores = [m[campo] for m in trabalhadores if campo in m]
+            if valores:
+                resumo[f"{campo}_medio_trabalhador"] = sum(valores) / len(valores)
+        return resumo
+
+    def imprimir_memoria(self):
+        resumo = self.resumo()
+        principal = resumo["principal"]
+        print(f"[INFO] Memória do processo principal: RSS {principal['rss_mb']:.0f} MB" + (f", PSS {principal['pss_mb']:.0f} MB" if "pss_mb" in principal else ""))
+        for pid, memoria in resumo["trabalhadores"].items():
+            detalhes = f", PSS {memoria['pss_mb']:.0f} MB, privada {memoria['privada_mb']:.0f} MB" if "pss_mb" in memoria else ""
+            print(f"[INFO] Trabalhador {pid}: RSS {memoria['rss_mb']:.0f} MB{detalhes}")
+
+    def fechar(self):
+        self._pool.close()
+        self._pool.join()
+        gc.unfreeze()
@@ -0,0 +1,141 @@
+# progresso.py
+# Eventos de progresso do pipeline. Vão para os ouvintes registrados no próprio processo (interface
+# web executando o pipeline em uma thread) e, em JSON lines, para o arquivo indicado pela variável
+# de ambiente EVALAI_PROGRESSO_ARQUIVO. Sem ouvintes nem variável, emitir() não faz nada.
+import json
+import os
+import threading
+import time
+
+VARIAVEL_ARQUIVO = "EVALAI_PROGRESSO_ARQUIVO"
+
+_lock = threading.Lock()
+_arquivo = None
+_ouvintes = []
+
+
+def adicionar_ouvinte(funcao):
+    """Registra funcao(evento: dict), chamada na thread que emitiu o evento."""
+    with _lock:
+        _ouvintes.append(funcao)
+
+
+def remover_ouvinte(funcao):
+    with _lock:
+        if funcao in _ouvintes:
+            _ouvintes.remove(funcao)
+
+
+def _abrir():
+    global _arquivo
+    if _arquivo is None:
+        caminho = os.getenv(VARIAVEL_ARQUIVO)
+        if not caminho:
+            return None
+        _arquivo = open(caminho, "a", encoding="utf-8")
+    return _arquivo
+
+
+def emitir(evento: str, **dados):
+    """Publica um evento {"evento", "t", **dados}. Falhas nunca interrompem o pipeline."""
+    registro = {"evento": evento, "t": time.time(), **dados}
+    try:
+        with _lock:
+            ouvintes = list(_ouvintes)
+            arquivo = _abrir()
+            if arquivo is not None:
+                arquivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                arquivo.flush()
+        for ouvinte in ouvintes:
+            ouvinte(registro)
+    except Exception as e:
+        print(f"[WARN] Não foi possível registrar progresso: {e}")
+
+
+def descrever(evento: dict) -> str:
+    """Linha de log legível para um evento (usada pela interface web no lugar da saída do console)."""
+    tipo = evento.get("evento")
+    hora = time.strftime("%H:%M:%S", time.localtime(evento.get("t", time.time())))
+    if tipo == "inicio":
+        texto = f"Início: {evento.get('total_perguntas')} perguntas x {len(evento.get('modelos') or [])} modelos"
+    elif tipo == "etapa":
+        texto = f"Pergunta {evento.get('pergunta')}/{evento.get('total_perguntas')}: {evento.get('etapa')}"
+    elif tipo == "modelo_concluido":
+        texto = f"Pergunta {evento.get('pergunta')}: {evento.get('modelo')} concluído (resposta em {evento.get('tempo_resposta') or 0:.1f}s)"
+    elif tipo == "modelo_falhou":
+        erro = f" - {evento['erro']}" if evento.get("erro") else ""
+        texto = f"Pergunta {evento.get('pergunta')}: {evento.get('modelo')} falhou{erro}"
+    elif tipo == "parada":
+        texto = f"Parada: {evento.get('motivo')} ({evento.get('perguntas_avaliadas')}/{evento.get('total_perguntas')} perguntas)"
+    elif tipo == "fim":
+        texto = f"Fim: {evento.get('resultados')} resultados em {evento.get('duracao') or 0:.1f}s"
+    else:
+        texto = json.dumps({k: v for k, v in evento.items() if k != "t"}, ensure_ascii=False)
+    return f"[{hora}] {texto}"
+
+
+class LeitorProgresso:
+    """Lê incrementalmente um arquivo de eventos, guardando linhas ainda incompletas para a próxima leitura."""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.posicao = 0
+        self.pendente = ""
+
+    def novos_eventos(self) -> list:
+        try:
+            with open(self.caminho, "r", encoding="utf-8") as f:
+                f.seek(self.posicao)
+                self.pendente += f.read()
+                self.posicao = f.tell()
+        except OSError:
+            return []
+        *linhas, self.pendente = self.pendente.split("\n")
+        eventos = []
+        for linha in linhas:
+            try:
+                eventos.append(json.loads(linha))
+            except ValueError:
+                continue
+        return eventos
+
+
+class EstadoProgresso:
+    """Agrega os eventos em unidades concluídas (pergunta x modelo) e estima o tempo restante."""
+
+    def __init__(self):
+        self.total = 0
+        self.concluidos = 0
+        self.inicio = None
+        self.etapa = ""
+        self.finalizado = False
+
+    def aplicar(self, evento: dict):
+        tipo = evento.get("evento")
+        if tipo == "inicio":
+            self.total = evento.get("total", 0)
+            self.inicio = evento.get("t")
+            self.etapa = "Iniciando"
+        elif tipo == "etapa":
+            self.etapa = f"Pergunta {evento.get('pergunta')}/{evento.get('total_perguntas')}: {evento.get('etapa')}"
+        elif tipo in ("modelo_concluido", "modelo_falhou"):
+            self.concluidos += 1
+        elif tipo == "parada" and evento.get("motivo") != "todas_as_perguntas":
+            # Parada antecipada: as unidades restantes não serão executadas
+            self.total = self.concluidos
+            self.etapa = f"Parada antecipada ({evento.get('motivo')})"
+        elif tipo == "fim":
+            self.finalizado = True
+            self.etapa = "Concluído"
+
+    def fracao(self) -> float:
+        if self.finalizado:
+            return 1.0
+        return min(1.0, self.concluidos / self.total) if self.total else 0.0
+
+    def eta_segundos(self):
+        """Tempo restante pela taxa média observada; None antes da primeira unidade concluída."""
+        if not self.inicio or not self.concluidos or self.finalizado:
+            return None
+        decorrido = time.time() - self.inicio
+        return decorrido / self.concluidos * (self.total - self.concluidos)
@@ -0,0 +1,174 @@
+# registro_modelos.py
+import argparse
+import json
+import os
+import threading
+import time
+
+import requests
+
+URL_MODELOS = "https://openrouter.ai/api/v1/models"
+DIR_BASE = os.path.dirname(os.path.abspath(__file__))
+ARQUIVO_SNAPSHOT = os.path.join(DIR_BASE, "modelos_snapshot.json")
+ARQUIVO_OVERRIDES = os.path.join(DIR_BASE, "modelos_overrides.json")
+ARQUIVO_CACHE = os.path.join("cache", "modelos_openrouter.json")
+VALIDADE_CACHE_S = 24 * 3600
+
+# Estimativa conservadora para texto jurídico em português (tokenizadores costumam dar ~3.5-4)
+CHARS_POR_TOKEN = 3.0
+# Reserva para a resposta quando o modelo não informa max_completion_tokens
+TOKENS_RESPOSTA_PADRAO = 4096
+# Folga para a formatação das mensagens e variações entre tokenizadores
+MARGEM_SEGURANCA = 0.9
+# Provedores em que o cache de prompt depende de marcações cache_control nas mensagens; nos demais
+# (OpenAI, DeepSeek, Grok...) o cache do prefixo é automático
+PREFIXOS_CACHE_CONTROL = ("anthropic/", "google/gemini")
+
+CAPACIDADES_PADRAO = {
+    "context_length": None,
+    "max_completion_tokens": None,
+    "suporta_json": True,
+    "preco_prompt": 0.0,
+    "preco_completion": 0.0,
+    # Sem preço de cache informado, tokens lidos do cache custam o preço normal do prompt
+    "preco_cache_leitura": None,
+    "preco_cache_escrita": None,
+    # None: decidido por PREFIXOS_CACHE_CONTROL (pode ser fixado em modelos_overrides.json)
+    "cache_control": None,
+    "conhecido": False,
+}
+
+_registro = None
+_lock = threading.Lock()
+
+
+def _normalizar_openrouter(entrada: dict) -> dict:
+    parametros = entrada.get("supported_parameters") or []
+    top = entrada.get("top_provider") or {}
+    precos = entrada.get("pricing") or {}
+    return {
+        "context_length": top.get("context_length") or entrada.get("context_length"),
+        "max_completion_tokens": top.get("max_completion_tokens"),
+        "suporta_json": "response_format" in parametros or "structured_outputs" in parametros,
+        "preco_prompt": float(precos.get("prompt") or 0),
+        "preco_completion": float(precos.get("completion") or 0),
+        "preco_cache_leitura": float(precos["input_cache_read"]) if precos.get("input_cache_read") else None,
+        "preco_cache_escrita": float(precos["input_cache_write"]) if precos.get("input_cache_write") else None,
+    }
+
+
+def _ler_json(caminho: str):
+    try:
+        with open(caminho, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def atualizar_cache(timeout: int = 15) -> dict:
+    """Baixa a listagem de modelos do OpenRouter e grava o cache local normalizado."""
+    resp = requests.get(URL_MODELOS, timeout=timeout)
+    resp.raise_for_status()
+    modelos = {m["id"]: _normalizar_openrouter(m) for m in resp.json().get("data", []) if m.get("id")}
+    os.makedirs(os.path.dirname(ARQUIVO_CACHE), exist_ok=True)
+    with open(ARQUIVO_CACHE, "w", encoding="utf-8") as f:
+        json.dump({"atualizado_em": time.time(), "modelos": modelos}, f, ensure_ascii=False)
+    print(f"[INFO] Registro de modelos atualizado: {len(modelos)} modelos do OpenRouter")
+    return modelos
+
+
+def carregar_registro(atualizar: bool = False) -> dict:
+    """Retorna {modelo: capacidades}, na prioridade overrides > cache do OpenRouter > snapshot embarcado."""
+    global _registro
+    with _lock:
+        if _registro is not None and not atualizar:
+            return _registro
+
+        registro = {}
+        snapshot = _ler_json(ARQUIVO_SNAPSHOT) or {}
+        registro.update(snapshot.get("modelos", {}))
+
+        cache = _ler_json(ARQUIVO_CACHE)
+        cache_valido = cache is not None and time.time() - cache.get("atualizado_em", 0) < VALIDADE_CACHE_S
+        if (atualizar or not cache_valido) and os.getenv("EVALAI_REGISTRO_OFFLINE") != "1":
+            try:
+                cache = {"modelos": atualizar_cache()}
+            except Exception as e:
+                print(f"[WARN] Não foi possível atualizar o registro de modelos ({e}) - usando cache/snapshot local")
+        if cache:
+            registro.update(cache.get("modelos", {}))
+
+        overrides = _ler_json(ARQUIVO_OVERRIDES) or {}
+        for modelo, valores in overrides.items():
+            registro[modelo] = {**registro.get(modelo, {}), **valores}
+
+        _registro = registro
+        return _registro
+
+
+def obter_capacidades(modelo: str) -> dict:
+    capacidades = carregar_registro().get(modelo)
+    if capacidades is None:
+        return dict(CAPACIDADES_PADRAO)
+    return {**CAPACIDADES_PADRAO, **capacidades, "conhecido": True}
+
+
+def suporta_json(modelo: str) -> bool:
+    return bool(obter_capacidades(modelo)["suporta_json"])
+
+
+def orcamento_contexto_chars(modelo: str, chars_fixos: int = 0, maximo: int = None) -> int:
+    """Quantos caracteres de contexto cabem no prompt do modelo, descontando a reserva para a
+    resposta e os chars_fixos (system prompt, pergunta e instruções). Limitado a maximo."""
+    capacidades = obter_capacidades(modelo)
+    context_length = capacidades["context_length"]
+    if not context_length:
+        return maximo
+    reserva = capacidades["max_completion_tokens"] or TOKENS_RESPOSTA_PADRAO
+    reserva = min(reserva, context_length // 4)
+    tokens_livres = (context_length - reserva) * MARGEM_SEGURANCA
+    orcamento = max(0, int(tokens_livres * CHARS_POR_TOKEN) - chars_fixos)
+    return min(orcamento, maximo) if maximo else orcamento
+
+
+def usa_cache_control(modelo: str) -> bool:
+    """Se o prefixo estável do prompt deve ir marcado com cache_control para o provedor guardá-lo."""
+    cache_control = obter_capacidades(modelo)["cache_control"]
+    if cache_control is None:
+        return modelo.startswith(PREFIXOS_CACHE_CONTROL)
+    return bool(cache_control)
+
+
+def estimar_custo(modelo: str, tokens_prompt: int, tokens_completion: int, tokens_cache: int = 0, tokens_escrita_cache: int = 0) -> float:
+    """Custo em US$. tokens_cache e tokens_escrita_cache são a parte de tokens_prompt lida do cache
+    e gravada nele, cobradas pelos preços de cache quando o registro os tem."""
+    capacidades = obter_capacidades(modelo)
+    preco_prompt = capacidades["preco_prompt"]
+    preco_leitura = capacidades["preco_cache_leitura"]
+    preco_escrita = capacidades["preco_cache_escrita"]
+    custo = tokens_prompt * preco_prompt + tokens_completion * capacidades["preco_completion"]
+    if preco_leitura is not None:
+        custo += tokens_cache * (preco_leitura - preco_prompt)
+    if preco_escrita is not None:
+        custo += tokens_escrita_cache * (preco_escrita - preco_prompt)
+    return custo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro local de capacidades dos modelos do OpenRouter.")
+    parser.add_argument('--atualizar', action='store_true', help='Baixa a listagem atual do OpenRouter para o cache local')
+    parser.add_argument('modelos', nargs='*', help='Modelos a exibir (padrão: todos do snapshot/overrides)')
+    args = parser.parse_args()
+
+    registro = carregar_registro(atualizar=args.atualizar)
+    modelos = args.modelos or sorted(set((_ler_json(ARQUIVO_SNAPSHOT) or {}).get("modelos", {})) | set(_ler_json(ARQUIVO_OVERRIDES) or {}))
+    print(f"{'Modelo':<45} {'Contexto':>9} {'JSON':>5} {'US$/1M prompt':>14} {'US$/1M compl.':>14} {'Orçamento (chars)':>18}")
+    for modelo in modelos:
+        c = obter_capacidades(modelo)
+        origem = "" if modelo in registro else " (desconhecido)"
+        print(f"{modelo + origem:<45} {str(c['context_length']):>9} {'sim' if c['suporta_json'] else 'não':>5} "
+              f"{c['preco_prompt'] * 1e6:>14.3f} {c['preco_completion'] * 1e6:>14.3f} {str(orcamento_contexto_chars(modelo)):>18}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,16 @@
 import json
 import csv
 import os
+import numpy as np
+import pandas as pd
+from armazem import registrar_run
+from significancia import bootstrap_pareado
+import esquema
 
-def salvar_resultados(resultados):
+COLUNAS_METRICAS = ['faithfulness', 'answer_relevancy', 'context_precision', 'rouge_1_f1', 'rouge_2_f1', 'bertscore_f1']
+COLUNAS_NUMERICAS = COLUNAS_METRICAS + ['tempo_geracao_queries', 'tempo_resposta', 'num_contextos', 'tokens_resposta']
+
+def salvar_resultados(resultados, metadados=None, comprimir=False, documentos=None):
     if not resultados:
         print("Nenhum resultado para salvar")
         return
@@ -12,29 +20,49 @@ def salvar_resultados(resultados):
     os.makedirs("results", exist_ok=True)
     print(f"Salvando {len(resultados)} resultados na pasta 'results'")
 
-    salvar_json_detalhado(resultados)
-    salvar_relatorio_comparacao(resultados)
+    tabela = tabela_resultados(resultados)
+    salvar_json_detalhado(resultados, comprimir, documentos)
+    salvar_relatorio_comparacao(resultados, tabela)
     salvar_csv(resultados)
+    salvar_parquet(tabela)
+    salvar_armazem(resultados, metadados)
 
     print("Arquivos salvos com sucesso na pasta 'results'")
 
-def salvar_json_detalhado(resultados):
+def salvar_armazem(resultados, metadados=None):
+    # Os arquivos acima refletem apenas o último run; o armazém guarda o histórico
     try:
-        with open("results/resultados.json", "w", encoding="utf-8") as f:
-            json.dump(resultados, f, ensure_ascii=False, indent=2)
-        print("results/resultados.json salvo")
+        return registrar_run(resultados, metadados)
+    except Exception as e:
+        print(f"Erro ao registrar run no armazém: {e}")
+
+def salvar_json_detalhado(resultados, comprimir=False, documentos=None):
+    # Formato normalizado (prompts, queries e documentos uma vez só); esquema.carregar() devolve a lista plana
+    try:
+        caminho = esquema.salvar(resultados, "results/resultados.json", comprimir, documentos)
+        print(f"{caminho} salvo")
     except Exception as e:
         print(f"Erro ao salvar JSON: {e}")
 
-def salvar_relatorio_comparacao(resultados):
+def salvar_relatorio_comparacao(resultados, tabela=None):
     try:
-        relatorio = gerar_relatorio_comparacao(resultados)
+        relatorio = gerar_relatorio_comparacao(resultados, tabela)
         with open("results/comparacao_modelos.json", "w", encoding="utf-8") as f:
             json.dump(relatorio, f, ensure_ascii=False, indent=2)
         print("results/comparacao_modelos.json salvo")
     except Exception as e:
         print(f"Erro ao salvar relatório de comparação: {e}")
 
+def salvar_parquet(tabela):
+    # Formato colunar para análises com pandas/Arrow; requer pyarrow (opcional)
+    try:
+        tabela.to_parquet("results/resultados.parquet", index=False)
+        print("results/resultados.parquet salvo")
+    except ImportError:
+        print("pyarrow não instalado - results/resultados.parquet não foi gerado")
+    except Exception as e:
+        print(f"Erro ao salvar Parquet: {e}")
+
 def salvar_csv(resultados):
     campos_csv = [
         'pergunta', 'modelo', 'resposta', 'queries_geradas',
@@ -54,91 +82,93 @@ def salvar_csv(resultados):
     except Exception as e:
         print(f"Erro ao salvar CSV: {e}")
 
-def gerar_relatorio_comparacao(resultados):
-    perguntas = {}
-    modelos_stats = {}
-
-    for resultado in resultados:
-        pergunta = resultado['pergunta']
-        modelo = resultado['modelo']
-
-        if pergunta not in perguntas:
-            perguntas[pergunta] = []
-        perguntas[pergunta].append(resultado)
-
-        if modelo not in modelos_stats:
-            modelos_stats[modelo] = {
-                'faithfulness': [], 'answer_relevancy': [], 'context_precision': [], 'rouge_1_f1': [], 'rouge_2_f1': [], 'bertscore_f1': [],
-                'tempos_queries': [], 'tempos_resposta': [], 'num_contextos': [], 'tokens_resposta': []
-            }
-
-        modelos_stats[modelo]['faithfulness'].append(resultado.get('faithfulness', 0.0))
-        modelos_stats[modelo]['answer_relevancy'].append(resultado.get('answer_relevancy', 0.0))
-        modelos_stats[modelo]['context_precision'].append(resultado.get('context_precision', 0.0))
-        modelos_stats[modelo]['rouge_1_f1'].append(resultado.get('rouge_1_f1', 0.0))
-        modelos_stats[modelo]['rouge_2_f1'].append(resultado.get('rouge_2_f1', 0.0))
-        modelos_stats[modelo]['bertscore_f1'].append(resultado.get('bertscore_f1', 0.0))
-        modelos_stats[modelo]['tempos_queries'].append(resultado.get('tempo_geracao_queries', 0.0))
-        modelos_stats[modelo]['tempos_resposta'].append(resultado.get('tempo_resposta', 0.0))
-        modelos_stats[modelo]['num_contextos'].append(resultado.get('num_contextos', 0))
-        modelos_stats[modelo]['tokens_resposta'].append(resultado.get('tokens_resposta', 0))
+def tabela_resultados(resultados):
+    """DataFrame com uma linha por resultado e as colunas numéricas já convertidas (ausentes = 0)."""
+    # Os documentos de contexto só vão para o JSON detalhado
+    df = pd.DataFrame(resultados).drop(columns=[esquema.CAMPO_CONTEXTOS], errors='ignore')
+    for coluna in COLUNAS_NUMERICAS:
+        if coluna not in df:
+            df[coluna] = 0.0
+        df[coluna] = pd.to_numeric(df[coluna], errors='coerce').fillna(0.0)
+    df['tempo_total'] = df['tempo_geracao_queries'] + df['tempo_resposta']
+    return df
+
+def _estatisticas_grupo(df, chave):
+    """{grupo: {coluna: {media, mediana, p90, desvio, min, max}}} com um group-by por estatística."""
+    grupos = df.groupby(chave, sort=False)[COLUNAS_NUMERICAS]
+    por_estatistica = {
+        'media': grupos.mean(),
+        'mediana': grupos.median(),
+        'p90': grupos.quantile(0.9),
+        'desvio': grupos.std(),
+        'min': grupos.min(),
+        'max': grupos.max(),
+    }
+    nomes = list(por_estatistica)
+    # (grupo, coluna, estatística); NaN vira None porque não é JSON válido
+    valores = np.stack([tabela[COLUNAS_NUMERICAS].to_numpy(dtype=float) for tabela in por_estatistica.values()], axis=-1)
+    valores = np.where(np.isnan(valores), None, valores).tolist()
+    return {
+        grupo: {coluna: dict(zip(nomes, valores[i][j])) for j, coluna in enumerate(COLUNAS_NUMERICAS)}
+        for i, grupo in enumerate(por_estatistica['media'].index)
+    }
+
+def _melhor_por_pergunta(df, metrica):
+    # Primeiro modelo com o maior score estritamente positivo; sem nenhum, modelo vazio e score 0.0
+    positivos = df[df[metrica] > 0]
+    melhores = df.loc[positivos.groupby('pergunta', sort=False)[metrica].idxmax()]
+    return {
+        pergunta: {'modelo': modelo, 'score': score}
+        for pergunta, modelo, score in zip(melhores['pergunta'].tolist(), melhores['modelo'].tolist(), melhores[metrica].astype(float).tolist())
+    }
+
+def gerar_relatorio_comparacao(resultados, tabela=None):
+    df = tabela if tabela is not None else tabela_resultados(resultados)
+    perguntas = list(dict.fromkeys(df['pergunta']))
 
     comparacao = {
         'resumo_geral': {
             'total_perguntas': len(perguntas),
-            'total_modelos': len(modelos_stats),
-            'total_avaliacoes': len(resultados)
+            'total_modelos': int(df['modelo'].nunique()),
+            'total_avaliacoes': len(df)
         },
         'comparacao_por_pergunta': {},
         'estatisticas_por_modelo': {},
-        'ranking_modelos': []
+        'ranking_modelos': [],
+        'estatisticas_detalhadas_por_modelo': _estatisticas_grupo(df, 'modelo'),
+        'estatisticas_por_pergunta': _estatisticas_grupo(df, 'pergunta')
     }
 
-    for pergunta, resultados_pergunta in perguntas.items():
+    melhor_faith = _melhor_por_pergunta(df, 'faithfulness')
+    melhor_relevancy = _melhor_por_pergunta(df, 'answer_relevancy')
+    colunas_pergunta = COLUNAS_METRICAS + ['num_contextos', 'tempo_total']
+    for pergunta in perguntas:
         comparacao['comparacao_por_pergunta'][pergunta] = {
             'modelos': {},
-            'melhor_faithfulness': {'modelo': '', 'score': 0.0},
-            'melhor_relevancy': {'modelo': '', 'score': 0.0}
+            'melhor_faithfulness': melhor_faith.get(pergunta, {'modelo': '', 'score': 0.0}),
+            'melhor_relevancy': melhor_relevancy.get(pergunta, {'modelo': '', 'score': 0.0})
         }
-
-        for resultado in resultados_pergunta:
-            modelo = resultado['modelo']
-            faith = resultado.get('faithfulness', 0.0)
-            relevancy = resultado.get('answer_relevancy', 0.0)
-
-            comparacao['comparacao_por_pergunta'][pergunta]['modelos'][modelo] = {
-                'faithfulness': faith,
-                'answer_relevancy': relevancy,
-                'context_precision': resultado.get('context_precision', 0.0),
-                'rouge_1_f1': resultado.get('rouge_1_f1', 0.0),
-                'rouge_2_f1': resultado.get('rouge_2_f1', 0.0),
-                'bertscore_f1': resultado.get('bertscore_f1', 0.0),
-                'num_contextos': resultado.get('num_contextos', 0),
-                'tempo_total': resultado.get('tempo_geracao_queries', 0.0) + resultado.get('tempo_resposta', 0.0)
-            }
-
-            if faith > comparacao['comparacao_por_pergunta'][pergunta]['melhor_faithfulness']['score']:
-                comparacao['comparacao_por_pergunta'][pergunta]['melhor_faithfulness'] = {'modelo': modelo, 'score': faith}
-
-            if relevancy > comparacao['comparacao_por_pergunta'][pergunta]['melhor_relevancy']['score']:
-                comparacao['comparacao_por_pergunta'][pergunta]['melhor_relevancy'] = {'modelo': modelo, 'score': relevancy}
-
-    for modelo, stats in modelos_stats.items():
-        def avg(lst):
-            return sum(lst) / len(lst) if lst else 0.0
-
+    colunas = {coluna: df[coluna].astype(float).tolist() for coluna in colunas_pergunta}
+    colunas['num_contextos'] = df['num_contextos'].astype(int).tolist()
+    for k, (pergunta, modelo) in enumerate(zip(df['pergunta'].tolist(), df['modelo'].tolist())):
+        comparacao['comparacao_por_pergunta'][pergunta]['modelos'][modelo] = {coluna: colunas[coluna][k] for coluna in colunas_pergunta}
+
+    grupos = df.groupby('modelo', sort=False)
+    medias = grupos[COLUNAS_NUMERICAS].mean()
+    contagens = grupos.size()
+    for modelo, media in medias.iterrows():
         comparacao['estatisticas_por_modelo'][modelo] = {
-            'faithfulness_media': avg(stats['faithfulness']),
-            'answer_relevancy_media': avg(stats['answer_relevancy']),
-            'context_precision_media': avg(stats['context_precision']),
-            'rouge_1_f1_media': avg(stats['rouge_1_f1']),
-            'rouge_2_f1_media': avg(stats['rouge_2_f1']),
-            'bertscore_f1_media': avg(stats['bertscore_f1']),
-            'tempo_queries_medio': avg(stats['tempos_queries']),
-            'tempo_resposta_medio': avg(stats['tempos_resposta']),
-            'contextos_medio': avg(stats['num_contextos']),
-            'tokens_medio': avg(stats['tokens_resposta']),
-            'total_avaliacoes': len(stats['faithfulness'])
+            'faithfulness_media': float(media['faithfulness']),
+            'answer_relevancy_media': float(media['answer_relevancy']),
+            'context_precision_media': float(media['context_precision']),
+            'rouge_1_f1_media': float(media['rouge_1_f1']),
+            'rouge_2_f1_media': float(media['rouge_2_f1']),
+            'bertscore_f1_media': float(media['bertscore_f1']),
+            'tempo_queries_medio': float(media['tempo_geracao_queries']),
+            'tempo_resposta_medio': float(media['tempo_resposta']),
+            'contextos_medio': float(media['num_contextos']),
+            'tokens_medio': float(media['tokens_resposta']),
+            'total_avaliacoes': int(contagens[modelo])
         }
 
     ranking = []
@@ -154,4 +184,20 @@ def gerar_relatorio_comparacao(resultados):
     ranking.sort(key=lambda x: x['score_combinado'], reverse=True)
     comparacao['ranking_modelos'] = ranking
 
-    return comparacao
\ No newline at end of file
+    # Intervalos de confiança e comparações par a par por bootstrap pareado nas perguntas
+    significancia = bootstrap_pareado(df)
+    comparacao['significancia'] = significancia
+    for item in ranking:
+        combinado = significancia['modelos'].get(item['modelo'], {}).get('score_combinado', {})
+        item['score_combinado_ic_inf'] = combinado.get('ic_inf')
+        item['score_combinado_ic_sup'] = combinado.get('ic_sup')
+        item['prob_melhor'] = combinado.get('prob_melhor')
+    # Empate técnico: diferença para o modelo imediatamente acima não é significativa
+    significativos = {(p['modelo_a'], p['modelo_b']): p['significativo'] for p in significancia['pares'] if p['metrica'] == 'score_combinado'}
+    for acima, item in zip(ranking, ranking[1:]):
+        par = significativos.get((acima['modelo'], item['modelo']), significativos.get((item['modelo'], acima['modelo'])))
+        item['empate_com_anterior'] = par is False
+    if ranking:
+        ranking[0]['empate_com_anterior'] = False
+
+    return comparacao
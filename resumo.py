@@ -0,0 +1,177 @@
+# resumo.py
+import hashlib
+import json
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from contexto import formatar_documento, SEPARADOR_DOCUMENTOS
+
+MODELO_RESUMO = "google/gemini-2.5-flash"
+SYSTEM_PROMPT_RESUMO = "Você é um assistente especializado em resumir textos legais. Sua tarefa é criar um resumo bem estruturado e rico do contexto fornecido, preservando todos os detalhes essenciais, dados importantes e informações chave. Não invente nada novo; use apenas o conteúdo existente. Estruture o resumo de forma clara, mantendo a riqueza do original."
+PROMPT_MAP = "Resuma o seguinte contexto: "
+PROMPT_REDUCE = "Combine os resumos parciais abaixo em um único resumo, eliminando repetições e preservando todas as normas, números de lei, datas e informações chave: "
+
+DIR_CACHE_RESUMOS = os.path.join("cache", "resumos")
+MAX_CHARS_BLOCO = 60000
+MAX_WORKERS_RESUMO = 4
+MAX_NIVEIS_REDUCE = 5
+
+# Fronteira de bloco definida pelo conteúdo: um documento cujo hash cai nesta classe encerra
+# o bloco. Assim, sequências de documentos compartilhadas entre modelos geram blocos idênticos
+# (e reaproveitam o cache) mesmo quando os documentos vizinhos diferem.
+DIVISOR_FRONTEIRA = 8
+
+
+def _hash(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _chave_documento(doc) -> str:
+    if isinstance(doc, dict):
+        return doc.get("link") or doc.get("titulo") or json.dumps(doc, sort_keys=True, ensure_ascii=False)
+    return str(doc)
+
+
+def dividir_em_blocos(documentos: list, max_chars: int = MAX_CHARS_BLOCO) -> list:
+    """Agrupa documentos (sem repetição) em blocos de até max_chars, sem quebrar documentos."""
+    vistos = set()
+    partes = []
+    for doc in documentos:
+        chave = _chave_documento(doc)
+        if chave in vistos:
+            continue
+        vistos.add(chave)
+        texto = formatar_documento(doc)
+        # Documento maior que o bloco: fatiar em pedaços do tamanho máximo
+        while len(texto) > max_chars:
+            partes.append(texto[:max_chars])
+            texto = texto[max_chars:]
+        if texto:
+            partes.append(texto)
+
+    blocos = []
+    atual = []
+    tamanho = 0
+    for parte in partes:
+        if atual and tamanho + len(SEPARADOR_DOCUMENTOS) + len(parte) > max_chars:
+            blocos.append(SEPARADOR_DOCUMENTOS.join(atual))
+            atual, tamanho = [], 0
+        atual.append(parte)
+        tamanho += len(parte) + (len(SEPARADOR_DOCUMENTOS) if len(atual) > 1 else 0)
+        if zlib.crc32(parte.encode("utf-8")) % DIVISOR_FRONTEIRA == 0:
+            blocos.append(SEPARADOR_DOCUMENTOS.join(atual))
+            atual, tamanho = [], 0
+    if atual:
+        blocos.append(SEPARADOR_DOCUMENTOS.join(atual))
+    return blocos
+
+
+def _agrupar_resumos(resumos: list, max_chars: int) -> list:
+    grupos = []
+    atual = []
+    tamanho = 0
+    for resumo in resumos:
+        if atual and tamanho + len(resumo) > max_chars:
+            grupos.append(atual)
+            atual, tamanho = [], 0
+        atual.append(resumo)
+        tamanho += len(resumo) + len(SEPARADOR_DOCUMENTOS)
+    if atual:
+        grupos.append(atual)
+    # Garantir progresso: se nenhum par coube junto, combinar de dois em dois
+    if len(grupos) == len(resumos) and len(resumos) > 1:
+        grupos = [resumos[i:i + 2] for i in range(0, len(resumos), 2)]
+    return [SEPARADOR_DOCUMENTOS.join(g) for g in grupos]
+
+
+def _caminho_cache(chave: str) -> str:
+    return os.path.join(DIR_CACHE_RESUMOS, chave[:2], f"{chave}.json")
+
+
+def _ler_cache(chave: str):
+    try:
+        with open(_caminho_cache(chave), "r", encoding="utf-8") as f:
+            return json.load(f)["resumo"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _gravar_cache(chave: str, resumo: str):
+    caminho = _caminho_cache(chave)
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump({"modelo": MODELO_RESUMO, "resumo": resumo}, f, ensure_ascii=False)
+        os.replace(temporario, caminho)
+    except OSError as e:
+        print(f"[WARN] Não foi possível gravar resumo em cache: {e}")
+
+
+def resumir_bloco(texto: str, prompt: str = PROMPT_MAP, opcoes_chamada: dict = None):
+    """Resume um bloco de texto, consultando antes o cache por hash de conteúdo."""
+    from models import chamar_openrouter
+
+    chave = _hash(MODELO_RESUMO + SYSTEM_PROMPT_RESUMO + prompt + texto)
+    resumo = _ler_cache(chave)
+    if resumo is not None:
+        return resumo, None, True
+
+    resumo, _, erro = chamar_openrouter(MODELO_RESUMO, SYSTEM_PROMPT_RESUMO, f"{prompt}{texto}", json_output=False, **(opcoes_chamada or {}))
+    if erro is None and resumo:
+        _gravar_cache(chave, resumo)
+        return resumo, None, False
+    return "", erro or "resumo_vazio", False
+
+
+def _resumir_em_paralelo(blocos: list, prompt: str, max_workers: int, opcoes_chamada: dict = None):
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(blocos)))) as executor:
+        return list(executor.map(lambda bloco: resumir_bloco(bloco, prompt, opcoes_chamada), blocos))
+
+
+def resumir_contexto(documentos, max_chars_final: int = MAX_CHARS_BLOCO, max_chars_bloco: int = MAX_CHARS_BLOCO, max_workers: int = MAX_WORKERS_RESUMO, opcoes_chamada: dict = None):
+    """Resume o contexto em map-reduce: blocos por fronteira de documento resumidos em paralelo,
+    depois combinados hierarquicamente até caber em max_chars_final.
+
+    Retorna (resumo, erro). Um resumo parcial (blocos que falharam, ou texto ainda acima de
+    max_chars_final) vem com o texto obtido e erro preenchido, para não ser guardado como definitivo.
+    """
+    if isinstance(documentos, str):
+        documentos = [documentos]
+    blocos = dividir_em_blocos(documentos, max_chars_bloco)
+    if not blocos:
+        return "", "contexto_vazio"
+
+    prompt = PROMPT_MAP
+    falhas_total = 0
+    for nivel in range(MAX_NIVEIS_REDUCE + 1):
+        print(f"[INFO] Resumo nível {nivel}: {len(blocos)} blocos ({sum(len(b) for b in blocos)} chars)")
+        resultados = _resumir_em_paralelo(blocos, prompt, max_workers, opcoes_chamada)
+        em_cache = sum(1 for _, _, cache in resultados if cache)
+        resumos = [resumo for resumo, erro, _ in resultados if erro is None]
+        falhas = len(resultados) - len(resumos)
+        print(f"[INFO] Resumo nível {nivel}: {len(resumos)} resumos ({em_cache} do cache, {falhas} falhas)")
+        if not resumos:
+            return "", resultados[0][1]
+        if falhas:
+            falhas_total += falhas
+            print(f"[WARN] Resumo nível {nivel}: {falhas} de {len(resultados)} blocos falharam - o conteúdo deles fica fora do resumo")
+
+        texto = SEPARADOR_DOCUMENTOS.join(resumos)
+        if len(texto) <= max_chars_final or len(resumos) == 1:
+            break
+
+        blocos = _agrupar_resumos(resumos, max_chars_bloco)
+        prompt = PROMPT_REDUCE
+    else:
+        print(f"[WARN] Resumo ainda excede {max_chars_final} chars após {MAX_NIVEIS_REDUCE} níveis de combinação")
+
+    if falhas_total:
+        return texto, f"resumo_parcial: {falhas_total} blocos falharam"
+    if len(texto) > max_chars_final:
+        if len(resumos) == 1:
+            print(f"[WARN] Resumo com {len(texto)} chars excede o limite de {max_chars_final}")
+        return texto, "resumo_excede_limite"
+    return texto, None
+
@@ -3,6 +3,8 @@ from bs4 import BeautifulSoup
 import urllib.parse
 import time
 import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +13,7 @@ logger = logging.getLogger(__name__)
 # 🔍 FUNÇÃO DE BUSCA NO LEXML
 # =====================================================
 BASE_URL = "https://www.lexml.gov.br/busca/search"
+AUTORIDADES = ['Federal', 'Estadual', 'Municipal', 'Distrital']
 
 
 def buscar_lexml(termo: str, pagina_inicial: int = 0, quantidade: int = 10, resultados_por_pagina: int = 10, autoridade: str = None):
@@ -30,7 +33,7 @@ def buscar_lexml(termo: str, pagina_inicial: int = 0, quantidade: int = 10, resu
         url = f"{BASE_URL}?keyword={termo_encoded}"
         
         # Adicionar filtro de autoridade se especificado
-        if autoridade and autoridade in ['Estadual', 'Federal', 'Municipal', 'Distrital']:
+        if autoridade and autoridade in AUTORIDADES:
             url += f";f1-autoridade={autoridade}"
 
         url += f";startDoc={start_doc}"
@@ -158,4 +161,74 @@ def buscar_lexml(termo: str, pagina_inicial: int = 0, quantidade: int = 10, resu
 
     logger.info(f"Busca concluída: {total_coletados} resultados, {pagina_inicial} páginas")
     print(f"Coletados: {total_coletados} resultados")
-    return resultados
\ No newline at end of file
+    return resultados
+
+
+# =====================================================
+# 🌐 BUSCA FEDERADA POR AUTORIDADE
+# =====================================================
+def interpretar_escopos(especificacoes: list) -> dict:
+    """["Federal:6", "Estadual"] -> {"Federal": 6, "Estadual": None} (None = cota padrão)."""
+    escopos = {}
+    for especificacao in especificacoes or []:
+        autoridade, _, cota = str(especificacao).partition(":")
+        autoridade = autoridade.strip().capitalize()
+        if autoridade not in AUTORIDADES:
+            raise ValueError(f"Autoridade inválida: {autoridade} (use {', '.join(AUTORIDADES)})")
+        if not cota.strip():
+            escopos[autoridade] = None
+            continue
+        try:
+            escopos[autoridade] = int(cota)
+        except ValueError:
+            raise ValueError(f"Cota inválida para {autoridade}: {cota.strip()} (use um inteiro positivo)")
+        if escopos[autoridade] <= 0:
+            raise ValueError(f"Cota inválida para {autoridade}: {escopos[autoridade]} (use um inteiro positivo)")
+    return escopos
+
+
+def buscar_lexml_federado(termo: str, escopos: dict = None, quantidade: int = 10, buscar=None):
+    """Busca o termo em cada autoridade ao mesmo tempo e junta os resultados.
+
+    escopos: {autoridade: cota}, com a cota = máximo de documentos daquela autoridade (None divide
+    quantidade igualmente). Cada escopo é buscado em uma thread, então o tempo total é o da busca
+    mais lenta. Os resultados são intercalados pela posição relativa à cota (o 1º de cada escopo,
+    depois o 2º, com escopos de cota maior avançando mais rápido) e documentos repetidos entre
+    escopos ficam só na melhor posição.
+    """
+    buscar = buscar or buscar_lexml
+    escopos = escopos or {autoridade: None for autoridade in AUTORIDADES}
+    cota_padrao = max(1, math.ceil(quantidade / len(escopos)))
+    cotas = {autoridade: cota if cota is not None else cota_padrao for autoridade, cota in escopos.items()}
+    invalidas = {autoridade: cota for autoridade, cota in cotas.items() if cota <= 0}
+    if invalidas:
+        raise ValueError(f"Cotas devem ser positivas: {invalidas}")
+
+    with ThreadPoolExecutor(max_workers=len(cotas)) as executor:
+        futuros = {autoridade: executor.submit(buscar, termo, quantidade=cota, autoridade=autoridade) for autoridade, cota in cotas.items()}
+        por_escopo = {}
+        for autoridade, futuro in futuros.items():
+            try:
+                por_escopo[autoridade] = futuro.result()[:cotas[autoridade]]
+            except Exception as e:
+                print(f"ERRO na busca federada ({autoridade}): {e}")
+                por_escopo[autoridade] = []
+
+    # Rank combinado: posição dentro do escopo dividida pela cota; empate decidido pela ordem dos escopos
+    ordem_escopo = {autoridade: k for k, autoridade in enumerate(cotas)}
+    candidatos = sorted(
+        ((posicao / cotas[autoridade], ordem_escopo[autoridade], documento)
+         for autoridade, documentos in por_escopo.items() for posicao, documento in enumerate(documentos)),
+        key=lambda item: (item[0], item[1]),
+    )
+    resultados = []
+    vistos = set()
+    for _, _, documento in candidatos:
+        chave = documento.get("link") if documento.get("link") != "Link não disponível" else documento.get("titulo")
+        if chave in vistos:
+            continue
+        vistos.add(chave)
+        resultados.append(documento)
+    contagem = ", ".join(f"{autoridade}: {len(documentos)}" for autoridade, documentos in por_escopo.items())
+    print(f"Busca federada: {len(resultados)} resultados ({contagem})")
+    return resultados
@@ -0,0 +1,72 @@
+# rouge_pt.py
+# ROUGE-N para português: tokens Unicode (o tokenizador do rouge_score descarta letras acentuadas,
+# partindo "proteção" em "prote" e "o") e stemmer Snowball português no lugar do Porter inglês.
+# Stems de cada palavra e n-gramas de cada referência ficam em memória, então a mesma referência
+# é processada uma vez por pergunta, qualquer que seja o número de respostas comparadas a ela.
+import re
+from collections import Counter
+from functools import lru_cache
+
+from nltk.stem.snowball import SnowballStemmer
+
+ORDENS = (1, 2)
+
+_stemmer = SnowballStemmer("portuguese")
+_PALAVRAS = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=100000)
+def stem(palavra: str) -> str:
+    return _stemmer.stem(palavra)
+
+
+def tokenizar(texto: str) -> list:
+    """Palavras em minúsculas, reduzidas ao stem."""
+    return [stem(palavra) for palavra in _PALAVRAS.findall((texto or "").lower())]
+
+
+def ngramas(tokens: list, n: int) -> Counter:
+    return Counter(zip(*(tokens[i:] for i in range(n))))
+
+
+def _contagens(texto: str, ordens: tuple) -> dict:
+    tokens = tokenizar(texto)
+    return {n: ngramas(tokens, n) for n in ordens}
+
+
+@lru_cache(maxsize=256)
+def preparar_referencia(texto: str, ordens: tuple = ORDENS) -> dict:
+    """{n: Counter de n-gramas} da referência, calculado uma vez por texto (não modificar o resultado)."""
+    return _contagens(texto, ordens)
+
+
+def _f1(referencia: Counter, resposta: Counter):
+    total_referencia = sum(referencia.values())
+    total_resposta = sum(resposta.values())
+    if not total_referencia or not total_resposta:
+        return 0.0, 0.0, 0.0
+    sobreposicao = sum((referencia & resposta).values())
+    precisao = sobreposicao / total_resposta
+    revocacao = sobreposicao / total_referencia
+    f1 = 2 * precisao * revocacao / (precisao + revocacao) if sobreposicao else 0.0
+    return precisao, revocacao, f1
+
+
+def pontuar_lote(referencia: str, respostas: list, ordens: tuple = ORDENS) -> list:
+    """ROUGE-N de cada resposta contra a mesma referência: [{"rouge_1_f1": ..., "rouge_1_precisao": ..., ...}]."""
+    contagens_referencia = preparar_referencia(referencia, ordens)
+    scores = []
+    for resposta in respostas:
+        contagens_resposta = _contagens(resposta, ordens)
+        score = {}
+        for n in ordens:
+            precisao, revocacao, f1 = _f1(contagens_referencia[n], contagens_resposta[n])
+            score[f"rouge_{n}_precisao"] = precisao
+            score[f"rouge_{n}_revocacao"] = revocacao
+            score[f"rouge_{n}_f1"] = f1
+        scores.append(score)
+    return scores
+
+
+def pontuar(referencia: str, resposta: str, ordens: tuple = ORDENS) -> dict:
+    return pontuar_lote(referencia, [resposta], ordens)[0]
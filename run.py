@@ -2,6 +2,35 @@
 import argparse
 import csv
 from main import run_pipeline
+import perfil
+from retriever import interpretar_escopos
+
+# Mock padrão para avaliação rápida
+MOCK_PERGUNTAS = [
+    "Quais são os direitos do consumidor no Brasil?",
+    "Como funciona o processo de aposentadoria no INSS?",
+    "Quais são as regras para abertura de empresa no Brasil?",
+    "O que é a LGPD?",
+    "Quem criou a LGPD?",
+    "Quais são as penalidades por violação da LGPD?"
+]
+MOCK_GROUND_TRUTHS = [
+    "Os direitos do consumidor incluem proteção contra práticas abusivas, garantia de produtos e serviços, direito à informação, etc., conforme o Código de Defesa do Consumidor (Lei nº 8.078/1990).",
+    "O processo de aposentadoria no INSS envolve contribuição previdenciária por pelo menos 15 anos, idade mínima de 65 anos para homens e 62 para mulheres, ou tempo de contribuição de 35 anos para homens e 30 para mulheres.",
+    "Para abertura de empresa no Brasil, é necessário registrar no CNPJ, escolher o regime tributário (Simples Nacional, Lucro Presumido, etc.), obter alvará municipal e estadual, e cumprir obrigações fiscais.",
+    "A LGPD é a Lei Geral de Proteção de Dados (Lei nº 13.709/2018), que regula o tratamento de dados pessoais no Brasil, visando proteger a privacidade dos indivíduos.",
+    "A LGPD foi criada pelo Congresso Nacional brasileiro e sancionada pelo Presidente da República em 2018.",
+    "As penalidades por violação da LGPD incluem multas de até 2% do faturamento da empresa (limitado a R$ 50 milhões por infração), além de outras sanções administrativas e civis."
+]
+
+def ler_csv_perguntas(linhas):
+    """Lê perguntas e ground truths de um CSV com colunas "pergunta" e "ground_truth" (opcional)."""
+    perguntas = []
+    ground_truths = []
+    for row in csv.DictReader(linhas):
+        perguntas.append(row['pergunta'].strip())
+        ground_truths.append((row.get('ground_truth') or '').strip())
+    return perguntas, ground_truths
 
 def main():
     parser = argparse.ArgumentParser(description="Executar pipeline de avaliação de modelos de IA para consultas jurídicas brasileiras.")
@@ -31,24 +60,6 @@ Diretrizes:
 - Se o contexto for insuficiente, indique claramente essa limitação
 - Não invente informações que não estejam no contexto"""
     
-    # Mock padrão para avaliação rápida
-    mock_perguntas = [
-        "Quais são os direitos do consumidor no Brasil?",
-        "Como funciona o processo de aposentadoria no INSS?",
-        "Quais são as regras para abertura de empresa no Brasil?",
-        "O que é a LGPD?",
-        "Quem criou a LGPD?",
-        "Quais são as penalidades por violação da LGPD?"
-    ]
-    mock_ground_truths = [
-        "Os direitos do consumidor incluem proteção contra práticas abusivas, garantia de produtos e serviços, direito à informação, etc., conforme o Código de Defesa do Consumidor (Lei nº 8.078/1990).",
-        "O processo de aposentadoria no INSS envolve contribuição previdenciária por pelo menos 15 anos, idade mínima de 65 anos para homens e 62 para mulheres, ou tempo de contribuição de 35 anos para homens e 30 para mulheres.",
-        "Para abertura de empresa no Brasil, é necessário registrar no CNPJ, escolher o regime tributário (Simples Nacional, Lucro Presumido, etc.), obter alvará municipal e estadual, e cumprir obrigações fiscais.",
-        "A LGPD é a Lei Geral de Proteção de Dados (Lei nº 13.709/2018), que regula o tratamento de dados pessoais no Brasil, visando proteger a privacidade dos indivíduos.",
-        "A LGPD foi criada pelo Congresso Nacional brasileiro e sancionada pelo Presidente da República em 2018.",
-        "As penalidades por violação da LGPD incluem multas de até 2% do faturamento da empresa (limitado a R$ 50 milhões por infração), além de outras sanções administrativas e civis."
-    ]
-    
     # Argumentos
     parser.add_argument('--perguntas', nargs='*', default=default_perguntas, help='Lista de perguntas a serem processadas (use aspas duplas para perguntas com espaços, ex: --perguntas "O que é a lei" "Outra pergunta")')
     parser.add_argument('--ground_truth', nargs='*', default=[], help='Respostas ideais opcionais para avaliação, uma por pergunta (use "" para vazio ou omita para auto-gerar)')
@@ -60,6 +71,35 @@ Diretrizes:
     parser.add_argument('--system_resposta', type=str, default=default_system_resposta, help='System prompt para geração de respostas')
     parser.add_argument('--system_resposta_file', type=str, help='Arquivo com system prompt para respostas (opcional, sobrescreve --system_resposta)')
     parser.add_argument('--modelos', nargs='+', default=['mistralai/mistral-7b-instruct', 'meta-llama/llama-3.3-70b-instruct'], help='Lista de modelos a serem comparados')
+    parser.add_argument('--lote_queries', type=int, default=0, help='Gera as queries de até K perguntas por chamada a cada modelo (0 ou 1 desativa o modo em lote)')
+    parser.add_argument('--max_chars_lote_queries', type=int, default=20000, help='Limite de caracteres das perguntas somadas em uma chamada de geração em lote')
+    parser.add_argument('--sem_dedup_queries', action='store_true', help='Desativa a deduplicação de queries equivalentes antes da busca na LexML')
+    parser.add_argument('--limiar_dedup', type=float, default=0.9, help='Similaridade de cosseno mínima (embeddings MiniLM) para considerar duas queries equivalentes')
+    parser.add_argument('--prazo_pergunta', type=float, default=None, help='Prazo total em segundos para cada pergunta (todas as chamadas de todos os modelos); padrão: sem prazo')
+    parser.add_argument('--timeout_chamada', type=float, default=300, help='Tempo máximo em segundos de cada tentativa de chamada ao OpenRouter')
+    parser.add_argument('--hedge', action='store_true', help='Dispara uma requisição duplicada quando a chamada passa do p95 de latência observado do modelo (pode cobrar em dobro)')
+    parser.add_argument('--max_concorrencia', type=int, default=16, help='Máximo de chamadas simultâneas por modelo; o limite efetivo se ajusta (AIMD) conforme os 429 do provedor')
+    parser.add_argument('--requisicoes_por_segundo', type=float, default=5.0, help='Taxa máxima de requisições por provedor (token bucket)')
+    parser.add_argument('--adaptativo', action='store_true', help='Avalia as perguntas em ordem aleatória e para assim que o teste sequencial confirmar o melhor modelo')
+    parser.add_argument('--confianca', type=float, default=0.95, help='Confiança do teste sequencial no modo adaptativo')
+    parser.add_argument('--min_perguntas', type=int, default=10, help='Mínimo de perguntas antes de permitir parada por confiança')
+    parser.add_argument('--semente', type=int, default=None, help='Semente da ordem aleatória das perguntas no modo adaptativo')
+    parser.add_argument('--orcamento_usd', type=float, default=None, help='Interrompe a execução quando o custo estimado (tokens x preços do registro) atingir este valor')
+    parser.add_argument('--orcamento_tempo', type=float, default=None, help='Interrompe a execução após este tempo total em segundos')
+    parser.add_argument('--juiz_faithfulness', type=str, default='llm', choices=['llm', 'local'], help='Juiz do faithfulness: "llm" (ragas com Gemini 2.5 Flash) ou "local" (NLI na CPU, juiz_local.py)')
+    parser.add_argument('--juiz_context_precision', type=str, default='llm', choices=['llm', 'local'], help='Juiz do context precision: "llm" (ragas com Gemini 2.5 Flash) ou "local" (NLI na CPU, juiz_local.py)')
+    parser.add_argument('--incremental', action='store_true', help='Guarda a saída de cada estágio (queries, busca, contexto, resposta, métricas) por hash das entradas e recalcula só o que mudou')
+    parser.add_argument('--simular', action='store_true', help='Não executa nada: mostra quais células do modo incremental seriam recalculadas')
+    parser.add_argument('--recalcular', nargs='+', default=[], choices=['queries', 'recuperacao', 'contexto', 'resposta', 'ground_truth', 'faithfulness', 'answer_relevancy', 'context_precision', 'rouge', 'bertscore'], help='Estágios recalculados mesmo com saída guardada (ex.: recuperacao para buscar de novo na LexML)')
+    parser.add_argument('--busca_federada', nargs='+', default=None, metavar='AUTORIDADE[:COTA]', help='Busca cada query em paralelo nas autoridades indicadas (Federal, Estadual, Municipal, Distrital), com cota opcional de documentos por autoridade (ex.: Federal:6 Estadual:2 Municipal:2)')
+    parser.add_argument('--processos_metricas', type=int, default=0, help='Avalia as respostas em N processos criados com fork depois de carregar os modelos, que compartilham os pesos com o processo principal (Linux/macOS; 0 ou 1 desativa)')
+    parser.add_argument('--backend_embeddings', type=str, default='torch', choices=['torch', 'onnx'], help='Modelo de embeddings da avaliação: PyTorch (padrão) ou ONNX int8 na CPU (requer onnxruntime; ver embeddings_onnx.py)')
+    parser.add_argument('--threads_onnx', type=int, default=None, help='Threads intra-op do onnxruntime no backend onnx (padrão: uma por núcleo)')
+    parser.add_argument('--comprimir_resultados', action='store_true', help='Grava results/resultados.json comprimido com zstd (resultados.json.zst, requer zstandard)')
+    parser.add_argument('--sobreposicao', type=int, default=0, help='Perguntas consultadas à frente enquanto a atual é avaliada (fila limitada; ex.: 2). 0 (padrão, também na interface web) mantém o modo sequencial')
+    parser.add_argument('--fila_distribuida', type=str, default=None, help='Modo distribuído: arquivo SQLite da fila (em pasta compartilhada) de onde os trabalhadores (distribuido.py) pegam as células')
+    parser.add_argument('--run_distribuido', type=str, default=None, help='Retoma um run distribuído existente (run_id) em vez de enfileirar um novo')
+    parser.add_argument('--profile', type=str, default=None, choices=['cpu', 'mem'], help='Perfil por etapa do pipeline: "cpu" (amostragem de pilhas, formato do flamegraph) ou "mem" (tracemalloc, locais que mais alocam); arquivos em results/profile/')
     parser.add_argument('--modo_contexto', type=str, default='truncar', choices=['truncar', 'resumir'], help='Modo de tratamento de contexto quando excede o limite de tokens: "truncar" (reduz regressivamente o tamanho: 100k → 50k → 28k) ou "resumir" (gera resumo com Gemini 2.5 Flash)')
     
     args = parser.parse_args()
@@ -87,18 +127,12 @@ Diretrizes:
     
     # Prioridade: quick_eval > csv_file > argumentos
     if args.quick_eval:
-        perguntas = mock_perguntas
-        ground_truths = mock_ground_truths
+        perguntas = MOCK_PERGUNTAS
+        ground_truths = MOCK_GROUND_TRUTHS
     elif args.csv_file:
-        perguntas = []
-        ground_truths = []
         try:
             with open(args.csv_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    perguntas.append(row['pergunta'].strip())
-                    gt = row.get('ground_truth', '').strip()
-                    ground_truths.append(gt if gt else None)
+                perguntas, ground_truths = ler_csv_perguntas(f)
         except Exception as e:
             print(f"Erro ao ler CSV: {e}")
             return
@@ -106,6 +140,13 @@ Diretrizes:
         perguntas = args.perguntas
         ground_truths = args.ground_truth
     
+    try:
+        busca_federada = interpretar_escopos(args.busca_federada) if args.busca_federada else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.num_queries < 1:
+        parser.error("--num_queries deve ser pelo menos 1")
+    
     # Construir config
     config = {
         'perguntas': perguntas,
@@ -116,11 +157,44 @@ Diretrizes:
             'resposta': system_resposta
         },
         'modelos': args.modelos,
-        'modo_contexto': args.modo_contexto
+        'modo_contexto': args.modo_contexto,
+        'lote_queries': args.lote_queries,
+        'max_chars_lote_queries': args.max_chars_lote_queries,
+        'dedup_queries': not args.sem_dedup_queries,
+        'limiar_dedup': args.limiar_dedup,
+        'prazo_pergunta': args.prazo_pergunta,
+        'timeout_chamada': args.timeout_chamada,
+        'hedge': args.hedge,
+        'max_concorrencia': args.max_concorrencia,
+        'requisicoes_por_segundo': args.requisicoes_por_segundo,
+        'adaptativo': args.adaptativo,
+        'confianca': args.confianca,
+        'min_perguntas': args.min_perguntas,
+        'semente': args.semente,
+        'orcamento_usd': args.orcamento_usd,
+        'orcamento_tempo': args.orcamento_tempo,
+        'juiz_faithfulness': args.juiz_faithfulness,
+        'juiz_context_precision': args.juiz_context_precision,
+        'incremental': args.incremental,
+        'simular': args.simular,
+        'recalcular': args.recalcular,
+        'busca_federada': busca_federada,
+        'processos_metricas': args.processos_metricas,
+        'backend_embeddings': args.backend_embeddings,
+        'threads_onnx': args.threads_onnx,
+        'comprimir_resultados': args.comprimir_resultados,
+        'sobreposicao': args.sobreposicao,
+        'fila_distribuida': args.fila_distribuida,
+        'run_distribuido': args.run_distribuido,
+        'profile': args.profile
     }
     
     # Executar pipeline
-    run_pipeline(config)
+    perfil.iniciar(args.profile)
+    try:
+        run_pipeline(config)
+    finally:
+        perfil.finalizar()
 
 if __name__ == "__main__":
     main()
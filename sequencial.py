@@ -0,0 +1,87 @@
+# sequencial.py
+# Teste sequencial pareado para parar a avaliação assim que o líder do ranking estiver decidido.
+#
+# Para cada par de modelos, as diferenças por pergunta do score combinado (em [-1, 1]) alimentam um
+# teste por apostas: a "riqueza" K = prod(1 + lambda_i * d_i), com lambda_i escolhido só com as
+# perguntas anteriores, é um supermartingale sob H0 (diferença média zero). Pela desigualdade de
+# Ville, P(K alguma vez >= 1/alfa) <= alfa, então o teste pode ser consultado após cada pergunta sem
+# inflar o erro, ao contrário de repetir um teste t a cada pergunta.
+import itertools
+import math
+
+CONFIANCA_PADRAO = 0.95
+MIN_PERGUNTAS_PADRAO = 10
+# Limite da aposta: com |d| <= 1, 1 + lambda * d >= 0.5 e a riqueza nunca zera
+LAMBDA_MAXIMO = 0.5
+
+
+def score_ranking(metricas: dict) -> float:
+    """Mesmo critério do ranking_modelos: média de faithfulness e answer_relevancy."""
+    return (metricas.get("faithfulness", 0.0) + metricas.get("answer_relevancy", 0.0)) / 2
+
+
+class TesteSequencialPareado:
+    def __init__(self, modelos: list, confianca: float = CONFIANCA_PADRAO, min_perguntas: int = MIN_PERGUNTAS_PADRAO):
+        self.modelos = list(modelos)
+        self.pares = list(itertools.combinations(self.modelos, 2))
+        self.min_perguntas = min_perguntas
+        # Bonferroni entre os pares; cada par é bilateral (alfa/2 para cada sentido)
+        alfa_par = (1 - confianca) / max(1, len(self.pares))
+        self.limiar_log = math.log(2 / alfa_par)
+        self.estado = {par: {"n": 0, "soma": 0.0, "soma_quadrados": 0.0, "log_k_a": 0.0, "log_k_b": 0.0} for par in self.pares}
+
+    def atualizar(self, scores: dict):
+        """Incorpora uma pergunta: scores = {modelo: score em [0, 1]}; pares incompletos são ignorados."""
+        for par in self.pares:
+            a, b = par
+            if a not in scores or b not in scores:
+                continue
+            e = self.estado[par]
+            d = max(-1.0, min(1.0, scores[a] - scores[b]))
+            # Aposta proporcional a média / segundo momento das diferenças anteriores (com um
+            # pseudo-ponto em zero para não apostar alto nas primeiras perguntas)
+            media = e["soma"] / (e["n"] + 1)
+            segundo_momento = (e["soma_quadrados"] + 0.25) / (e["n"] + 1)
+            aposta = media / segundo_momento
+            lambda_a = min(LAMBDA_MAXIMO, max(0.0, aposta))
+            lambda_b = min(LAMBDA_MAXIMO, max(0.0, -aposta))
+            e["log_k_a"] += math.log1p(lambda_a * d)
+            e["log_k_b"] += math.log1p(-lambda_b * d)
+            e["n"] += 1
+            e["soma"] += d
+            e["soma_quadrados"] += d * d
+
+    def vencedor_par(self, par):
+        """Modelo do par com vantagem confirmada, ou None."""
+        e = self.estado[par]
+        if e["n"] < self.min_perguntas:
+            return None
+        if e["log_k_a"] >= self.limiar_log:
+            return par[0]
+        if e["log_k_b"] >= self.limiar_log:
+            return par[1]
+        return None
+
+    def lider_confirmado(self):
+        """Modelo que venceu, com a confiança pedida, todos os outros; None enquanto não houver."""
+        if not self.pares:
+            return None
+        for modelo in self.modelos:
+            if all(self.vencedor_par(par) == modelo for par in self.pares if modelo in par):
+                return modelo
+        return None
+
+    def resumo(self) -> list:
+        return [
+            {
+                "modelo_a": a,
+                "modelo_b": b,
+                "perguntas": e["n"],
+                "diferenca_media": e["soma"] / e["n"] if e["n"] else None,
+                "log_evidencia_a": e["log_k_a"],
+                "log_evidencia_b": e["log_k_b"],
+                "limiar_log": self.limiar_log,
+                "vencedor": self.vencedor_par((a, b)),
+            }
+            for (a, b), e in self.estado.items()
+        ]
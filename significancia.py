@@ -0,0 +1,144 @@
+# significancia.py
+# Bootstrap pareado por pergunta: intervalos de confiança das médias de cada modelo, das diferenças
+# entre cada par de modelos e das taxas de vitória. As reamostragens são calculadas em blocos, como
+# produtos de matrizes (contagens de cada pergunta x valores por pergunta).
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# score_combinado = (faithfulness + answer_relevancy) / 2, o mesmo critério do ranking_modelos
+METRICAS = ['score_combinado', 'faithfulness', 'answer_relevancy', 'context_precision', 'rouge_1_f1', 'rouge_2_f1', 'bertscore_f1']
+REAMOSTRAGENS_PADRAO = 10000
+NIVEL_CONFIANCA = 0.95
+# Reamostragens por bloco: limita a matriz de contagens a TAMANHO_BLOCO x número de perguntas
+TAMANHO_BLOCO = 1000
+
+
+def _contagens(rng, n: int, b: int) -> np.ndarray:
+    """Matriz b x n com quantas vezes cada pergunta foi sorteada em cada reamostragem."""
+    indices = rng.integers(0, n, size=(b, n)) + (np.arange(b) * n)[:, None]
+    return np.bincount(indices.ravel(), minlength=b * n).reshape(b, n).astype(np.float32)
+
+
+def _cubo_por_pergunta(tabela: pd.DataFrame, metricas: list):
+    """Array (perguntas, modelos, métricas), NaN onde o modelo não tem resultado para a pergunta."""
+    perguntas = list(dict.fromkeys(tabela['pergunta']))
+    modelos = list(dict.fromkeys(tabela['modelo']))
+    medias = tabela.groupby(['pergunta', 'modelo'], sort=False)[metricas].mean()
+    cubo = np.full((len(perguntas), len(modelos), len(metricas)), np.nan)
+    linhas = pd.Index(perguntas).get_indexer(medias.index.get_level_values(0))
+    colunas = pd.Index(modelos).get_indexer(medias.index.get_level_values(1))
+    cubo[linhas, colunas, :] = medias.to_numpy(dtype=float)
+    return cubo, modelos
+
+
+def _media_mascarada(valores: np.ndarray, mascara: np.ndarray, pesos: np.ndarray) -> np.ndarray:
+    """Médias ponderadas de cada coluna, ignorando as posições fora da máscara."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (pesos @ valores) / (pesos @ mascara)
+
+
+def _intervalo(amostras: np.ndarray, nivel: float):
+    alfa = (1 - nivel) / 2
+    with np.errstate(invalid='ignore'):
+        return np.nanquantile(amostras, [alfa, 1 - alfa], axis=0)
+
+
+def _float(valor):
+    return None if valor is None or np.isnan(valor) else float(valor)
+
+
+def bootstrap_pareado(tabela: pd.DataFrame, metricas: list = None, reamostragens: int = REAMOSTRAGENS_PADRAO,
+                      nivel: float = NIVEL_CONFIANCA, semente: int = 0) -> dict:
+    """Reamostra as perguntas (com reposição) e recalcula, em cada reamostragem, a média de cada
+    modelo, a diferença média de cada par de modelos nas perguntas que ambos responderam e a taxa de
+    vitória (empate conta meia vitória).
+
+    tabela: uma linha por (pergunta, modelo) com as colunas das métricas (ex.: report.tabela_resultados).
+    """
+    tabela = tabela.copy()
+    if 'score_combinado' not in tabela and {'faithfulness', 'answer_relevancy'} <= set(tabela.columns):
+        tabela['score_combinado'] = (tabela['faithfulness'] + tabela['answer_relevancy']) / 2
+    metricas = [m for m in (metricas or METRICAS) if m in tabela]
+    cubo, modelos = _cubo_por_pergunta(tabela, metricas)
+    n, num_modelos, num_metricas = cubo.shape
+    pares = list(itertools.combinations(range(num_modelos), 2))
+
+    # Colunas: médias por modelo, diferenças por par e vitórias por par (cada bloco modelo/par x métrica)
+    valores_modelos = cubo.reshape(n, -1)
+    if pares:
+        a, b = np.array(pares).T
+        diferencas = (cubo[:, a, :] - cubo[:, b, :]).reshape(n, -1)
+    else:
+        diferencas = np.empty((n, 0))
+    # Perguntas sem valor para um dos modelos ficam fora da taxa de vitória (NaN é mascarado abaixo)
+    vitorias = np.where(np.isnan(diferencas), np.nan, np.where(diferencas > 0, 1.0, np.where(diferencas < 0, 0.0, 0.5)))
+    valores = np.concatenate([valores_modelos, diferencas, vitorias], axis=1)
+    mascara = ~np.isnan(valores)
+    valores_zerados = np.where(mascara, valores, 0.0).astype(np.float32)
+    mascara = mascara.astype(np.float32)
+
+    observado = _media_mascarada(valores_zerados, mascara, np.ones(n, dtype=np.float32))
+    rng = np.random.default_rng(semente)
+    amostras = np.empty((reamostragens, valores.shape[1]), dtype=np.float32)
+    for inicio in range(0, reamostragens, TAMANHO_BLOCO):
+        fim = min(inicio + TAMANHO_BLOCO, reamostragens)
+        contagens = _contagens(rng, n, fim - inicio)
+        amostras[inicio:fim] = _media_mascarada(valores_zerados, mascara, contagens)
+
+    inferior, superior = _intervalo(amostras, nivel)
+    k_modelos = num_modelos * num_metricas
+    k_pares = len(pares) * num_metricas
+
+    resultado = {
+        'reamostragens': reamostragens,
+        'nivel_confianca': nivel,
+        'semente': semente,
+        'perguntas': n,
+        'modelos': {},
+        'pares': [],
+    }
+
+    medias_boot = amostras[:, :k_modelos].reshape(reamostragens, num_modelos, num_metricas)
+    # Probabilidade de cada modelo ter a maior média, contando só reamostragens em que todos têm valor
+    validas = ~np.isnan(medias_boot).any(axis=1)
+    melhores = np.nan_to_num(medias_boot, nan=-np.inf).argmax(axis=1)
+    for i, modelo in enumerate(modelos):
+        resultado['modelos'][modelo] = {}
+        for j, metrica in enumerate(metricas):
+            coluna = i * num_metricas + j
+            total_validas = validas[:, j].sum()
+            resultado['modelos'][modelo][metrica] = {
+                'media': _float(observado[coluna]),
+                'ic_inf': _float(inferior[coluna]),
+                'ic_sup': _float(superior[coluna]),
+                'prob_melhor': float(((melhores[:, j] == i) & validas[:, j]).sum() / total_validas) if total_validas else None,
+            }
+
+    perguntas_em_comum = (~np.isnan(diferencas)).sum(axis=0)
+    boot_dif = amostras[:, k_modelos:k_modelos + k_pares]
+    validas_dif = (~np.isnan(boot_dif)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # p-valor bilateral: proporção de reamostragens do lado oposto ao zero, dobrada
+        p_valores = np.minimum(1.0, 2 * np.minimum((boot_dif <= 0).sum(axis=0), (boot_dif >= 0).sum(axis=0)) / validas_dif)
+    for p, (a, b) in enumerate(pares):
+        for j, metrica in enumerate(metricas):
+            coluna = p * num_metricas + j
+            vitoria = k_modelos + k_pares + coluna
+            ic_inf, ic_sup = _float(inferior[k_modelos + coluna]), _float(superior[k_modelos + coluna])
+            resultado['pares'].append({
+                'modelo_a': modelos[a],
+                'modelo_b': modelos[b],
+                'metrica': metrica,
+                'perguntas_em_comum': int(perguntas_em_comum[coluna]),
+                'diferenca_media': _float(observado[k_modelos + coluna]),
+                'ic_inf': ic_inf,
+                'ic_sup': ic_sup,
+                'p_valor': _float(p_valores[coluna]),
+                'taxa_vitoria_a': _float(observado[vitoria]),
+                'taxa_vitoria_a_ic_inf': _float(inferior[vitoria]),
+                'taxa_vitoria_a_ic_sup': _float(superior[vitoria]),
+                'significativo': ic_inf is not None and (ic_inf > 0 or ic_sup < 0),
+            })
+    return resultado
@@ -1,10 +1,58 @@
 import streamlit as st
-import subprocess
 import os
-import tempfile
+import sys
 import json
+import queue
+import threading
+import time
+from collections import deque
 from pathlib import Path
 
+# O pipeline grava results/ e cache/ relativos à raiz do projeto
+RAIZ_PROJETO = Path(__file__).parent.parent
+sys.path.insert(0, str(RAIZ_PROJETO))
+os.chdir(RAIZ_PROJETO)
+
+import esquema
+import progresso
+from progresso import EstadoProgresso
+
+# Só as últimas linhas do log ficam na tela; o log completo fica disponível para download
+MAX_LINHAS_LOG = 300
+INTERVALO_REDESENHO_S = 0.5
+
+
+@st.cache_resource(show_spinner="Carregando pipeline e modelos de avaliação (apenas na primeira execução)...")
+def carregar_pipeline():
+    """Importa o pipeline e carrega embeddings e BERTScore uma única vez por processo do Streamlit."""
+    from main import run_pipeline
+    import metrics
+    return {
+        "run_pipeline": run_pipeline,
+        "modelos": metrics.carregar_modelos(),
+        # Uma avaliação por vez: o pipeline usa estado global (estatísticas, limitadores)
+        "execucao": threading.Lock(),
+    }
+
+
+def executar_pipeline(ambiente, config, fila):
+    """Executa o pipeline nesta thread. O andamento chega à interface pelos eventos de progresso;
+    o sys.stdout do processo não é trocado (as saídas do pipeline continuam só no console)."""
+    import estatisticas
+    ouvinte = lambda evento: fila.put(("evento", evento))
+    erro = None
+    try:
+        progresso.adicionar_ouvinte(ouvinte)
+        estatisticas.zerar_estatisticas()
+        ambiente["run_pipeline"](config)
+    except Exception as e:
+        erro = str(e)
+    finally:
+        progresso.remover_ouvinte(ouvinte)
+        ambiente["execucao"].release()
+        fila.put(("fim", erro))
+
+
 st.set_page_config(page_title="Avaliação de Modelos Jurídicos", page_icon="⚖️")
 
 st.title("⚖️ Avaliação de Modelos de IA para Consultas Jurídicas Brasileiras")
@@ -112,82 +160,108 @@ num_queries = st.number_input("Número de Queries", min_value=1, max_value=10, v
 
 # Botão executar
 if st.button("Executar Avaliação"):
-    # Caminho absoluto para run.py
-    run_py_path = os.path.join(Path(__file__).parent.parent, 'run.py')
-    
-    # Preparar argumentos
-    args = ["python", run_py_path]
-
+    ambiente = carregar_pipeline()
+    from run import MOCK_PERGUNTAS, MOCK_GROUND_TRUTHS, ler_csv_perguntas
+
+    config = {
+        'num_queries': int(num_queries),
+        'system_prompts': {
+            'queries': system_queries,
+            'resposta': system_resposta
+        },
+        'modelos': modelos_selecionados,
+        'modo_contexto': modo_contexto,
+        # Mesmo padrão do run.py: consultas sobrepostas só quando pedidas
+        'sobreposicao': 0,
+        # Chave desta execução: não vai para os.environ, que é compartilhado por todas as sessões
+        'api_key': api_key
+    }
     if modo == "Avaliação Rápida":
-        args.append("--quick_eval")
+        config['perguntas'] = MOCK_PERGUNTAS
+        config['ground_truth'] = MOCK_GROUND_TRUTHS
     elif modo == "Perguntas Customizadas":
-        if perguntas:
-            for p in perguntas.split('\n'):
-                if p.strip():
-                    args.extend(["--perguntas", p.strip()])
+        lista_perguntas = [p.strip() for p in perguntas.split('\n') if p.strip()]
+        if lista_perguntas:
+            config['perguntas'] = lista_perguntas
         if ground_truth:
-            for gt in ground_truth.split('\n'):
-                args.extend(["--ground_truth", gt.strip() or ""])
+            config['ground_truth'] = [gt.strip() for gt in ground_truth.split('\n')]
     elif modo == "Arquivo CSV" and csv_file:
-        # Salvar temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp:
-            tmp.write(csv_file.getvalue())
-            args.extend(["--csv_file", tmp.name])
-
-    args.extend(["--num_queries", str(num_queries)])
-    
-    # Alternativa: passar como lista única
-    args.extend(["--modelos"] + modelos_selecionados)
-    args.extend(["--modo_contexto", modo_contexto])
-
-    # Tratar system prompts - usar arquivos se tiverem quebras de linha
-    if '\n' in system_queries:
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=".txt", encoding='utf-8') as tmp:
-            tmp.write(system_queries)
-            args.extend(["--system_queries_file", tmp.name])
-    else:
-        args.extend(["--system_queries", system_queries])
-    
-    if '\n' in system_resposta:
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=".txt", encoding='utf-8') as tmp:
-            tmp.write(system_resposta)
-            args.extend(["--system_resposta_file", tmp.name])
-    else:
-        args.extend(["--system_resposta", system_resposta])
-    
-    # Debug: mostrar modelos e argumentos
+        try:
+            # utf-8-sig: CSVs salvos pelo Excel começam com BOM, que colaria no nome da coluna
+            config['perguntas'], config['ground_truth'] = ler_csv_perguntas(csv_file.getvalue().decode('utf-8-sig').splitlines())
+        except KeyError as e:
+            st.error(f"O CSV precisa de uma coluna {e} (e, opcionalmente, \"ground_truth\")")
+            st.stop()
+        except UnicodeDecodeError:
+            st.error("Não foi possível ler o CSV: salve o arquivo em UTF-8")
+            st.stop()
+
+    # Debug: mostrar modelos e configuração
     st.write(f"**Modelos selecionados:** {modelos_selecionados}")
     st.write(f"**Modo de contexto:** {modo_contexto}")
-    st.write(f"**Argumentos:** {' '.join(args)}")
+    st.write(f"**Perguntas:** {len(config.get('perguntas', []))}")
 
-    # Definir API key no ambiente
-    env = os.environ.copy()
-    env['OPENAI_API_KEY'] = api_key
+    if not ambiente["execucao"].acquire(blocking=False):
+        st.warning("Já existe uma avaliação em andamento neste servidor. Aguarde ela terminar.")
+        st.stop()
 
     # Executar
     st.info("Iniciando avaliação... Isso pode levar alguns minutos.")
 
-    progress_bar = st.progress(0)
+    progress_bar = st.progress(0.0, text="Aguardando início do pipeline...")
     status_text = st.empty()
     log_area = st.empty()
 
-    logs = []
-
-    try:
-        process = subprocess.Popen(args, cwd=Path(__file__).parent.parent, env=env,
-                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                   text=True, bufsize=1, universal_newlines=True)
+    logs = deque(maxlen=MAX_LINHAS_LOG)
+    log_completo = []
+    estado = EstadoProgresso()
 
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                logs.append(output.strip())
-                log_area.code("\n".join(logs), language="text")  # Mostra todos os logs com scroll
+    def redesenhar():
+        texto = f"{estado.etapa} - {estado.concluidos}/{estado.total} (pergunta x modelo)" if estado.total else estado.etapa
+        eta = estado.eta_segundos()
+        if eta is not None:
+            texto += f" - restante estimado: {int(eta // 60)}min {int(eta % 60)}s"
+        progress_bar.progress(estado.fracao(), text=texto or "Aguardando início do pipeline...")
+        log_area.code("\n".join(logs), language="text")
 
-        progress_bar.progress(100)
-        status_text.success("Avaliação concluída! Verifique os resultados abaixo.")
+    try:
+        # O pipeline roda em uma thread; os eventos de progresso (barra e log) chegam por uma fila
+        fila = queue.Queue()
+        trabalhador = threading.Thread(target=executar_pipeline, args=(ambiente, config, fila), daemon=True)
+        trabalhador.start()
+
+        terminou = False
+        erro_execucao = None
+        ultimo_redesenho = 0.0
+        while not terminou:
+            try:
+                item = fila.get(timeout=INTERVALO_REDESENHO_S)
+                while True:
+                    tipo, valor = item
+                    if tipo == "evento":
+                        estado.aplicar(valor)
+                        linha = progresso.descrever(valor)
+                        logs.append(linha)
+                        log_completo.append(linha)
+                    else:
+                        terminou = True
+                        erro_execucao = valor
+                        break
+                    item = fila.get_nowait()
+            except queue.Empty:
+                pass
+            if terminou or time.monotonic() - ultimo_redesenho >= INTERVALO_REDESENHO_S:
+                redesenhar()
+                ultimo_redesenho = time.monotonic()
+        trabalhador.join()
+
+        estado.finalizado = True
+        redesenhar()
+        if erro_execucao:
+            st.error(f"Erro durante execução: {erro_execucao}")
+        else:
+            status_text.success("Avaliação concluída! Verifique os resultados abaixo.")
+        st.download_button("Baixar log completo", "\n".join(log_completo), file_name="execucao.log")
 
         # Exibir comparação de resultados
         st.subheader("📊 Comparação de Modelos")
@@ -201,14 +275,23 @@ if st.button("Executar Avaliação"):
             
             if ranking:
                 vencedor = ranking[0]['modelo']
-                st.success(f"🏆 **Modelo Vencedor**: {vencedor}")
+                if len(ranking) > 1 and ranking[1].get('empate_com_anterior'):
+                    st.info(f"🤝 **Empate técnico**: {vencedor} lidera, mas a diferença para {ranking[1]['modelo']} não é significativa (IC 95% do bootstrap inclui zero)")
+                else:
+                    st.success(f"🏆 **Modelo Vencedor**: {vencedor}")
             
             # Tabela de comparação
             import pandas as pd
+            posicoes = {item['modelo']: item for item in ranking}
             data = []
             for modelo, stat in stats.items():
+                item = posicoes.get(modelo, {})
+                ic = f"[{item['score_combinado_ic_inf']:.3f}, {item['score_combinado_ic_sup']:.3f}]" if item.get('score_combinado_ic_inf') is not None else "-"
                 data.append({
                     'Modelo': modelo,
+                    'Score': f"{item.get('score_combinado', 0.0):.3f}",
+                    'IC 95%': ic,
+                    'P(melhor)': f"{item['prob_melhor']:.0%}" if item.get('prob_melhor') is not None else "-",
                     'Faithfulness': f"{stat['faithfulness_media']:.3f}",
                     'Relevancy': f"{stat['answer_relevancy_media']:.3f}",
                     'Context Precision': f"{stat.get('context_precision_media', 0.0):.3f}",
@@ -219,12 +302,25 @@ if st.button("Executar Avaliação"):
             df = pd.DataFrame(data)
             st.table(df)
 
+            # Comparações par a par (bootstrap pareado nas perguntas)
+            pares = [p for p in comparacao.get('significancia', {}).get('pares', []) if p['metrica'] == 'score_combinado']
+            if pares:
+                st.subheader("⚖️ Comparação Par a Par (Score Combinado)")
+                st.table(pd.DataFrame([{
+                    'Modelo A': p['modelo_a'],
+                    'Modelo B': p['modelo_b'],
+                    'Diferença (A - B)': f"{p['diferenca_media']:.3f}" if p['diferenca_media'] is not None else "-",
+                    'IC 95%': f"[{p['ic_inf']:.3f}, {p['ic_sup']:.3f}]" if p['ic_inf'] is not None else "-",
+                    'Vitórias de A': f"{p['taxa_vitoria_a']:.0%}" if p['taxa_vitoria_a'] is not None else "-",
+                    'p-valor': f"{p['p_valor']:.3f}" if p['p_valor'] is not None else "-",
+                    'Significativo': "sim" if p['significativo'] else "não",
+                } for p in pares]))
+
             # Issues Identificados
             st.subheader("📋 Issues Identificados")
             try:
                 results_path = os.path.join(Path(__file__).parent.parent, 'results', 'resultados.json')
-                with open(results_path, 'r', encoding='utf-8') as f:
-                    resultados = json.load(f)
+                resultados = esquema.carregar(results_path)
                 
                 issues_por_modelo = {}
                 for res in resultados:
@@ -281,6 +377,7 @@ with tab2:
     - Para precisão jurídica, priorize **Faithfulness** e **Relevancy**.
     - Para eficiência, considere o **Tempo de Resposta**.
     - O **vencedor** é determinado pela combinação de Faithfulness e Relevancy.
+    - **IC 95% e P(melhor)**: obtidos por bootstrap pareado nas perguntas (10.000 reamostragens). Se o intervalo da diferença entre dois modelos inclui zero, a vantagem não é significativa com as perguntas avaliadas.
     """)
 
 st.markdown("---")